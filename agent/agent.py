@@ -2,6 +2,7 @@ import argparse
 import json
 from typing import Any
 
+import aiolimiter
 import tiktoken
 from beartype import beartype
 from beartype.door import is_bearable
@@ -11,16 +12,15 @@ from browser_env import Trajectory
 from browser_env.actions import (
     Action,
     ActionParsingError,
+    ActionTypes,
     create_id_based_action,
     create_none_action,
     create_playwright_action,
+    is_equivalent,
 )
 from browser_env.utils import Observation, StateInfo
 from llms import lm_config
-from llms.providers.openai_utils import (
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-)
+from llms.providers import PROVIDERS, get_provider
 
 
 class Agent:
@@ -110,6 +110,7 @@ class PromptAgent(Agent):
     ) -> None:
         super().__init__()
         self.lm_config = lm_config
+        self.provider = get_provider(lm_config.provider)
         self.prompt_constructor = prompt_constructor
         self.action_set_tag = action_set_tag
 
@@ -124,36 +125,74 @@ class PromptAgent(Agent):
         prompt = self.prompt_constructor.construct(
             trajectory, intent, meta_data
         )
-        lm_config = self.lm_config
-        if lm_config.provider == "openai":
-            if lm_config.mode == "chat":
-                response = generate_from_openai_chat_completion(
-                    messages=prompt,
-                    model=lm_config.model,
-                    temperature=lm_config.gen_config["temperature"],
-                    top_p=lm_config.gen_config["top_p"],
-                    context_length=lm_config.gen_config["context_length"],
-                    max_tokens=lm_config.gen_config["max_tokens"],
-                    stop_token=None,
-                )
-            elif lm_config.mode == "completion":
-                response = generate_from_openai_completion(
-                    prompt=prompt,
-                    engine=lm_config.model,
-                    temperature=lm_config.gen_config["temperature"],
-                    max_tokens=lm_config.gen_config["max_tokens"],
-                    top_p=lm_config.gen_config["top_p"],
-                    stop_token=lm_config.gen_config["stop_token"],
-                )
-            else:
-                raise ValueError(
-                    f"OpenAI models do not support mode {lm_config.mode}"
-                )
+        num_samples = self.lm_config.gen_config.get("num_samples", 1)
+        if num_samples > 1:
+            responses = self.provider.generate_n(
+                self.lm_config, prompt, num_samples
+            )
+            return self.vote(responses)
+        elif self.lm_config.gen_config.get("stream_actions", False):
+            parser = self.prompt_constructor.action_stream_parser()
+            response = self.provider.generate_stream(
+                self.lm_config, prompt, parser.feed
+            )
         else:
-            raise NotImplementedError(
-                f"Provider {lm_config.provider} not implemented"
+            response = self.provider.generate(self.lm_config, prompt)
+        return self.parse_response(response)
+
+    @beartype
+    async def anext_action(
+        self,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> Action:
+        """Async version of `next_action`, `limiter` is shared by all the
+        tasks running in the event loop"""
+        prompt = self.prompt_constructor.construct(
+            trajectory, intent, meta_data
+        )
+        num_samples = self.lm_config.gen_config.get("num_samples", 1)
+        if num_samples > 1:
+            responses = await self.provider.agenerate_n(
+                self.lm_config, prompt, limiter, num_samples
+            )
+            return self.vote(responses)
+        elif self.lm_config.gen_config.get("stream_actions", False):
+            parser = self.prompt_constructor.action_stream_parser()
+            response = await self.provider.agenerate_stream(
+                self.lm_config, prompt, limiter, parser.feed
             )
+        else:
+            response = await self.provider.agenerate(
+                self.lm_config, prompt, limiter
+            )
+        return self.parse_response(response)
 
+    @beartype
+    def vote(self, responses: list[str]) -> Action:
+        """Self-consistency: the most frequent action among the samples, two
+        actions are the same when `is_equivalent`. The unparsable samples
+        only win when no sample parses, the ties go to the earliest sample"""
+        groups: list[list[Action]] = []
+        for response in responses or [""]:
+            action = self.parse_response(response)
+            for group in groups:
+                if is_equivalent(group[0], action):
+                    group.append(action)
+                    break
+            else:
+                groups.append([action])
+        valid_groups = [
+            group
+            for group in groups
+            if group[0]["action_type"] != ActionTypes.NONE
+        ]
+        return max(valid_groups or groups, key=len)[0]
+
+    @beartype
+    def parse_response(self, response: str) -> Action:
         try:
             parsed_response = self.prompt_constructor.extract_action(response)
             if self.action_set_tag == "id_accessibility_tree":
@@ -179,13 +218,30 @@ def construct_llm_config(args: argparse.Namespace) -> lm_config.LMConfig:
     llm_config = lm_config.LMConfig(
         provider=args.provider, model=args.model, mode=args.mode
     )
-    if args.provider == "openai":
+    if args.provider in PROVIDERS:
         llm_config.gen_config["temperature"] = args.temperature
         llm_config.gen_config["top_p"] = args.top_p
         llm_config.gen_config["context_length"] = args.context_length
         llm_config.gen_config["max_tokens"] = args.max_tokens
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_truncation_mode"] = args.obs_truncation_mode
+        llm_config.gen_config["max_history_length"] = args.max_history_length
+        # the retrieved examples get the budget of the observation by default
+        llm_config.gen_config["max_retrieved_length"] = (
+            args.max_retrieved_length
+            if args.max_retrieved_length is not None
+            else args.max_obs_length
+        )
+        llm_config.gen_config["message_layout"] = args.message_layout
+        llm_config.gen_config["stream_actions"] = args.stream_actions
+        llm_config.gen_config["num_samples"] = args.num_samples
+        if args.provider == "mock":
+            llm_config.gen_config["mock_latency"] = args.mock_latency
+            llm_config.gen_config[
+                "mock_tokens_per_second"
+            ] = args.mock_tokens_per_second
+            llm_config.gen_config["mock_error_rate"] = args.mock_error_rate
     else:
         raise NotImplementedError(f"provider {args.provider} not implemented")
     return llm_config
@@ -1,21 +1,124 @@
 from __future__ import annotations
+
+import functools
 import json
+import logging
 import re
+import string
 from pathlib import Path
-from typing import Any, TypedDict
+from typing import Any, Literal, TypedDict, cast
 
 import tiktoken
 from beartype import beartype
 
+from agent.retrieval import condense_trajectory
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
 from browser_env.utils import StateInfo
 from llms import lm_config
+from llms.providers import get_provider
+
+from .sections import (
+    HistorySection,
+    ObjectiveSection,
+    ObservationSection,
+    PreviousActionSection,
+    PromptSection,
+    RetrievedExamplesSection,
+    URLSection,
+)
+from .truncation import ObservationTruncator
 
+# the prompts and responses are logged at the debug level
+logger = logging.getLogger("logger.prompt_constructor")
 
 
 APIInput = str | list[Any] | dict[str, Any]
 
+MESSAGE_LAYOUTS = ["default", "prefix_stable"]
+
+
+@beartype
+def reorder_template(template: str, volatility: dict[str, int]) -> str:
+    """Move the template sections of the values that change less often first,
+    so that consecutive prompts share the longest possible prefix.
+
+    The sections are the paragraphs separated by blank lines, or the lines when
+    the template has no blank line. A keyword starts a new block, which also
+    takes the label right above it (e.g., `OBSERVATION:`) and the sections
+    below it without keyword (e.g., a line of dashes). The sections before the
+    first keyword stay first
+    """
+
+    def section_keywords(section: str) -> set[str]:
+        return {
+            keyword
+            for _, keyword, _, _ in string.Formatter().parse(section)
+            if keyword
+        }
+
+    body = template.rstrip("\n")
+    separator = "\n\n" if "\n\n" in body else "\n"
+    blocks: list[list[str]] = [[]]
+    block_keywords: list[set[str]] = [set()]
+    for section in body.split(separator):
+        keywords = section_keywords(section)
+        if not keywords:
+            blocks[-1].append(section)
+            continue
+        label = []
+        prev_sections = blocks[-1]
+        if (
+            prev_sections
+            and not section_keywords(prev_sections[-1])
+            and prev_sections[-1].strip().endswith(":")
+        ):
+            label = [prev_sections.pop()]
+        blocks.append(label + [section])
+        block_keywords.append(keywords)
+
+    order = sorted(
+        range(1, len(blocks)),
+        key=lambda idx: max(
+            volatility.get(keyword, 3) for keyword in block_keywords[idx]
+        ),
+    )
+    sections = blocks[0] + [
+        section for idx in order for section in blocks[idx]
+    ]
+    return separator.join(sections) + template[len(body) :]
+
+
+# e.g., `OBSERVATION:` or `HISTORY (the previous actions):` starting a line
+EXAMPLE_FIELD_PATTERN = re.compile(r"^[A-Z][A-Z ]*(\(.*\))?:")
+
+
+@beartype
+def reorder_example(
+    example: str, keywords: list[str], volatility: dict[str, int]
+) -> str:
+    """Move the fields of an example observation in the order of
+    `reorder_template`, so that the examples show the same layout as the
+    current observation.
+
+    The fields start with an upper case label line, e.g., `URL: ...`, and
+    are listed in the order of the template `keywords`. An example with
+    another number of fields is left unchanged
+    """
+    fields: list[list[str]] = []
+    for line in example.split("\n"):
+        if EXAMPLE_FIELD_PATTERN.match(line) or not fields:
+            fields.append([line])
+        else:
+            fields[-1].append(line)
+    if len(fields) != len(keywords):
+        return example
+    order = sorted(
+        range(len(fields)),
+        key=lambda idx: volatility.get(keywords[idx], 3),
+    )
+    return "\n".join(line for idx in order for line in fields[idx])
+
 
 class Instruction(TypedDict):
     """Instruction for constructing prompt"""
@@ -34,21 +137,82 @@ class PromptConstructor(object):
         tokenizer: tiktoken.core.Encoding,
     ):
         self.instrction_path = Path(instruction_path)
-        self.obs_modality = "text"
+        self.obs_modality: Literal["text"] = "text"
         self.lm_config = lm_config
         instruction = json.load(open(self.instrction_path))
         instruction["examples"] = [tuple(e) for e in instruction["examples"]]
         self.instruction: Instruction = instruction
         self.tokenizer = tokenizer
+        self.obs_truncator = ObservationTruncator(
+            tokenizer, lm_config.gen_config.get("obs_truncation_mode", "token")
+        )
+        self.sections = {
+            section.name: section for section in self.build_sections()
+        }
+        # only the sections used by the template are rendered
+        template_keywords = {
+            keyword
+            for _, keyword, _, _ in string.Formatter().parse(
+                self.instruction["template"]
+            )
+            if keyword
+        }
+        missing_keywords = template_keywords - set(self.sections)
+        if missing_keywords:
+            raise ValueError(
+                f"No section for the template keywords {missing_keywords}"
+            )
+        self.template_sections = [
+            section
+            for name, section in self.sections.items()
+            if name in template_keywords
+        ]
+
+        # `prefix_stable` puts the values that change at every step last, the
+        # intro and examples are always the same prefix. The examples follow
+        # the same layout
+        self.message_layout = lm_config.gen_config.get(
+            "message_layout", "default"
+        )
+        if self.message_layout not in MESSAGE_LAYOUTS:
+            raise ValueError(f"Unknown message layout {self.message_layout}")
+        self.template = self.instruction["template"]
+        if self.message_layout == "prefix_stable":
+            volatility = {
+                name: section.volatility
+                for name, section in self.sections.items()
+            }
+            self.template = reorder_template(self.template, volatility)
+            keywords = list(
+                dict.fromkeys(
+                    keyword
+                    for _, keyword, _, _ in string.Formatter().parse(
+                        self.instruction["template"]
+                    )
+                    if keyword
+                )
+            )
+            self.instruction["examples"] = [
+                (reorder_example(x, keywords, volatility), y)
+                for x, y in self.instruction["examples"]
+            ]
+
+    def build_sections(self) -> list[PromptSection]:
+        """The sections that can fill the template"""
+        return [
+            ObjectiveSection(),
+            URLSection(),
+            ObservationSection(),
+            PreviousActionSection(),
+        ]
 
     @beartype
-    def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
-    ) -> APIInput:
-
-        """Return the require format for an API"""
+    def build_static_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> list[dict[str, str]] | str:
+        """The part of the API input before the current observation"""
         message: list[dict[str, str]] | str
-        if "openai" in self.lm_config.provider:
+        if get_provider(self.lm_config.provider).api_format == "openai":
             if self.lm_config.mode == "chat":
                 message = [{"role": "system", "content": intro}]
                 for (x, y) in examples:
@@ -66,7 +230,6 @@ class PromptConstructor(object):
                             "content": y,
                         }
                     )
-                message.append({"role": "user", "content": current})
                 return message
             elif self.lm_config.mode == "completion":
                 message = f"{intro}\n\n"
@@ -75,8 +238,7 @@ class PromptConstructor(object):
                     message += f"Observation\n:{example[0]}\n\n"
                     message += f"Action: {example[1]}\n\n"
                 message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
+                message += "Observation\n:"
                 return message
             else:
                 raise ValueError(
@@ -87,6 +249,44 @@ class PromptConstructor(object):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
+    @functools.cached_property
+    def static_prefix(self) -> list[dict[str, str]] | str:
+        """The prefix of the instruction, built once and shared by every step"""
+        return self.build_static_prefix(
+            self.instruction["intro"], self.instruction["examples"]
+        )
+
+    @functools.cached_property
+    def static_prefix_tokens(self) -> int:
+        """The tokens of the static prefix, i.e., the tokens a provider side
+        prefix cache can skip. Chat messages only count their content"""
+        if isinstance(self.static_prefix, str):
+            num_tokens = len(self.tokenizer.encode(self.static_prefix))
+        else:
+            num_tokens = sum(
+                len(self.tokenizer.encode(message["content"]))
+                for message in self.static_prefix
+            )
+        logger.info(f"[Prompt] static prefix: {num_tokens} tokens")
+        return num_tokens
+
+    @beartype
+    def get_lm_api_input(
+        self, intro: str, examples: list[tuple[str, str]], current: str
+    ) -> APIInput:
+        """Return the require format for an API"""
+        if (
+            intro == self.instruction["intro"]
+            and examples == self.instruction["examples"]
+        ):
+            prefix = self.static_prefix
+        else:
+            prefix = self.build_static_prefix(intro, examples)
+
+        if isinstance(prefix, str):
+            return f"{prefix}{current}\n\nAction:"
+        return prefix + [{"role": "user", "content": current}]
+
     @beartype
     def construct(
         self,
@@ -94,7 +294,35 @@ class PromptConstructor(object):
         intent: str,
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
-        raise NotImplementedError
+        """Construct prompt given the trajectory"""
+        intro = self.instruction["intro"]
+        examples = self.instruction["examples"]
+        template = self.template
+
+        # input x
+        current = template.format(
+            **{
+                section.name: section.render(
+                    self, trajectory, intent, meta_data
+                )
+                for section in self.template_sections
+            }
+        )
+
+        prompt = self.get_lm_api_input(intro, examples, current)
+        # logged once, when first counted
+        self.static_prefix_tokens
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[Prompt] {json.dumps(prompt, indent=2)}")
+        return prompt
+
+    @beartype
+    def truncate_observation(self, obs: str) -> str:
+        """Truncate the observation to `max_obs_length` tokens"""
+        max_obs_length = self.lm_config.gen_config["max_obs_length"]
+        if max_obs_length:
+            obs = self.obs_truncator.truncate(obs, max_obs_length)
+        return obs
 
     @beartype
     def map_url_to_real(self, url: str) -> str:
@@ -118,10 +346,43 @@ class PromptConstructor(object):
 
     @beartype
     def extract_action(self, response: str) -> str:
+        logger.debug(f"[Response] {response}")
         response = self._extract_action(response)
         response = self.map_url_to_local(response)
+        logger.debug(f"[Parsed action] {response}")
         return response
 
+    def action_stream_parser(self) -> ActionStreamParser:
+        return ActionStreamParser(self)
+
+
+class ActionStreamParser:
+    """Follow a streamed response, `feed` returns True once the response holds
+    a complete action. The action is the text between the first pair of
+    action splitters, as in `_extract_action`, so the rest of the response
+    would not change it"""
+
+    def __init__(self, constructor: PromptConstructor) -> None:
+        self.constructor = constructor
+        self.splitter = constructor.instruction["meta_data"]["action_splitter"]
+        self.response = ""
+        self.num_splitters = 0
+        self.scanned = 0
+
+    def feed(self, text: str) -> bool:
+        self.response += text
+        # a splitter may straddle two pieces of text
+        while (idx := self.response.find(self.splitter, self.scanned)) != -1:
+            self.num_splitters += 1
+            self.scanned = idx + len(self.splitter)
+        if self.num_splitters < 2:
+            return False
+        try:
+            self.constructor._extract_action(self.response)
+        except ActionParsingError:
+            return False
+        return True
+
 
 class DirectPromptConstructor(PromptConstructor):
     """The agent will direct predict the action"""
@@ -134,42 +395,6 @@ class DirectPromptConstructor(PromptConstructor):
     ):
         super().__init__(instruction_path, lm_config, tokenizer)
 
-    @beartype
-    def construct(
-        self,
-        trajectory: Trajectory,
-        intent: str,
-        meta_data: dict[str, Any] = {},
-    ) -> APIInput:
-        """Construct prompt given the trajectory"""
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
-        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
-
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
-        page = state_info["info"]["page"]
-        url = page.url
-        previous_action_str = meta_data["action_history"][-1]
-
-        # input x
-        current = template.format(
-            objective=intent,
-            url=self.map_url_to_real(url),
-            observation=obs,
-            previous_action=previous_action_str,
-        )
-
-        # make sure all keywords are replaced
-        assert all([f"{{k}}" not in current for k in keywords])
-        prompt = self.get_lm_api_input(intro, examples, current)
-        return prompt
-
     @beartype
     def _extract_action(self, response: str) -> str:
         action_splitter = self.instruction["meta_data"]["action_splitter"]
@@ -195,39 +420,6 @@ class CoTPromptConstructor(PromptConstructor):
         super().__init__(instruction_path, lm_config, tokenizer)
         self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
 
-    @beartype
-    def construct(
-        self,
-        trajectory: Trajectory,
-        intent: str,
-        meta_data: dict[str, Any] = {},
-    ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
-        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
-
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
-        page = state_info["info"]["page"]
-        url = page.url
-        previous_action_str = meta_data["action_history"][-1]
-        current = template.format(
-            objective=intent,
-            url=self.map_url_to_real(url),
-            observation=obs,
-            previous_action=previous_action_str,
-        )
-
-        assert all([f"{{k}}" not in current for k in keywords])
-
-        prompt = self.get_lm_api_input(intro, examples, current)
-        return prompt
-
     @beartype
     def _extract_action(self, response: str) -> str:
         # find the first occurence of action
@@ -242,75 +434,12 @@ class CoTPromptConstructor(PromptConstructor):
             )
 
 
-class VerbosePromptConstructor(PromptConstructor):
+class VerbosePromptConstructor(CoTPromptConstructor):
     """The agent will perform step-by-step reasoning before the answer
-    verbose
+    verbose, the prompts and responses are logged at the debug level
+    (`--log_prompts`)
     """
 
-    def __init__(
-        self,
-        instruction_path: str | Path,
-        lm_config: lm_config.LMConfig,
-        tokenizer: tiktoken.core.Encoding,
-    ):
-        super().__init__(instruction_path, lm_config, tokenizer)
-        self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
-
-    @beartype
-    def construct(
-        self,
-        trajectory: Trajectory,
-        intent: str,
-        meta_data: dict[str, Any] = {},
-    ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
-        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
-
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
-        page = state_info["info"]["page"]
-        url = page.url
-        previous_action_str = meta_data["action_history"][-1]
-        current = template.format(
-            objective=intent,
-            url=self.map_url_to_real(url),
-            observation=obs,
-            previous_action=previous_action_str,
-        )
-
-        assert all([f"{{k}}" not in current for k in keywords])
-
-        prompt = self.get_lm_api_input(intro, examples, current)
-        print('prompt \n')
-        for item in prompt:
-            print(item)
-            print('\n')
-        return prompt
-
-    @beartype
-    def _extract_action(self, response: str) -> str:
-        # find the first occurence of action
-        print('response\n')
-        print(response)
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}(.*?){action_splitter}"
-        match = re.search(pattern, response)
-        print('\n matched action \n')
-        if match:
-            print(match.group(1))
-            return match.group(1)
-        else:
-            print('cannot find answer phrase in response')
-            raise ActionParsingError(
-                f'Cannot find the answer phrase "{self.answer_phrase}" in "{response}"'
-            )
-
 
 class HistoricalPromptConstructor(VerbosePromptConstructor):
     """The agent will perform step-by-step reasoning before the answer
@@ -318,123 +447,61 @@ class HistoricalPromptConstructor(VerbosePromptConstructor):
     access to its own history
     """
 
-    def __init__(
-        self,
-        instruction_path: str | Path,
-        lm_config: lm_config.LMConfig,
-        tokenizer: tiktoken.core.Encoding,
-    ):
-        super().__init__(instruction_path, lm_config, tokenizer)
-        self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
+    def build_sections(self) -> list[PromptSection]:
+        return super().build_sections() + [
+            HistorySection(
+                self.lm_config.gen_config.get("max_history_length", 0)
+            ),
+        ]
 
     @beartype
-    def construct(
+    def construct_history(
+        self, trajectory: Trajectory, meta_data: dict[str, Any]
+    ) -> str:
+        """The full history of the task, without token budget"""
+        section = self.sections[HistorySection.name]
+        return "".join(section.items(self, trajectory, "", meta_data))
+
+    @beartype
+    def construct_condensed_history(
         self,
         trajectory: Trajectory,
-        intent: str,
-        meta_data: dict[str, Any] = {},
-    ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
-        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
-
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
-        page = state_info["info"]["page"]
-        url = page.url
-        
-        historical_actions_str = ""
-        past_states = trajectory[0::2]
-        for i, act_hist in enumerate(meta_data["action_history"]):
-            historical_actions_str += f'{i}. url:{self.map_url_to_real(past_states[i]["info"]["page"].url)} action/error: {act_hist} \n\n'
-        
-        current = template.format(
-            objective=intent,
-            url=self.map_url_to_real(url),
-            observation=obs,
-            historical_actions=historical_actions_str,
-        )
-
-        assert all([f"{{k}}" not in current for k in keywords])
-
-        prompt = self.get_lm_api_input(intro, examples, current)
-        print('prompt \n')
-        for item in prompt:
-            print(item)
-            print('\n')
-        return prompt
-
-
-class VectorDBPromptConstructor(VerbosePromptConstructor):
+        meta_data: dict[str, Any],
+        score: float,
+        summary: str = "",
+    ) -> str:
+        """The compact memory record of the task, see `condense_trajectory`"""
+        states = cast(list[StateInfo], trajectory[0::2])
+        urls = [
+            self.map_url_to_real(state["info"]["page"].url) for state in states
+        ]
+        # the first entry of the action history is the placeholder "None"
+        actions = [
+            self.map_url_to_real(action)
+            for action in meta_data["action_history"][1:]
+        ]
+        return condense_trajectory(urls, actions, score, summary=summary)
+
+
+class VectorDBPromptConstructor(HistoricalPromptConstructor):
     """The agent will perform step-by-step reasoning before the answer
-    access to its own history of state/action and previous attempts on other qns too 
+    access to its own history of state/action and previous attempts on other qns too
     """
 
-    def __init__(
-        self,
-        instruction_path: str | Path,
-        lm_config: lm_config.LMConfig,
-        tokenizer: tiktoken.core.Encoding,
-    ):
-        super().__init__(instruction_path, lm_config, tokenizer)
-        self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
-
-    def construct_history(self, trajectory, meta_data):
-        historical_actions_str = ""
-        past_states = trajectory[0::2]
-        for i, act_hist in enumerate(meta_data["action_history"]):
+    def build_sections(self) -> list[PromptSection]:
+        gen_config = self.lm_config.gen_config
+        return PromptConstructor.build_sections(self) + [
             # note: if action contains `goto [url]`, that URL is still displayed as local rather than real so need to convert
-            try:
-                historical_actions_str += f'{i}. url:{self.map_url_to_real(past_states[i]["info"]["page"].url)} action/error: {self.map_url_to_real(act_hist)} \n\n'
-            except:
-                print('action history exceeds states')
-        return historical_actions_str
-
-    @beartype
-    def construct(
-        self,
-        trajectory: Trajectory,
-        intent: str,
-        meta_data: dict[str, Any] = {},
-    ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
-        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
-
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
-        page = state_info["info"]["page"]
-        url = page.url
-        
-        historical_actions_str = self.construct_history(trajectory, meta_data)
-
-        retrieved_examples = ""
-        for i, (retrieved_intent, retrieved_score, retrieved_historical_actions_str) in enumerate(meta_data["related_intents"]):
-            retrieved_examples += f'Retrieved Example {i}. \n Retrieved intent: {retrieved_intent} \n Retrieved score: {retrieved_score} \n Retrieved history: [Start of retrieved history] {retrieved_historical_actions_str} [End of retrieved history]'
-
-        current = template.format(
-            objective=intent,
-            url=self.map_url_to_real(url),
-            observation=obs,
-            historical_actions=historical_actions_str,
-            retrieved_examples=retrieved_examples,
-        )
-
-        assert all([f"{{k}}" not in current for k in keywords])
-
-        prompt = self.get_lm_api_input(intro, examples, current)
-        print('prompt \n')
-        for item in prompt:
-            print(item)
-            print('\n')
-        return prompt
+            HistorySection(
+                gen_config.get("max_history_length", 0),
+                map_action_urls=True,
+                skip_missing_states=True,
+            ),
+            # the retrieved records get the budget of the observation by
+            # default
+            RetrievedExamplesSection(
+                gen_config.get(
+                    "max_retrieved_length", gen_config.get("max_obs_length", 0)
+                )
+            ),
+        ]
@@ -0,0 +1,202 @@
+"""The sections filling the values of a prompt template, e.g., `{observation}`"""
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any, cast
+
+from browser_env import Trajectory
+from browser_env.utils import StateInfo
+
+if TYPE_CHECKING:
+    from .prompt_constructor import PromptConstructor
+
+logger = logging.getLogger("logger.prompt_constructor")
+
+
+class PromptSection:
+    """A value of the prompt template, named after its template keyword.
+
+    The section is rendered from a list of items joined by `separator`. With a
+    token budget `max_tokens`, whole items are dropped until the section fits,
+    the oldest ones first when `keep_latest` is set, the last ones otherwise.
+    `volatility` tells how often the value changes: 0 once per task, 1 grows
+    by appending at every step, 2 replaced at every step, 3 replaced and large.
+    """
+
+    name = ""
+    separator = ""
+    keep_latest = False
+    volatility = 2
+
+    def __init__(self, max_tokens: int = 0) -> None:
+        self.max_tokens = max_tokens
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        raise NotImplementedError
+
+    def render(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> str:
+        items = self.items(constructor, trajectory, intent, meta_data)
+        if self.max_tokens:
+            items = self.fit(constructor, items)
+        return self.separator.join(items)
+
+    def fit(
+        self, constructor: PromptConstructor, items: list[str]
+    ) -> list[str]:
+        budget = self.max_tokens
+        kept: list[str] = []
+        for item in reversed(items) if self.keep_latest else items:
+            num_tokens = len(
+                constructor.tokenizer.encode(item + self.separator)
+            )
+            if num_tokens > budget:
+                break
+            budget -= num_tokens
+            kept.append(item)
+        if len(kept) < len(items):
+            logger.debug(
+                f"[Prompt] {self.name}: kept {len(kept)}/{len(items)} items"
+            )
+        return kept[::-1] if self.keep_latest else kept
+
+
+class ObjectiveSection(PromptSection):
+    name = "objective"
+    volatility = 0
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        return [intent]
+
+
+class URLSection(PromptSection):
+    name = "url"
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
+        return [constructor.map_url_to_real(state_info["info"]["page"].url)]
+
+
+class ObservationSection(PromptSection):
+    """The observation has its own line based truncation, its budget is
+    `max_obs_length`"""
+
+    name = "observation"
+    volatility = 3
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
+        return [
+            constructor.truncate_observation(
+                state_info["observation"][constructor.obs_modality]
+            )
+        ]
+
+
+class PreviousActionSection(PromptSection):
+    name = "previous_action"
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        return [meta_data["action_history"][-1]]
+
+
+class HistorySection(PromptSection):
+    """The url and the action of every past step, the latest are kept first.
+    `map_action_urls` also maps the urls inside the actions (e.g., `goto [url]`)
+    to their real world counterparts. With `skip_missing_states`, the actions
+    without a matching state are skipped instead of raising an error"""
+
+    name = "historical_actions"
+    keep_latest = True
+    volatility = 1
+
+    def __init__(
+        self,
+        max_tokens: int = 0,
+        map_action_urls: bool = False,
+        skip_missing_states: bool = False,
+    ) -> None:
+        super().__init__(max_tokens)
+        self.map_action_urls = map_action_urls
+        self.skip_missing_states = skip_missing_states
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        items = []
+        past_states = cast(list[StateInfo], trajectory[0::2])
+        for i, act_hist in enumerate(meta_data["action_history"]):
+            if self.map_action_urls:
+                act_hist = constructor.map_url_to_real(act_hist)
+            if i >= len(past_states) and self.skip_missing_states:
+                logger.warning("action history exceeds states")
+                continue
+            url = constructor.map_url_to_real(
+                past_states[i]["info"]["page"].url
+            )
+            items.append(f"{i}. url:{url} action/error: {act_hist} \n\n")
+        return items
+
+
+class RetrievedExamplesSection(PromptSection):
+    """The related tasks retrieved from the vector DB, best first"""
+
+    name = "retrieved_examples"
+    volatility = 0
+
+    def items(
+        self,
+        constructor: PromptConstructor,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+    ) -> list[str]:
+        items = []
+        for i, (
+            retrieved_intent,
+            retrieved_score,
+            retrieved_historical_actions_str,
+        ) in enumerate(meta_data["related_intents"]):
+            items.append(
+                f"Retrieved Example {i}. \n Retrieved intent: {retrieved_intent} \n Retrieved score: {retrieved_score} \n Retrieved history: [Start of retrieved history] {retrieved_historical_actions_str} [End of retrieved history]"
+            )
+        return items
@@ -0,0 +1,140 @@
+"""Truncate the observation to the token budget of the prompt"""
+import hashlib
+import re
+from collections import OrderedDict
+
+import tiktoken
+from beartype import beartype
+
+TRUNCATION_MODES = ["token", "line", "priority"]
+
+# the nodes the agent can act on, kept first when space is short
+INTERACTIVE_ROLES = [
+    "link",
+    "button",
+    "textbox",
+    "searchbox",
+    "combobox",
+    "checkbox",
+    "radio",
+    "menuitem",
+    "option",
+    "tab",
+    "switch",
+    "slider",
+    "spinbutton",
+]
+NODE_ROLE_PATTERN = re.compile(r"^\s*\[\d+\] (\S+)")
+
+
+class ObservationTruncator:
+    """Cut the observation to at most `max_obs_length` tokens.
+
+    Modes:
+        token: cut after `max_obs_length` tokens, possibly in the middle of a line
+        line: keep the first lines that fit, the lines are encoded one by one
+            until the budget is reached
+        priority: when the observation does not fit, keep the header and the
+            interactive nodes first, then the other nodes and the StaticText
+            last. The kept lines stay in their original order
+
+    The line based modes count each line with its newline separately, which
+    slightly overestimates the tokens of the joined text, so the budget is
+    never exceeded.
+    """
+
+    def __init__(
+        self,
+        tokenizer: tiktoken.core.Encoding,
+        mode: str = "line",
+        cache_size: int = 64,
+    ) -> None:
+        if mode not in TRUNCATION_MODES:
+            raise ValueError(f"Unknown truncation mode {mode}")
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple[str, int], str] = OrderedDict()
+
+    @beartype
+    def truncate(self, obs: str, max_obs_length: int) -> str:
+        # a token is at least one byte
+        if len(obs.encode("utf-8")) <= max_obs_length:
+            return obs
+
+        key = (hashlib.md5(obs.encode("utf-8")).hexdigest(), max_obs_length)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        match self.mode:
+            case "token":
+                truncated = self.truncate_tokens(obs, max_obs_length)
+            case "line":
+                truncated = self.truncate_lines(obs, max_obs_length)
+            case "priority":
+                truncated = self.truncate_priority(obs, max_obs_length)
+
+        self.cache[key] = truncated
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return truncated
+
+    def truncate_tokens(self, obs: str, max_obs_length: int) -> str:
+        return self.tokenizer.decode(
+            self.tokenizer.encode(obs)[:max_obs_length]
+        )
+
+    def count_tokens(self, line: str) -> int:
+        return len(self.tokenizer.encode(line + "\n"))
+
+    def truncate_lines(self, obs: str, max_obs_length: int) -> str:
+        lines = obs.split("\n")
+        budget = max_obs_length
+        num_lines = 0
+        for line in lines:
+            num_tokens = self.count_tokens(line)
+            if num_tokens > budget:
+                break
+            budget -= num_tokens
+            num_lines += 1
+        if num_lines == len(lines):
+            return obs
+        if num_lines == 0:
+            # not even a single line fits
+            return self.truncate_tokens(obs, max_obs_length)
+        return "\n".join(lines[:num_lines])
+
+    @staticmethod
+    def line_priority(line: str) -> int:
+        """0 for the header and interactive nodes, 1 for the other nodes and 2
+        for StaticText"""
+        match = NODE_ROLE_PATTERN.match(line)
+        if match is None:
+            return 0
+        role = match.group(1)
+        if role in INTERACTIVE_ROLES:
+            return 0
+        if role == "StaticText":
+            return 2
+        return 1
+
+    def truncate_priority(self, obs: str, max_obs_length: int) -> str:
+        lines = obs.split("\n")
+        num_tokens = [self.count_tokens(line) for line in lines]
+        if sum(num_tokens) <= max_obs_length:
+            return obs
+
+        priorities = [self.line_priority(line) for line in lines]
+        keep = [False for _ in lines]
+        budget = max_obs_length
+        for priority in range(3):
+            for idx, line in enumerate(lines):
+                if priorities[idx] != priority:
+                    continue
+                if num_tokens[idx] <= budget:
+                    keep[idx] = True
+                    budget -= num_tokens[idx]
+        if not any(keep):
+            return self.truncate_tokens(obs, max_obs_length)
+        return "\n".join(line for line, k in zip(lines, keep) if k)
@@ -0,0 +1,56 @@
+from .bm25 import BM25Index, tokenize
+from .embedders import (
+    EMBEDDERS,
+    Embedder,
+    HashingEmbedder,
+    SentenceTransformerEmbedder,
+    create_embedder,
+)
+from .index import FlatIndex
+from .memory import (
+    MEMORY_FORMATS,
+    collapse_repeats,
+    condense_action,
+    condense_trajectory,
+    summarize_trajectory,
+)
+from .store import (
+    RETRIEVAL_BACKENDS,
+    ChromaVectorStore,
+    HybridVectorStore,
+    LocalVectorStore,
+    RetrievedDocument,
+    VectorStore,
+    create_vector_store,
+    match_sites,
+    maximal_marginal_relevance,
+    parse_sites,
+    task_sites,
+)
+
+__all__ = [
+    "BM25Index",
+    "tokenize",
+    "EMBEDDERS",
+    "Embedder",
+    "HashingEmbedder",
+    "SentenceTransformerEmbedder",
+    "create_embedder",
+    "FlatIndex",
+    "MEMORY_FORMATS",
+    "collapse_repeats",
+    "condense_action",
+    "condense_trajectory",
+    "summarize_trajectory",
+    "RETRIEVAL_BACKENDS",
+    "ChromaVectorStore",
+    "HybridVectorStore",
+    "LocalVectorStore",
+    "RetrievedDocument",
+    "VectorStore",
+    "create_vector_store",
+    "match_sites",
+    "maximal_marginal_relevance",
+    "parse_sites",
+    "task_sites",
+]
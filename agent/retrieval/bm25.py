@@ -0,0 +1,68 @@
+"""An in-memory BM25 inverted index over short texts, e.g., the task intents"""
+import math
+from collections import Counter, defaultdict
+
+import numpy as np
+import numpy.typing as npt
+
+from .embedders import WORD_PATTERN
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25, `k1` saturates the term frequencies and `b` normalizes by
+    the document length. The documents are only appended, the rows are the
+    ones of the vector index"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        # term -> the rows containing it and the term frequencies
+        self.postings: dict[str, tuple[list[int], list[int]]] = defaultdict(
+            lambda: ([], [])
+        )
+        self.doc_lengths: list[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, texts: list[str]) -> None:
+        for text in texts:
+            row = len(self.doc_lengths)
+            terms = tokenize(text)
+            for term, tf in Counter(terms).items():
+                rows, tfs = self.postings[term]
+                rows.append(row)
+                tfs.append(tf)
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+
+    def scores(self, query: str) -> npt.NDArray[np.float32]:
+        """The BM25 score of every row, zero without a common term"""
+        num_docs = len(self.doc_lengths)
+        scores = np.zeros(num_docs, dtype=np.float32)
+        if not num_docs:
+            return scores
+        avg_length = max(self.total_length / num_docs, 1.0)
+        doc_lengths = np.asarray(self.doc_lengths, dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, tfs = self.postings[term]
+            idf = math.log(
+                1 + (num_docs - len(rows) + 0.5) / (len(rows) + 0.5)
+            )
+            rows_array = np.asarray(rows)
+            tfs_array = np.asarray(tfs, dtype=np.float32)
+            scores[rows_array] += (
+                idf
+                * tfs_array
+                * (self.k1 + 1)
+                / (tfs_array + norms[rows_array])
+            )
+        return scores
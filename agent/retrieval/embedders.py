@@ -0,0 +1,95 @@
+"""Embed the task intents into unit vectors, without network access"""
+import re
+import zlib
+
+import numpy as np
+import numpy.typing as npt
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class Embedder:
+    """Embed texts into float32 vectors of norm 1, so that the inner product
+    is the cosine similarity. `name` identifies the embedding space, an index
+    built with an embedder can only be queried with the same one"""
+
+    name = ""
+    dim = 0
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        raise NotImplementedError
+
+
+def normalize(vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    normalized: npt.NDArray[np.float32] = vectors / norms
+    return normalized
+
+
+class HashingEmbedder(Embedder):
+    """Bag of word unigrams, word bigrams and character trigrams, hashed into
+    `dim` buckets with a random sign. The term frequencies are dampened with
+    log(1 + tf). The hash is crc32, which, unlike `hash`, is the same in every
+    process"""
+
+    def __init__(self, dim: int = 1024) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def features(text: str) -> list[str]:
+        words = WORD_PATTERN.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            features += [
+                f"c:{padded[idx : idx + 3]}" for idx in range(len(padded) - 2)
+            ]
+        return features
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dim] += sign
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """A local CPU model of the sentence-transformers package, which is not
+    a requirement of the repo"""
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2") -> None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The sentence_transformer embedder needs `pip install sentence-transformers`"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence_transformer-{model_name}"
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        vectors = self.model.encode(
+            texts, batch_size=64, convert_to_numpy=True
+        ).astype(np.float32)
+        return normalize(vectors)
+
+
+EMBEDDERS = ["hashing", "sentence_transformer"]
+
+
+def create_embedder(name: str) -> Embedder:
+    match name:
+        case "hashing":
+            return HashingEmbedder()
+        case "sentence_transformer":
+            return SentenceTransformerEmbedder()
+        case _:
+            raise ValueError(f"Unknown embedder {name}")
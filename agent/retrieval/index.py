@@ -0,0 +1,110 @@
+"""A flat inner product index persisted as a memory-mapped file.
+
+The index directory holds:
+    index.json: the embedder name and the dimension
+    vectors.f32: the float32 vectors, one row per document
+    docs.jsonl: the text and the metadata of each document
+
+The documents are only appended, under a file lock, so several processes can
+share an index: each one picks up the rows added by the others on its next
+query.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from filelock import FileLock
+
+
+class FlatIndex:
+    def __init__(self, index_dir: str | Path, embedder_name: str, dim: int):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.index_dir / "vectors.f32"
+        self.docs_path = self.index_dir / "docs.jsonl"
+        self.lock = FileLock(str(self.index_dir / "index.lock"))
+        self.dim = dim
+
+        header_path = self.index_dir / "index.json"
+        with self.lock:
+            if header_path.exists():
+                with open(header_path) as f:
+                    header = json.load(f)
+                if header != {"embedder": embedder_name, "dim": dim}:
+                    raise ValueError(
+                        f"The index in {index_dir} was built with {header}, not {embedder_name}"
+                    )
+            else:
+                with open(header_path, "w") as f:
+                    json.dump({"embedder": embedder_name, "dim": dim}, f)
+
+        self.vectors: npt.NDArray[np.float32] = np.zeros(
+            (0, dim), dtype=np.float32
+        )
+        self.docs: list[dict[str, Any]] = []
+        self.docs_offset = 0
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Load the rows appended since the last refresh"""
+        if self.docs_path.exists():
+            with open(self.docs_path, "rb") as f:
+                f.seek(self.docs_offset)
+                for line in f:
+                    # a line is complete once its newline is written
+                    if not line.endswith(b"\n"):
+                        break
+                    self.docs.append(json.loads(line))
+                    self.docs_offset += len(line)
+
+        if self.vectors_path.exists():
+            num_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            if num_rows != len(self.vectors):
+                self.vectors = np.memmap(
+                    self.vectors_path,
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(num_rows, self.dim),
+                )
+
+    def __len__(self) -> int:
+        return min(len(self.docs), len(self.vectors))
+
+    def add(
+        self,
+        vectors: npt.NDArray[np.float32],
+        texts: list[str],
+        metadatas: list[dict[str, Any]],
+    ) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        assert vectors.shape == (len(texts), self.dim)
+        with self.lock:
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.docs_path, "a") as f:
+                for text, metadata in zip(texts, metadatas):
+                    f.write(
+                        json.dumps({"text": text, "metadata": metadata}) + "\n"
+                    )
+        self.refresh()
+
+    def search(
+        self, query: npt.NDArray[np.float32], k: int
+    ) -> list[tuple[int, float]]:
+        """The (row, inner product) of the `k` closest rows, best first"""
+        self.refresh()
+        num_rows = len(self)
+        k = min(k, num_rows)
+        if k <= 0:
+            return []
+        scores = self.vectors[:num_rows] @ query.reshape(-1)
+        if k < num_rows:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(num_rows)
+        # stable, the earlier rows first among equal scores
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(row), float(scores[row])) for row in top]
@@ -0,0 +1,111 @@
+"""Condense a finished trajectory into a compact memory record.
+
+The raw history of a task repeats the url and the full action description at
+every step, the record keeps what transfers to a related task:
+    Outcome: the score and the number of steps
+    Pages: the visited urls, consecutive duplicates collapsed
+    Actions: the actions without the element ids, consecutive repeats collapsed
+    Summary: optionally, a one-off LLM summary of the above
+"""
+import dataclasses
+import re
+from typing import Any
+
+from llms import lm_config
+from llms.providers import get_provider
+
+MEMORY_FORMATS = ["raw", "condensed"]
+
+# the element ids of a page are meaningless for another task
+ELEMENT_ID_PATTERN = re.compile(
+    r"^(click|type|hover) \[\d+\] (.*?)where \[\d+\] is "
+)
+INVALID_FORMAT_PREFIX = "The previous prediction you issued was"
+MISSING_ELEMENT_PATTERN = re.compile(
+    r'^Attempt to perfom "(\w+)" on element "\[\d+\]" but no matching element found'
+)
+
+SUMMARY_INSTRUCTION = (
+    "Summarize, in at most three sentences, how the following web task was "
+    "attempted and what a later attempt on a similar task should do or avoid."
+)
+
+
+def condense_action(action: str) -> str:
+    if action.startswith(INVALID_FORMAT_PREFIX):
+        return "invalid action"
+    if match := MISSING_ELEMENT_PATTERN.match(action):
+        return f"{match.group(1)} a missing element"
+    action = ELEMENT_ID_PATTERN.sub(r"\1 \2", action)
+    return " ".join(action.split())
+
+
+def collapse_repeats(items: list[str]) -> list[tuple[str, int]]:
+    """The runs of consecutive equal items, with their lengths"""
+    runs: list[tuple[str, int]] = []
+    for item in items:
+        if runs and runs[-1][0] == item:
+            runs[-1] = (item, runs[-1][1] + 1)
+        else:
+            runs.append((item, 1))
+    return runs
+
+
+def condense_trajectory(
+    urls: list[str],
+    actions: list[str],
+    score: float,
+    max_actions: int = 20,
+    summary: str = "",
+) -> str:
+    """The memory record of a task, `max_actions` keeps the first and the
+    last action runs"""
+    outcome = "PASS" if score == 1 else "FAIL"
+    lines = [f"Outcome: {outcome} (score {score}) in {len(actions)} steps"]
+
+    pages = [url for url, _ in collapse_repeats(urls)]
+    if pages:
+        lines.append("Pages: " + " -> ".join(pages))
+
+    runs = [
+        f"{action} (x{count})" if count > 1 else action
+        for action, count in collapse_repeats(
+            [condense_action(action) for action in actions]
+        )
+    ]
+    if max_actions and len(runs) > max_actions:
+        num_head = max_actions // 2
+        num_tail = max_actions - num_head
+        runs = (
+            runs[:num_head]
+            + [f"... {len(runs) - max_actions} more ..."]
+            + runs[len(runs) - num_tail :]
+        )
+    if runs:
+        lines.append(
+            "Actions: "
+            + "; ".join(f"{i}. {run}" for i, run in enumerate(runs, 1))
+        )
+
+    if summary:
+        lines.append(f"Summary: {' '.join(summary.split())}")
+    return "\n".join(lines)
+
+
+def summarize_trajectory(
+    config: lm_config.LMConfig, intent: str, record: str
+) -> str:
+    """A short LLM summary of a record, generated once when the task is
+    stored, the response cache (`--response_cache`) keeps it across runs.
+    It is generated greedily, the sampled requests are not cached"""
+    content = f"{SUMMARY_INSTRUCTION}\n\nTask: {intent}\n{record}"
+    prompt: Any
+    if config.mode == "chat":
+        prompt = [{"role": "user", "content": content}]
+    else:
+        prompt = f"{content}\nSummary:"
+    config = dataclasses.replace(
+        config, gen_config={**config.gen_config, "temperature": 0.0}
+    )
+    provider = get_provider(config.provider)
+    return provider.generate(config, prompt).strip()
@@ -0,0 +1,316 @@
+"""The stores of the finished tasks, searched by intent"""
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from .bm25 import BM25Index
+from .embedders import Embedder, create_embedder
+from .index import FlatIndex
+
+RETRIEVAL_BACKENDS = ["hybrid", "local", "chroma"]
+SITE_PLACEHOLDER_PATTERN = re.compile(r"__([A-Z_]+)__")
+
+
+@dataclass
+class RetrievedDocument:
+    """Named as the langchain documents, `similarity` is higher for closer
+    documents"""
+
+    page_content: str
+    metadata: dict[str, Any]
+    similarity: float
+
+
+def task_sites(config: dict[str, Any]) -> list[str]:
+    """The sites of a task config, its `sites` or else the site placeholders
+    of its `start_url`, e.g., `__GITLAB__`"""
+    if config.get("sites"):
+        return sorted(config["sites"])
+    return sorted(
+        {
+            site.lower()
+            for site in SITE_PLACEHOLDER_PATTERN.findall(
+                config.get("start_url") or ""
+            )
+        }
+    )
+
+
+def parse_sites(metadata: dict[str, Any]) -> frozenset[str]:
+    """The sites are stored comma separated, as Chroma only takes scalar
+    metadata"""
+    return frozenset(filter(None, (metadata.get("sites") or "").split(",")))
+
+
+def match_sites(doc_sites: frozenset[str], sites: list[str] | None) -> bool:
+    """Whether a document shares a site with the query, the documents
+    without sites match every query"""
+    return not sites or not doc_sites or not doc_sites.isdisjoint(sites)
+
+
+class VectorStore:
+    def add_texts(
+        self, texts: list[str], metadatas: list[dict[str, Any]]
+    ) -> None:
+        raise NotImplementedError
+
+    def similarity_search(
+        self, query: str, k: int, sites: list[str] | None = None
+    ) -> list[RetrievedDocument]:
+        """The `k` documents closest to `query`, best first, among the ones
+        sharing one of `sites`"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def pre_embed(self, texts: list[str]) -> None:
+        """Embed the future queries in one batch, e.g., all the intents of a
+        run"""
+
+    def documents(self) -> list[tuple[str, dict[str, Any]]]:
+        """The text and the metadata of every stored document"""
+        raise NotImplementedError
+
+
+class LocalVectorStore(VectorStore):
+    """Embed locally and search a FlatIndex, the query embeddings are kept in
+    memory"""
+
+    def __init__(self, persist_directory: str | Path, embedder: Embedder):
+        self.embedder = embedder
+        self.index = FlatIndex(persist_directory, embedder.name, embedder.dim)
+        self.embeddings: dict[str, npt.NDArray[np.float32]] = {}
+
+    def pre_embed(self, texts: list[str]) -> None:
+        texts = list(
+            dict.fromkeys(t for t in texts if t not in self.embeddings)
+        )
+        if texts:
+            vectors = self.embedder.embed(texts)
+            self.embeddings.update(zip(texts, vectors))
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        self.pre_embed(texts)
+        return np.stack([self.embeddings[text] for text in texts])
+
+    def add_texts(
+        self, texts: list[str], metadatas: list[dict[str, Any]]
+    ) -> None:
+        self.index.add(self.embed(texts), texts, metadatas)
+
+    def similarity_search(
+        self, query: str, k: int, sites: list[str] | None = None
+    ) -> list[RetrievedDocument]:
+        query_vector = self.embed([query])[0]
+        if sites:
+            results = [
+                (row, similarity)
+                for row, similarity in self.index.search(
+                    query_vector, self.count()
+                )
+                if match_sites(
+                    parse_sites(self.index.docs[row]["metadata"]), sites
+                )
+            ][:k]
+        else:
+            results = self.index.search(query_vector, k)
+        return [
+            RetrievedDocument(
+                self.index.docs[row]["text"],
+                self.index.docs[row]["metadata"],
+                similarity,
+            )
+            for row, similarity in results
+        ]
+
+    def count(self) -> int:
+        self.index.refresh()
+        return len(self.index)
+
+    def documents(self) -> list[tuple[str, dict[str, Any]]]:
+        return [
+            (doc["text"], doc["metadata"])
+            for doc in self.index.docs[: self.count()]
+        ]
+
+
+def maximal_marginal_relevance(
+    vectors: npt.NDArray[np.float32],
+    relevance: npt.NDArray[np.float32],
+    k: int,
+    mmr_lambda: float,
+) -> list[int]:
+    """Greedily pick `k` items, each one maximizing
+    `mmr_lambda * relevance - (1 - mmr_lambda) * similarity`, where the
+    similarity is the highest cosine similarity to the items already picked"""
+    scores = relevance.astype(np.float32)
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    selected: list[int] = []
+    for _ in range(min(k, len(relevance))):
+        mmr = mmr_lambda * scores - (1 - mmr_lambda) * max_similarity
+        mmr[selected] = -np.inf
+        idx = int(np.argmax(mmr))
+        selected.append(idx)
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[idx])
+    return selected
+
+
+class HybridVectorStore(LocalVectorStore):
+    """Rank the documents by a mix of the cosine similarity of the
+    embeddings and the BM25 score of the texts, normalized by the best one,
+    plus `success_weight` times the score of the stored task. The best
+    `num_candidates` are then reranked with maximal marginal relevance, so
+    that the retrieved examples are not the same task over and over.
+
+    The BM25 index is rebuilt in memory from the shared vector index, so it
+    follows the documents added by the other processes too.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str | Path,
+        embedder: Embedder,
+        vector_weight: float = 0.5,
+        success_weight: float = 0.1,
+        mmr_lambda: float = 0.9,
+        num_candidates: int = 50,
+    ):
+        super().__init__(persist_directory, embedder)
+        self.vector_weight = vector_weight
+        self.success_weight = success_weight
+        self.mmr_lambda = mmr_lambda
+        self.num_candidates = num_candidates
+        self.lexical = BM25Index()
+        self.successes: list[float] = []
+        self.sites: list[frozenset[str]] = []
+
+    def sync(self) -> int:
+        """Index the rows added since the last sync, by any process"""
+        self.index.refresh()
+        num_rows = len(self.index)
+        docs = self.index.docs[len(self.lexical) : num_rows]
+        self.lexical.add([doc["text"] for doc in docs])
+        for doc in docs:
+            score = doc["metadata"].get("score") or 0.0
+            # a missing or NaN score counts as a failure
+            self.successes.append(float(score) if score == score else 0.0)
+            self.sites.append(parse_sites(doc["metadata"]))
+        return num_rows
+
+    def relevance(self, query: str, num_rows: int) -> npt.NDArray[np.float32]:
+        semantic = self.index.vectors[:num_rows] @ self.embed([query])[0]
+        lexical = self.lexical.scores(query)[:num_rows]
+        if num_rows and lexical.max() > 0:
+            lexical /= lexical.max()
+        successes = np.asarray(self.successes[:num_rows], dtype=np.float32)
+        relevance: npt.NDArray[np.float32] = (
+            self.vector_weight * semantic
+            + (1 - self.vector_weight) * lexical
+            + self.success_weight * successes
+        )
+        return relevance
+
+    def count(self) -> int:
+        return self.sync()
+
+    def similarity_search(
+        self, query: str, k: int, sites: list[str] | None = None
+    ) -> list[RetrievedDocument]:
+        num_rows = self.sync()
+        relevance = self.relevance(query, num_rows)
+        rows = np.array(
+            [
+                row
+                for row in range(num_rows)
+                if match_sites(self.sites[row], sites)
+            ],
+            dtype=np.int64,
+        )
+        if k <= 0 or not len(rows):
+            return []
+        # stable, the earlier rows first among equal scores
+        candidates = rows[np.argsort(-relevance[rows], kind="stable")]
+        candidates = candidates[: max(self.num_candidates, k)]
+        selected = maximal_marginal_relevance(
+            np.asarray(self.index.vectors[candidates]),
+            relevance[candidates],
+            k,
+            self.mmr_lambda,
+        )
+        return [
+            RetrievedDocument(
+                self.index.docs[row]["text"],
+                self.index.docs[row]["metadata"],
+                float(relevance[row]),
+            )
+            for row in candidates[selected]
+        ]
+
+
+class ChromaVectorStore(VectorStore):
+    """The original Chroma store with the OpenAI embeddings"""
+
+    def __init__(self, persist_directory: str | Path):
+        from langchain.embeddings.openai import OpenAIEmbeddings
+        from langchain.vectorstores import Chroma
+
+        self.vectordb = Chroma(
+            collection_name="tasks",
+            embedding_function=OpenAIEmbeddings(),
+            persist_directory=str(persist_directory),
+        )
+
+    def add_texts(
+        self, texts: list[str], metadatas: list[dict[str, Any]]
+    ) -> None:
+        self.vectordb.add_texts(texts=texts, metadatas=metadatas)
+
+    def similarity_search(
+        self, query: str, k: int, sites: list[str] | None = None
+    ) -> list[RetrievedDocument]:
+        # the site filter is applied on an over-fetched result
+        docs = [
+            RetrievedDocument(doc.page_content, doc.metadata, -distance)
+            for doc, distance in self.vectordb.similarity_search_with_score(
+                query, k=k * 4 if sites else k
+            )
+        ]
+        return [
+            doc
+            for doc in docs
+            if match_sites(parse_sites(doc.metadata), sites)
+        ][:k]
+
+    def count(self) -> int:
+        return int(self.vectordb._collection.count())
+
+    def documents(self) -> list[tuple[str, dict[str, Any]]]:
+        docs = self.vectordb.get()
+        return list(zip(docs["documents"], docs["metadatas"]))
+
+
+def create_vector_store(
+    backend: str,
+    persist_directory: str | Path,
+    embedder: str = "hashing",
+    **kwargs: Any,
+) -> VectorStore:
+    """`kwargs` are the options of the hybrid backend"""
+    match backend:
+        case "hybrid":
+            return HybridVectorStore(
+                persist_directory, create_embedder(embedder), **kwargs
+            )
+        case "local":
+            return LocalVectorStore(
+                persist_directory, create_embedder(embedder)
+            )
+        case "chroma":
+            return ChromaVectorStore(persist_directory)
+        case _:
+            raise ValueError(f"Unknown retrieval backend {backend}")
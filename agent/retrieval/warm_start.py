@@ -0,0 +1,226 @@
+"""Warm start a vector store with the finished tasks of earlier runs.
+
+A result directory of run.py holds the finished tasks in up to three places:
+    vector_index/: the index of the local and hybrid backends
+    vectordb/: the Chroma store (needs `langchain` and `chromadb`)
+    logged_results.csv and render_*.html: the score and the rendered
+        trajectory of every task, also of the runs without retrieval
+
+The tasks are deduplicated by `task_id` and by intent, the best scored one
+first, then the first directory first, and the ones already in the store are
+skipped. The rest is added in one batch, so embedded in one pass.
+
+Usage:
+    python -m agent.retrieval.warm_start --result_dir new_run old_run_1 old_run_2
+"""
+import argparse
+import ast
+import csv
+import html
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any
+
+from browser_env.env_config import URL_MAPPINGS
+
+from .embedders import EMBEDDERS
+from .index import FlatIndex
+from .memory import condense_trajectory
+from .store import (
+    RETRIEVAL_BACKENDS,
+    VectorStore,
+    create_vector_store,
+    task_sites,
+)
+
+logger = logging.getLogger("logger")
+
+Document = tuple[str, dict[str, Any]]
+
+RENDER_URL_PATTERN = re.compile(r"<h3 class='url'><a href=(.*?)>URL: ")
+RENDER_ACTION_PATTERN = re.compile(
+    r"<div class='parsed_action'[^>]*><pre>(.*?)</pre></div>", re.DOTALL
+)
+# the rendered action repeats the element id before the element
+RENDER_ELEMENT_PATTERN = re.compile(r"where \[(\d+)\] is \[\1\] ")
+
+
+def map_url_to_real(url: str) -> str:
+    """As `PromptConstructor.map_url_to_real`, the rendered urls are local"""
+    for local, real in URL_MAPPINGS.items():
+        if local in url:
+            url = url.replace(local, real)
+    return url
+
+
+def load_scores(result_dir: Path) -> dict[int, float]:
+    """The scores of `logged_results.csv`, without the unfinished tasks"""
+    scores: dict[int, float] = {}
+    path = result_dir / "logged_results.csv"
+    if not path.exists():
+        return scores
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            if row.get("score"):
+                scores[int(row[""])] = float(row["score"])
+    return scores
+
+
+def parse_render(render: str) -> tuple[dict[str, Any], list[str], list[str]]:
+    """The task config, the urls and the actions of a rendered trajectory"""
+    config: dict[str, Any] = {}
+    header = re.search(r"<pre>(.*?)</pre>", render, re.DOTALL)
+    for line in header.group(1).splitlines() if header else []:
+        key, _, value = line.partition(": ")
+        if key in ("intent", "start_url"):
+            config[key] = value
+        elif key in ("task_id", "sites"):
+            config[key] = ast.literal_eval(value)
+    urls = [map_url_to_real(url) for url in RENDER_URL_PATTERN.findall(render)]
+    actions = [
+        map_url_to_real(
+            RENDER_ELEMENT_PATTERN.sub(
+                r"where [\1] is ", html.unescape(action)
+            )
+        )
+        for action in RENDER_ACTION_PATTERN.findall(render)
+    ]
+    return config, urls, actions
+
+
+def load_render_documents(result_dir: Path) -> list[Document]:
+    """The condensed records of the rendered trajectories of the scored
+    tasks"""
+    scores = load_scores(result_dir)
+    documents = []
+    for path in sorted(result_dir.glob("render_*.html")):
+        with open(path) as f:
+            config, urls, actions = parse_render(f.read())
+        if "intent" not in config or config.get("task_id") not in scores:
+            continue
+        score = scores[config["task_id"]]
+        documents.append(
+            (
+                config["intent"],
+                {
+                    "score": score,
+                    "task_id": config["task_id"],
+                    "sites": ",".join(task_sites(config)),
+                    "historical_actions_str": condense_trajectory(
+                        urls, actions, score
+                    ),
+                },
+            )
+        )
+    return documents
+
+
+def load_documents(result_dir: str | Path) -> list[Document]:
+    """The finished tasks of a result directory, the stored ones first"""
+    result_dir = Path(result_dir)
+    documents: list[Document] = []
+
+    header_path = result_dir / "vector_index" / "index.json"
+    if header_path.exists():
+        with open(header_path) as f:
+            header = json.load(f)
+        index = FlatIndex(
+            result_dir / "vector_index", header["embedder"], header["dim"]
+        )
+        documents += [
+            (doc["text"], doc["metadata"]) for doc in index.docs[: len(index)]
+        ]
+
+    if (result_dir / "vectordb").exists():
+        try:
+            documents += create_vector_store(
+                "chroma", result_dir / "vectordb"
+            ).documents()
+        except ImportError as e:
+            logger.warning(f"[Warm start] skip {result_dir}/vectordb: {e}")
+
+    documents += load_render_documents(result_dir)
+    return documents
+
+
+def dedupe_documents(documents: list[Document]) -> list[Document]:
+    """One document per task id and per intent, the best scored one, then
+    the first one"""
+
+    def score(document: Document) -> float:
+        value = document[1].get("score") or 0.0
+        # NaN for the tasks without a score
+        return float(value) if value == value else 0.0
+
+    task_ids: set[Any] = set()
+    intents: set[str] = set()
+    deduped = []
+    for text, metadata in sorted(documents, key=score, reverse=True):
+        task_id = metadata.get("task_id")
+        if text in intents or (task_id is not None and task_id in task_ids):
+            continue
+        intents.add(text)
+        task_ids.add(task_id)
+        deduped.append((text, metadata))
+    return deduped
+
+
+def warm_start(
+    vectordb: VectorStore, result_dirs: list[str] | list[Path]
+) -> int:
+    """Add the finished tasks of `result_dirs` to `vectordb`, returns the
+    number of added documents"""
+    stored = vectordb.documents()
+    documents = dedupe_documents(
+        [
+            doc
+            for result_dir in result_dirs
+            for doc in load_documents(result_dir)
+        ]
+    )
+    stored_task_ids = {metadata.get("task_id") for _, metadata in stored}
+    stored_intents = {text for text, _ in stored}
+    documents = [
+        (text, metadata)
+        for text, metadata in documents
+        if text not in stored_intents
+        and metadata.get("task_id") not in stored_task_ids
+    ]
+    if documents:
+        texts, metadatas = zip(*documents)
+        vectordb.add_texts(list(texts), list(metadatas))
+    logger.info(
+        f"[Warm start] added {len(documents)} tasks from {len(result_dirs)} result directories"
+    )
+    return len(documents)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--result_dir", required=True)
+    parser.add_argument("result_dirs", nargs="+")
+    parser.add_argument(
+        "--retrieval_backend", choices=RETRIEVAL_BACKENDS, default="hybrid"
+    )
+    parser.add_argument(
+        "--retrieval_embedder", choices=EMBEDDERS, default="hashing"
+    )
+    args = parser.parse_args()
+
+    if args.retrieval_backend == "chroma":
+        persist_directory = f"{args.result_dir}/vectordb"
+    else:
+        persist_directory = f"{args.result_dir}/vector_index"
+    vectordb = create_vector_store(
+        args.retrieval_backend, persist_directory, args.retrieval_embedder
+    )
+    num_added = warm_start(vectordb, args.result_dirs)
+    print(
+        f"Added {num_added} tasks, {vectordb.count()} in {persist_directory}"
+    )
+
+
+if __name__ == "__main__":
+    main()
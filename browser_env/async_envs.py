@@ -2,25 +2,41 @@ import asyncio
 import json
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, Coroutine, TypeVar, cast
 
 import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from gymnasium import Env
-from gymnasium.spaces import Box, Text
-from playwright.async_api import Page, ViewportSize, async_playwright
+from gymnasium.spaces import Box, Space, Text
+from playwright.async_api import (
+    CDPSession,
+    Page,
+    ViewportSize,
+    async_playwright,
+)
 
 from .actions import Action, aexecute_action, get_action_space
-from .utils import DetachedPage, png_bytes_to_numpy
+from .processors import ObservationHandler, ObservationMetadata
+from .replay import SnapshotRecorder
+from .settle import create_settle_strategy
+from .utils import PAGE_CONTENT_MODES, DetachedPage, ObservationDict
 
+T = TypeVar("T")
 
-class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
+
+class AsyncScriptBrowserEnv(Env[ObservationDict, Action]):
     """
     The goal of this environment is to produce a prototype of a browser environment.
     In the end, we want to support a fully configurable browser environment with wide
     range of action spaces and observation spaces, both structured and unstructured.
     But in this prototype, we just support action space specified by Playwright script,
     and observation space is the html content of the page.
+
+    This is the asyncio counterpart of ScriptBrowserEnv, many of them can be
+    interleaved in one event loop. The sync `reset`, `step` and `close` run
+    it on its own event loop instead, kept for the whole life of the env, so
+    they can not be mixed with the async methods.
     """
 
     @beartype
@@ -31,13 +47,18 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         slow_mo: int = 0,
         timeout: int = 30000,
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        observation_type: str = "html",
+        current_viewport_only: bool = False,
+        save_trace_enabled: bool = False,
+        sleep_after_execution: float = 0.0,
+        settle_strategy: str = "sleep",
+        record_snapshots_dir: str | None = None,
+        screenshot_mode: str = "eager",
+        screenshot_format: str = "png",
+        screenshot_quality: int | None = None,
+        screenshot_scale: float = 1.0,
+        page_content_mode: str = "eager",
     ):
-        self.observation_space = Box(
-            0,
-            255,
-            (viewport_size["height"], viewport_size["width"], 4),
-            np.uint8,
-        )
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
         self.headless = headless
@@ -45,6 +66,68 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         self.reset_finished = False
         self.timeout = timeout
         self.viewport_size = viewport_size
+        self.current_viewport_only = current_viewport_only
+        self.save_trace_enabled = save_trace_enabled
+        self.sleep_after_execution = sleep_after_execution
+        self.settle_strategy = create_settle_strategy(
+            settle_strategy, sleep_after_execution
+        )
+        if page_content_mode not in PAGE_CONTENT_MODES:
+            raise ValueError(f"Unknown page content mode {page_content_mode}")
+        self.page_content_mode = page_content_mode
+        self.detached_page: DetachedPage | None = None
+        # the event loop of the sync methods, the playwright objects are
+        # bound to the loop they are created in
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+        match observation_type:
+            case "html" | "accessibility_tree":
+                self.text_observation_type = observation_type
+                self.image_observation_type = ""
+                self.main_observation_type = "text"
+            case "image":
+                self.image_observation_type = observation_type
+                self.text_observation_type = ""  # type: ignore[assignment]
+                self.main_observation_type = "image"
+            case _:
+                raise ValueError(
+                    f"Unsupported observation type: {observation_type}"
+                )
+
+        self.observation_handler = ObservationHandler(
+            self.main_observation_type,
+            self.text_observation_type,
+            self.image_observation_type,
+            self.current_viewport_only,
+            self.viewport_size,
+            screenshot_mode,
+            screenshot_format,
+            screenshot_quality,
+            screenshot_scale,
+        )
+
+        self.observation_space = cast(
+            Space[ObservationDict],
+            self.observation_handler.get_observation_space(),
+        )
+
+        # record the raw browser data of every text observation
+        self.recorder = (
+            SnapshotRecorder(record_snapshots_dir)
+            if record_snapshots_dir
+            else None
+        )
+        self.observation_handler.text_processor.recorder = self.recorder
+
+    @beartype
+    async def new_page(self) -> Page:
+        page = await self.context.new_page()
+        page.set_default_timeout(self.timeout)
+        client = await page.context.new_cdp_session(page)
+        if self.text_observation_type == "accessibility_tree":
+            await client.send("Accessibility.enable")
+        page.client = client  # type: ignore
+        return page
 
     @beartype
     async def setup(self, config_file: Path | None = None) -> None:
@@ -69,9 +152,54 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
-        self.page = await self.context.new_page()
+        if self.save_trace_enabled:
+            await self.context.tracing.start(screenshots=True, snapshots=True)
         if start_url:
-            await self.page.goto(start_url)
+            start_urls = start_url.split(" |AND| ")
+            for url in start_urls:
+                page = await self.new_page()
+                await page.goto(url)
+            # set the first page as the current page
+            self.page = self.context.pages[0]
+            await self.page.bring_to_front()
+        else:
+            self.page = await self.new_page()
+
+    def run_sync(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the event loop of the sync methods, created on
+        first use and kept until `close`"""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    @beartype
+    def get_page_client(self, page: Page) -> CDPSession:
+        return page.client  # type: ignore
+
+    @beartype
+    async def _aget_obs(self) -> ObservationDict:
+        obs = await self.observation_handler.aget_observation(
+            self.page, self.get_page_client(self.page)
+        )
+        return obs
+
+    @beartype
+    def _get_obs_metadata(self) -> dict[str, ObservationMetadata]:
+        metadata = self.observation_handler.get_observation_metadata()
+        return metadata
+
+    async def _adetach_page(self, fetch_content: bool = True) -> DetachedPage:
+        if self.detached_page is not None:
+            self.detached_page.expire()
+        if not fetch_content or self.page_content_mode == "disabled":
+            self.detached_page = DetachedPage(self.page.url, "")
+        elif self.page_content_mode == "lazy":
+            self.detached_page = DetachedPage(self.page.url, page=self.page)
+        else:
+            self.detached_page = DetachedPage(
+                self.page.url, await self.page.content()
+            )
+        return self.detached_page
 
     @beartype
     async def areset(
@@ -79,7 +207,7 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
+    ) -> tuple[ObservationDict, dict[str, Any]]:
         """
         Reset the environment.
         :param options: options for the environment. The options are:
@@ -90,6 +218,8 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
             await self.context_manager.__aexit__()
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
+            if self.recorder is not None:
+                self.recorder.start_episode(config_file.stem)
             if config_file.exists():
                 await self.setup(config_file=config_file)
             else:
@@ -97,12 +227,18 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         else:
             await self.setup()
         self.reset_finished = True
-        content = await self.page.content()
-        screenshot = png_bytes_to_numpy(await self.page.screenshot())
-        return (
-            screenshot,
-            {"page": DetachedPage(self.page.url, content)},
-        )
+
+        settle_time = await self.settle_strategy.asettle(self.page)
+
+        observation = await self._aget_obs()
+        observation_metadata = self._get_obs_metadata()
+        info = {
+            "page": await self._adetach_page(fetch_content=False),
+            "fail_error": "",
+            "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
+        }
+        return (observation, info)
 
     @beartype
     def reset(
@@ -110,51 +246,67 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
-        return asyncio.run(self.areset(seed=seed, options=options))
+    ) -> tuple[ObservationDict, dict[str, Any]]:
+        return self.run_sync(self.areset(seed=seed, options=options))
+
+    @beartype
+    async def asave_trace(self, trace_path: str | Path) -> None:
+        if self.save_trace_enabled:
+            await self.context.tracing.stop(path=trace_path)
 
     async def aclose(self) -> None:
         if self.reset_finished:
             await self.context_manager.__aexit__()
+            self.reset_finished = False
 
     def close(self) -> None:
-        asyncio.run(self.aclose())
+        try:
+            self.run_sync(self.aclose())
+        finally:
+            assert self.loop is not None
+            self.loop.close()
+            self.loop = None
 
     @beartype
     async def astep(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
+    ) -> tuple[ObservationDict, float, bool, bool, dict[str, Any]]:
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
         success = False
         fail_error = ""
         try:
-            self.page = await aexecute_action(action, self.page, self.context)
+            self.page = await aexecute_action(
+                action,
+                self.page,
+                self.context,
+                self.observation_handler.action_processor,
+            )
             success = True
         except Exception as e:
             fail_error = str(e)
 
-        try:
-            content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
-        except:
-            await self.page.wait_for_load_state("load")
-            content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
+        settle_time = await self.settle_strategy.asettle(self.page)
+
+        observation = await self._aget_obs()
+        observation_metadata = self._get_obs_metadata()
 
+        info = {
+            "page": await self._adetach_page(),
+            "fail_error": fail_error,
+            "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
+        }
         return (
-            screenshot,
-            float(success),
-            False,
-            False,
-            {
-                "page": DetachedPage(self.page.url, content),
-                "fail_error": fail_error,
-            },
+            observation,
+            float(success),  # reward
+            False,  # terminated
+            False,  # truncated
+            info,
         )
 
     @beartype
     def step(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
-        return asyncio.run(self.astep(action), debug=True)
+    ) -> tuple[ObservationDict, float, bool, bool, dict[str, Any]]:
+        return self.run_sync(self.astep(action))
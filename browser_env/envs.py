@@ -4,13 +4,13 @@ import time
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Union, cast
 
 import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from gymnasium import Env
-from gymnasium.spaces import Box, Text
+from gymnasium.spaces import Box, Space, Text
 from playwright.sync_api import (
     CDPSession,
     Page,
@@ -22,10 +22,13 @@ from playwright.sync_api import (
 
 from .actions import Action, execute_action, get_action_space
 from .processors import ObservationHandler, ObservationMetadata
+from .replay import SnapshotRecorder
+from .settle import create_settle_strategy
 from .utils import (
+    PAGE_CONTENT_MODES,
     AccessibilityTree,
     DetachedPage,
-    Observation,
+    ObservationDict,
     png_bytes_to_numpy,
 )
 
@@ -64,7 +67,7 @@ def parse_action(action: str) -> PlaywrightScript:
             raise ValueError(f"Invalid action {action}")
 
 
-class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
+class ScriptBrowserEnv(Env[ObservationDict, Action]):
     """
     The goal of this environment is to produce a prototype of a browser environment.
     In the end, we want to support a fully configurable browser environment with wide
@@ -84,6 +87,14 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        reuse_browser: bool = False,
+        settle_strategy: str = "sleep",
+        record_snapshots_dir: str | None = None,
+        screenshot_mode: str = "eager",
+        screenshot_format: str = "png",
+        screenshot_quality: int | None = None,
+        screenshot_scale: float = 1.0,
+        page_content_mode: str = "eager",
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -94,6 +105,21 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        # wait for the page to settle after each action, for at most
+        # `sleep_after_execution` seconds
+        self.settle_strategy = create_settle_strategy(
+            settle_strategy, sleep_after_execution
+        )
+        # when enabled, the playwright driver and the browser are launched
+        # once and only a fresh context is created on every reset
+        self.reuse_browser = reuse_browser
+        self.browser_launched = False
+        # the html of the page after each step, fetched on every step
+        # (eager), when read (lazy) or never (disabled)
+        if page_content_mode not in PAGE_CONTENT_MODES:
+            raise ValueError(f"Unknown page content mode {page_content_mode}")
+        self.page_content_mode = page_content_mode
+        self.detached_page: DetachedPage | None = None
 
         match observation_type:
             case "html" | "accessibility_tree":
@@ -115,19 +141,68 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.image_observation_type,
             self.current_viewport_only,
             self.viewport_size,
+            screenshot_mode,
+            screenshot_format,
+            screenshot_quality,
+            screenshot_scale,
+        )
+
+        self.observation_space = cast(
+            Space[ObservationDict],
+            self.observation_handler.get_observation_space(),
         )
 
-        self.observation_space = (
-            self.observation_handler.get_observation_space()
+        # record the raw browser data of every text observation
+        self.recorder = (
+            SnapshotRecorder(record_snapshots_dir)
+            if record_snapshots_dir
+            else None
         )
+        self.observation_handler.text_processor.recorder = self.recorder
 
     @beartype
-    def setup(self, config_file: Path | None = None) -> None:
+    def launch_browser(self) -> None:
         self.context_manager = sync_playwright()
         self.playwright = self.context_manager.__enter__()
         self.browser = self.playwright.chromium.launch(
             headless=self.headless, slow_mo=self.slow_mo
         )
+        self.browser_launched = True
+
+    @beartype
+    def shutdown_browser(self) -> None:
+        if self.browser_launched:
+            self.browser_launched = False
+            self.context_manager.__exit__()
+
+    @beartype
+    def is_browser_healthy(self) -> bool:
+        """Check whether the launched browser is still usable"""
+        if not self.browser_launched:
+            return False
+        try:
+            return self.browser.is_connected()
+        except Exception:
+            return False
+
+    @beartype
+    def close_context(self) -> None:
+        """Close the context of the previous task, keeping the browser alive"""
+        try:
+            self.context.close()
+        except Exception:
+            # the context dies with a crashed browser
+            pass
+
+    @beartype
+    def setup(self, config_file: Path | None = None) -> None:
+        if not self.is_browser_healthy():
+            # first launch, or the persistent browser crashed
+            try:
+                self.shutdown_browser()
+            except Exception:
+                pass
+            self.launch_browser()
 
         if config_file:
             with open(config_file, "r") as f:
@@ -173,7 +248,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         return page.client  # type: ignore
 
     @beartype
-    def _get_obs(self) -> dict[str, Observation]:
+    def _get_obs(self) -> ObservationDict:
         obs = self.observation_handler.get_observation(
             self.page, self.get_page_client(self.page)
         )
@@ -184,13 +259,27 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         metadata = self.observation_handler.get_observation_metadata()
         return metadata
 
+    def _detach_page(self, fetch_content: bool = True) -> DetachedPage:
+        # the html of the previous step can no longer be fetched
+        if self.detached_page is not None:
+            self.detached_page.expire()
+        if not fetch_content or self.page_content_mode == "disabled":
+            self.detached_page = DetachedPage(self.page.url, "")
+        elif self.page_content_mode == "lazy":
+            self.detached_page = DetachedPage(self.page.url, page=self.page)
+        else:
+            self.detached_page = DetachedPage(
+                self.page.url, self.page.content()
+            )
+        return self.detached_page
+
     @beartype
     def reset(
         self,
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[dict[str, Observation], dict[str, Any]]:
+    ) -> tuple[ObservationDict, dict[str, Any]]:
         """
         Reset the environment.
         :param options: options for the environment. The current supported options are:
@@ -198,10 +287,15 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         """
         super().reset(seed=seed, options=options)
         if self.reset_finished:
-            self.context_manager.__exit__()
+            if self.reuse_browser:
+                self.close_context()
+            else:
+                self.shutdown_browser()
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
+            if self.recorder is not None:
+                self.recorder.start_episode(config_file.stem)
             if config_file.exists():
                 self.setup(config_file=config_file)
             else:
@@ -210,15 +304,15 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.setup()
         self.reset_finished = True
 
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.settle_strategy.settle(self.page)
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
         info = {
-            "page": DetachedPage(self.page.url, ""),
+            "page": self._detach_page(fetch_content=False),
             "fail_error": "",
             "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
         }
 
         return (observation, info)
@@ -231,11 +325,11 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
     @beartype
     def close(self) -> None:
         if self.reset_finished:
-            self.context_manager.__exit__()
+            self.shutdown_browser()
 
     def step(
         self, action: Action
-    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+    ) -> tuple[ObservationDict, float, bool, bool, dict[str, Any]]:
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
 
@@ -252,17 +346,16 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         except Exception as e:
             fail_error = str(e)
 
-        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.settle_strategy.settle(self.page)
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
 
         info = {
-            "page": DetachedPage(self.page.url, self.page.content()),
+            "page": self._detach_page(),
             "fail_error": fail_error,
             "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
         }
         msg = (
             observation,
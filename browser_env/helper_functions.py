@@ -1,7 +1,8 @@
 import base64
 import io
 import json
-import re
+import queue
+import threading
 from pathlib import Path
 from typing import Any
 
@@ -16,6 +17,7 @@ from browser_env import (
     StateInfo,
     action2str,
 )
+from browser_env.utils import Screenshot
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -113,12 +115,30 @@ def get_action_description(
     return action_str
 
 
+SCREENSHOT_FORMATS = ["inline", "png", "jpeg", "webp"]
+
+
 class RenderHelper(object):
-    """Helper class to render text and image observations and meta data in the trajectory"""
+    """Helper class to render text and image observations and meta data in the trajectory
+
+    The html is streamed: each step appends its fragment to the file and
+    `close` ends the document. The screenshots are encoded and the fragments
+    written by a background thread, so `render` does not wait for the disk.
+    `screenshot_format` `inline` embeds the PNG screenshots in base64, the
+    other formats write them to `render_{task_id}/` next to the html, with
+    `screenshot_quality` for `jpeg` and `webp`.
+    """
 
     def __init__(
-        self, config_file: str, result_dir: str, action_set_tag: str
+        self,
+        config_file: str,
+        result_dir: str,
+        action_set_tag: str,
+        screenshot_format: str = "inline",
+        screenshot_quality: int = 80,
     ) -> None:
+        if screenshot_format not in SCREENSHOT_FORMATS:
+            raise ValueError(f"Unknown screenshot format {screenshot_format}")
         with open(config_file, "r") as f:
             _config = json.load(f)
             _config_str = ""
@@ -128,16 +148,28 @@ class RenderHelper(object):
             task_id = _config["task_id"]
 
         self.action_set_tag = action_set_tag
+        self.screenshot_format = screenshot_format
+        self.screenshot_quality = screenshot_quality
+        self.screenshot_dir = f"render_{task_id}"
+        self.result_dir = Path(result_dir)
+        self.num_screenshots = 0
 
+        # write init template, the end of the document is written on close
+        self.html_head, self.html_tail = HTML_TEMPLATE.split("{body}")
         self.render_file = open(
-            Path(result_dir) / f"render_{task_id}.html", "a+"
+            self.result_dir / f"render_{task_id}.html", "w"
         )
-        self.render_file.truncate(0)
-        # write init template
-        self.render_file.write(HTML_TEMPLATE.format(body=f"{_config_str}"))
-        self.render_file.read()
+        self.render_file.write(
+            self.html_head.replace("{{", "{").replace("}}", "}")
+        )
+        self.render_file.write(_config_str)
         self.render_file.flush()
 
+        self.error: BaseException | None = None
+        self.queue: queue.Queue[tuple[str, Any] | None] = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
     def render(
         self,
         action: Action,
@@ -146,6 +178,7 @@ class RenderHelper(object):
         render_screenshot: bool = False,
     ) -> None:
         """Render the trajectory"""
+        self.raise_error()
         # text observation
         observation = state_info["observation"]
         text_obs = observation["text"]
@@ -153,20 +186,19 @@ class RenderHelper(object):
         new_content = f"<h2>New Page</h2>\n"
         new_content += f"<h3 class='url'><a href={state_info['info']['page'].url}>URL: {state_info['info']['page'].url}</a></h3>\n"
         new_content += f"<div class='state_obv'><pre>{text_obs}</pre><div>\n"
+        self.queue.put((new_content, None))
 
         if render_screenshot:
-            # image observation
             img_obs = observation["image"]
-            image = Image.fromarray(img_obs)
-            byte_io = io.BytesIO()
-            image.save(byte_io, format="PNG")
-            byte_io.seek(0)
-            image_bytes = base64.b64encode(byte_io.read())
-            image_str = image_bytes.decode("utf-8")
-            new_content += f"<img src='data:image/png;base64,{image_str}' style='width:50vw; height:auto;'/>\n"
+            if isinstance(img_obs, Screenshot):
+                # taken here, on the thread of the page
+                img_obs.capture()
+            if not isinstance(img_obs, Screenshot) or img_obs.enabled:
+                # image observation, encoded by the writer
+                self.queue.put(("", img_obs))
 
         # meta data
-        new_content += f"<div class='prev_action' style='background-color:pink'>{meta_data['action_history'][-1]}</div>\n"
+        new_content = f"<div class='prev_action' style='background-color:pink'>{meta_data['action_history'][-1]}</div>\n"
 
         # action
         action_str = get_render_action(
@@ -177,18 +209,82 @@ class RenderHelper(object):
         # with yellow background
         action_str = f"<div class='predict_action'>{action_str}</div>"
         new_content += f"{action_str}\n"
+        self.queue.put((new_content, None))
 
-        # add new content
-        self.render_file.seek(0)
-        html = self.render_file.read()
-        html_body = re.findall(r"<body>(.*?)</body>", html, re.DOTALL)[0]
-        html_body += new_content
+    def render_image(self, img_obs: Any) -> str:
+        # a screenshot as captured is not decoded and encoded again
+        captured = (
+            isinstance(img_obs, Screenshot)
+            and img_obs.scale == 1
+            and img_obs.data is not None
+        )
+        if self.screenshot_format == "inline":
+            if captured:
+                image_format = img_obs.image_format
+                image_bytes = base64.b64encode(img_obs.data)
+            else:
+                if isinstance(img_obs, Screenshot):
+                    img_obs = img_obs.array
+                image = Image.fromarray(img_obs)
+                image_format = "png"
+                byte_io = io.BytesIO()
+                image.save(byte_io, format="PNG")
+                byte_io.seek(0)
+                image_bytes = base64.b64encode(byte_io.read())
+            image_str = image_bytes.decode("utf-8")
+            return f"<img src='data:image/{image_format};base64,{image_str}' style='width:50vw; height:auto;'/>\n"
 
-        html = HTML_TEMPLATE.format(body=html_body)
-        self.render_file.seek(0)
-        self.render_file.truncate()
-        self.render_file.write(html)
-        self.render_file.flush()
+        extension = (
+            "jpg"
+            if self.screenshot_format == "jpeg"
+            else self.screenshot_format
+        )
+        path = f"{self.screenshot_dir}/step_{self.num_screenshots}.{extension}"
+        self.num_screenshots += 1
+        (self.result_dir / self.screenshot_dir).mkdir(exist_ok=True)
+        if captured and img_obs.image_format == self.screenshot_format:
+            with open(self.result_dir / path, "wb") as f:
+                f.write(img_obs.data)
+            return f"<img src='{path}' style='width:50vw; height:auto;'/>\n"
+
+        if isinstance(img_obs, Screenshot):
+            img_obs = img_obs.array
+        image = Image.fromarray(img_obs)
+        if self.screenshot_format == "png":
+            image.save(self.result_dir / path, format="PNG")
+        else:
+            # no alpha channel in jpeg
+            image.convert("RGB").save(
+                self.result_dir / path,
+                format=self.screenshot_format.upper(),
+                quality=self.screenshot_quality,
+            )
+        return f"<img src='{path}' style='width:50vw; height:auto;'/>\n"
+
+    def write_loop(self) -> None:
+        while (item := self.queue.get()) is not None:
+            if self.error is not None:
+                continue
+            content, img_obs = item
+            try:
+                if img_obs is not None:
+                    content += self.render_image(img_obs)
+                self.render_file.write(content)
+                self.render_file.flush()
+            except BaseException as e:
+                self.error = e
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(
+                f"Failed to render {self.render_file.name}"
+            ) from self.error
 
     def close(self) -> None:
+        if self.render_file.closed:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.render_file.write(self.html_tail)
         self.render_file.close()
+        self.raise_error()
@@ -3,12 +3,14 @@ import re
 import traceback
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, TypedDict, Union
+from typing import TYPE_CHECKING, Any, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from gymnasium import spaces
+from playwright.async_api import CDPSession as ACDPSession
+from playwright.async_api import Page as APage
 from playwright.sync_api import CDPSession, Page, ViewportSize
 
 from browser_env.constants import (
@@ -19,18 +21,44 @@ from browser_env.constants import (
 )
 
 from .utils import (
+    SCREENSHOT_MODES,
     AccessibilityTree,
+    AccessibilityTreeNode,
     BrowserConfig,
     BrowserInfo,
+    ImageObservation,
     Observation,
-    png_bytes_to_numpy,
+    ObservationDict,
+    Screenshot,
 )
 
+if TYPE_CHECKING:
+    from .replay import SnapshotRecorder
+
+
+# the window information needed to decide the current viewport
+WINDOW_METRICS_JS = """() => ({
+    win_upper_bound: window.pageYOffset,
+    win_left_bound: window.pageXOffset,
+    win_width: window.screen.width,
+    win_height: window.screen.height,
+    device_pixel_ratio: window.devicePixelRatio,
+})"""
+
+DOM_SNAPSHOT_PARAMS = {
+    "computedStyles": [],
+    "includeDOMRects": True,
+    "includePaintOrder": True,
+}
+
 
 class ObservationProcessor:
     def process(self, page: Page, client: CDPSession) -> Observation:
         raise NotImplementedError
 
+    async def aprocess(self, page: APage, client: ACDPSession) -> Observation:
+        raise NotImplementedError
+
 
 class ObservationMetadata(TypedDict):
     obs_nodes_info: dict[str, Any]
@@ -56,40 +84,83 @@ class TextObervationProcessor(ObservationProcessor):
         self.meta_data = (
             create_empty_metadata()
         )  # use the store meta data of this observation type
+        # record the raw browser data of each step, see browser_env/replay.py
+        self.recorder: "SnapshotRecorder | None" = None
 
     @beartype
-    def fetch_browser_info(
+    def fetch_dom_snapshot(
         self,
         page: Page,
         client: CDPSession,
-    ) -> BrowserInfo:
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        """Return the raw DOM snapshot and window metrics"""
         # extract domtree
-        tree = client.send(
-            "DOMSnapshot.captureSnapshot",
-            {
-                "computedStyles": [],
-                "includeDOMRects": True,
-                "includePaintOrder": True,
-            },
+        tree = client.send("DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS)
+        # extract browser info
+        window_metrics = page.evaluate(WINDOW_METRICS_JS)
+        return tree, window_metrics
+
+    @beartype
+    async def afetch_dom_snapshot(
+        self,
+        page: APage,
+        client: ACDPSession,
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        tree = await client.send(
+            "DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS
         )
+        window_metrics = await page.evaluate(WINDOW_METRICS_JS)
+        return tree, window_metrics
+
+    @beartype
+    def fetch_browser_info(
+        self,
+        page: Page,
+        client: CDPSession,
+    ) -> BrowserInfo:
+        tree, window_metrics = self.fetch_dom_snapshot(page, client)
+        return self.build_browser_info(tree, window_metrics)
+
+    @beartype
+    async def afetch_browser_info(
+        self,
+        page: APage,
+        client: ACDPSession,
+    ) -> BrowserInfo:
+        tree, window_metrics = await self.afetch_dom_snapshot(page, client)
+        return self.build_browser_info(tree, window_metrics)
 
+    @beartype
+    def build_browser_info(
+        self, tree: dict[str, Any], window_metrics: dict[str, Any]
+    ) -> BrowserInfo:
+        """Build the browser info from the raw DOM snapshot and window metrics.
+        The raw snapshot is not modified"""
+        document = tree["documents"][0]
         # calibrate the bounds, in some cases, the bounds are scaled somehow
-        bounds = tree["documents"][0]["layout"]["bounds"]
+        bounds = document["layout"]["bounds"]
         b = bounds[0]
         n = b[2] / self.viewport_size["width"]
         bounds = [[x / n for x in bound] for bound in bounds]
-        tree["documents"][0]["layout"]["bounds"] = bounds
-        # add union bound placeholder
-        tree["documents"][0]["layout"]["unionBounds"] = [None for _ in bounds]
+        layout = {
+            **document["layout"],
+            "bounds": bounds,
+            # add union bound placeholder
+            "unionBounds": [None for _ in bounds],
+        }
+        tree = {
+            **tree,
+            "documents": [{**document, "layout": layout}]
+            + tree["documents"][1:],
+        }
 
-        # extract browser info
-        win_upper_bound = page.evaluate("window.pageYOffset")
-        win_left_bound = page.evaluate("window.pageXOffset")
-        win_width = page.evaluate("window.screen.width")
-        win_height = page.evaluate("window.screen.height")
+        win_upper_bound = window_metrics["win_upper_bound"]
+        win_left_bound = window_metrics["win_left_bound"]
+        win_width = window_metrics["win_width"]
+        win_height = window_metrics["win_height"]
         win_right_bound = win_left_bound + win_width
         win_lower_bound = win_upper_bound + win_height
-        device_pixel_ratio = page.evaluate("window.devicePixelRatio")
+        device_pixel_ratio = window_metrics["device_pixel_ratio"]
         assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
         config: BrowserConfig = {
@@ -131,79 +202,97 @@ class TextObervationProcessor(ObservationProcessor):
     def retrieve_viewport_info(self, info: BrowserInfo) -> None:
         """Add viewport related information to the DOMTree
         1. add union bound, which is a union of all the bounds of the nodes in the subtree
-        This is only used when current_viewport_only is enabled since it is quite slow
-
-        TODO[robert1003]: improve
+        Only the nodes reachable from the root through nodes with a layout are considered.
+        The subtrees are reduced level by level from the deepest one, without recursion
         """
         tree = info["DOMTree"]
         document = tree["documents"][0]
         nodes = document["nodes"]
-        parent = nodes["parentIndex"]
+        parent = np.asarray(nodes["parentIndex"], dtype=np.int64)
         node_names = nodes["nodeName"]
 
         layout = document["layout"]
-        layout_node_cursor = layout["nodeIndex"]
-        bounds = layout["bounds"]
+        layout_node_cursor = np.asarray(layout["nodeIndex"], dtype=np.int64)
+        bounds = np.asarray(layout["bounds"], dtype=np.float64).reshape(-1, 4)
 
-        graph = defaultdict(lambda: [])
         assert len(node_names) == len(parent)
-        for node_idx in range(len(node_names)):
-            parent_idx = parent[node_idx]
-            if parent_idx != -1:
-                graph[parent_idx].append(node_idx)
-
+        num_nodes = len(parent)
         union_bounds: list[list[float] | None] = [None for _ in bounds]
 
-        def valid_bbox(bound: list[float] | None) -> bool:
-            if bound is None:
-                return False
+        # the first layout entry of each node, -1 if the node has no layout
+        node_cursor = np.full(num_nodes, -1, dtype=np.int64)
+        layout_nodes, first_cursor = np.unique(
+            layout_node_cursor, return_index=True
+        )
+        node_cursor[layout_nodes] = first_cursor
+        if num_nodes == 0 or node_cursor[0] == -1:
+            info["DOMTree"]["documents"][0]["layout"][
+                "unionBounds"
+            ] = union_bounds
+            return
+
+        # children of each node, grouped by parent
+        children = np.argsort(parent, kind="stable")
+        sorted_parent = parent[children]
+
+        # visit the tree level by level, stopping at nodes without a layout
+        levels = []
+        frontier = np.array([0], dtype=np.int64)
+        while len(frontier) > 0:
+            levels.append(frontier)
+            starts = np.searchsorted(sorted_parent, frontier, side="left")
+            ends = np.searchsorted(sorted_parent, frontier, side="right")
+            counts = ends - starts
+            offsets = np.repeat(ends - np.cumsum(counts), counts)
+            child_nodes = children[np.arange(counts.sum()) + offsets]
+            frontier = child_nodes[node_cursor[child_nodes] != -1]
+
+        def valid_bbox(
+            bound: npt.NDArray[np.float64],
+        ) -> npt.NDArray[Any]:
             # no width or height
-            if np.isclose(bound[2], 0):
-                return False
-            if np.isclose(bound[3], 0):
-                return False
-            return True
-
-        def add_union_bound(idx: int) -> list[float] | None:
-            if idx in layout_node_cursor:
-                cursor = layout_node_cursor.index(idx)
-                node_bound = bounds[cursor].copy()
-                tree_bounds: list[Any] = [node_bound]
-                for child_idx in graph[idx]:
-                    child_bound = add_union_bound(child_idx)
-                    tree_bounds.append(
-                        child_bound.copy() if child_bound else None
-                    )
-
-                tree_bounds = [b for b in tree_bounds if valid_bbox(b)]
-                # convert to absolute coordinates
-                for i in range(len(tree_bounds)):
-                    tree_bounds[i][2] = tree_bounds[i][0] + tree_bounds[i][2]
-                    tree_bounds[i][3] = tree_bounds[i][1] + tree_bounds[i][3]
-
-                if len(tree_bounds) == 0:
-                    assert not valid_bbox(node_bound)
-                    node_union_bound = [0.0, 0.0, 0.0, 0.0]
-                else:
-                    left_bound = min([b[0] for b in tree_bounds])
-                    top_bound = min([b[1] for b in tree_bounds])
-                    right_bound = max([b[2] for b in tree_bounds])
-                    bottom_bound = max([b[3] for b in tree_bounds])
-                    node_union_bound = [
-                        left_bound,
-                        top_bound,
-                        right_bound - left_bound,
-                        bottom_bound - top_bound,
-                    ]
-
-                # update the list
-                union_bounds[cursor] = node_union_bound
-            else:
-                node_union_bound = None
+            return ~(np.isclose(bound[:, 2], 0) | np.isclose(bound[:, 3], 0))
+
+        # running [left, top, right, bottom] of the valid bounds in each subtree
+        left = np.full(num_nodes, np.inf)
+        top = np.full(num_nodes, np.inf)
+        right = np.full(num_nodes, -np.inf)
+        bottom = np.full(num_nodes, -np.inf)
+        result = np.zeros((len(bounds), 4), dtype=np.float64)
+
+        def add_bounds(
+            idx: npt.NDArray[np.int64], bound: npt.NDArray[np.float64]
+        ) -> None:
+            # convert to absolute coordinates
+            valid = valid_bbox(bound)
+            idx, bound = idx[valid], bound[valid]
+            np.minimum.at(left, idx, bound[:, 0])
+            np.minimum.at(top, idx, bound[:, 1])
+            np.maximum.at(right, idx, bound[:, 0] + bound[:, 2])
+            np.maximum.at(bottom, idx, bound[:, 1] + bound[:, 3])
+
+        for level in reversed(levels):
+            cursor = node_cursor[level]
+            add_bounds(level, bounds[cursor])
+            has_bound = np.isfinite(left[level])
+            node_union_bound = np.zeros((len(level), 4), dtype=np.float64)
+            node_union_bound[has_bound, 0] = left[level][has_bound]
+            node_union_bound[has_bound, 1] = top[level][has_bound]
+            node_union_bound[has_bound, 2] = (
+                right[level][has_bound] - left[level][has_bound]
+            )
+            node_union_bound[has_bound, 3] = (
+                bottom[level][has_bound] - top[level][has_bound]
+            )
+            result[cursor] = node_union_bound
+            # the union bound of a node is one of the bounds of its parent
+            has_parent = level != 0
+            add_bounds(parent[level[has_parent]], node_union_bound[has_parent])
 
-            return node_union_bound
+        for level in levels:
+            for cursor in node_cursor[level].tolist():
+                union_bounds[cursor] = result[cursor].tolist()
 
-        add_union_bound(0)
         info["DOMTree"]["documents"][0]["layout"]["unionBounds"] = union_bounds
 
     @beartype
@@ -279,7 +368,22 @@ class TextObervationProcessor(ObservationProcessor):
         accessibility_tree: AccessibilityTree = client.send(
             "Accessibility.getFullAXTree", {}
         )["nodes"]
+        return self.build_page_accessibility_tree(info, accessibility_tree)
 
+    @beartype
+    async def afetch_page_accessibility_tree(
+        self, info: BrowserInfo, client: ACDPSession
+    ) -> AccessibilityTree:
+        accessibility_tree: AccessibilityTree = (
+            await client.send("Accessibility.getFullAXTree", {})
+        )["nodes"]
+        return self.build_page_accessibility_tree(info, accessibility_tree)
+
+    @beartype
+    def build_page_accessibility_tree(
+        self, info: BrowserInfo, accessibility_tree: AccessibilityTree
+    ) -> AccessibilityTree:
+        """Attach the bounding boxes in the DOM snapshot to the raw accessibility tree"""
         # a few nodes are repeated in the accessibility tree
         seen_ids = set()
         _accessibility_tree = []
@@ -303,11 +407,16 @@ class TextObervationProcessor(ObservationProcessor):
         offsetrect_bounds = layout["offsetRects"]
         backend_id_to_bound = {}
 
+        # the first layout entry of each dom node
+        node_idx_to_cursor: dict[int, int] = {}
+        for cursor, idx in enumerate(layout_node_cursor):
+            node_idx_to_cursor.setdefault(idx, cursor)
+
         # get the mapping between backend node id and bounding box
         for idx in range(len(node_names)):
-            if idx not in layout_node_cursor:
+            if idx not in node_idx_to_cursor:
                 continue
-            cursor = layout_node_cursor.index(idx)
+            cursor = node_idx_to_cursor[idx]
             node_bound = bounds[cursor]
             node_union_bound = union_bounds[cursor]
             node_offsetrect_bound = offsetrect_bounds[cursor]
@@ -341,18 +450,20 @@ class TextObervationProcessor(ObservationProcessor):
                 ][2]
 
         # refine the bounding box for nodes which only appear in the accessibility tree
-        node_ids = [node["nodeId"] for node in accessibility_tree]
+        node_id_to_idx = {
+            node["nodeId"]: idx for idx, node in enumerate(accessibility_tree)
+        }
         for refine_node_id in refine_node_ids:
             child_id = refine_node_id
             parent_idx: None | int = None
             while child_id in parent_graph:
                 parent_id = parent_graph[child_id]
-                parent_idx = node_ids.index(parent_id)
+                parent_idx = node_id_to_idx[parent_id]
                 child_id = parent_id
                 if accessibility_tree[parent_idx]["union_bound"] is not None:
                     break
 
-            refine_node_idx = node_ids.index(refine_node_id)
+            refine_node_idx = node_id_to_idx[refine_node_id]
 
             if parent_idx is not None:
                 accessibility_tree[refine_node_idx][
@@ -401,6 +512,55 @@ class TextObervationProcessor(ObservationProcessor):
 
         return subtree
 
+    @beartype
+    @staticmethod
+    def format_accessibility_node(
+        node: AccessibilityTreeNode, obs_node_id: str
+    ) -> tuple[str, bool]:
+        """Format a single node, return the text and whether it should be shown"""
+        valid_node = True
+        role = node["role"]["value"]
+        name = node["name"]["value"]
+        node_str = f"[{obs_node_id}] {role} {repr(name)}"
+        properties = []
+        for property in node.get("properties", []):
+            try:
+                if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                    continue
+                properties.append(
+                    f'{property["name"]}: {property["value"]["value"]}'
+                )
+            except KeyError:
+                pass
+
+        if properties:
+            node_str += " " + " ".join(properties)
+
+        # check valid
+        if not node_str.strip():
+            valid_node = False
+
+        # empty generic node
+        if not name.strip():
+            if not properties:
+                if role in [
+                    "generic",
+                    "img",
+                    "list",
+                    "strong",
+                    "paragraph",
+                    "banner",
+                    "navigation",
+                    "Section",
+                    "LabelText",
+                    "Legend",
+                    "listitem",
+                ]:
+                    valid_node = False
+            elif role in ["listitem"]:
+                valid_node = False
+        return node_str, valid_node
+
     @beartype
     @staticmethod
     def parse_accessibility_tree(
@@ -413,55 +573,24 @@ class TextObervationProcessor(ObservationProcessor):
 
         obs_nodes_info = {}
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
+        # depth first traversal with an explicit stack, the lines are emitted
+        # in pre-order and joined once
+        lines: list[str] = []
+        stack = [(0, accessibility_tree[0]["nodeId"], 0)]
+        while stack:
+            idx, obs_node_id, depth = stack.pop()
             node = accessibility_tree[idx]
             indent = "\t" * depth
             valid_node = True
             try:
-                role = node["role"]["value"]
-                name = node["name"]["value"]
-                node_str = f"[{obs_node_id}] {role} {repr(name)}"
-                properties = []
-                for property in node.get("properties", []):
-                    try:
-                        if property["name"] in IGNORED_ACTREE_PROPERTIES:
-                            continue
-                        properties.append(
-                            f'{property["name"]}: {property["value"]["value"]}'
-                        )
-                    except KeyError:
-                        pass
-
-                if properties:
-                    node_str += " " + " ".join(properties)
-
-                # check valid
-                if not node_str.strip():
-                    valid_node = False
-
-                # empty generic node
-                if not name.strip():
-                    if not properties:
-                        if role in [
-                            "generic",
-                            "img",
-                            "list",
-                            "strong",
-                            "paragraph",
-                            "banner",
-                            "navigation",
-                            "Section",
-                            "LabelText",
-                            "Legend",
-                            "listitem",
-                        ]:
-                            valid_node = False
-                    elif role in ["listitem"]:
-                        valid_node = False
-
+                (
+                    node_str,
+                    valid_node,
+                ) = TextObervationProcessor.format_accessibility_node(
+                    node, obs_node_id
+                )
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
+                    lines.append(f"{indent}{node_str}")
                     obs_nodes_info[obs_node_id] = {
                         "backend_id": node["backendDOMNodeId"],
                         "bound": node["bound"],
@@ -473,22 +602,16 @@ class TextObervationProcessor(ObservationProcessor):
             except Exception as e:
                 valid_node = False
 
-            for _, child_node_id in enumerate(node["childIds"]):
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            for child_node_id in reversed(node["childIds"]):
                 if child_node_id not in node_id_to_idx:
                     continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
+                stack.append(
+                    (node_id_to_idx[child_node_id], child_node_id, child_depth)
                 )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
-
-            return tree_str
 
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @beartype
@@ -514,32 +637,53 @@ class TextObervationProcessor(ObservationProcessor):
 
         return "\n".join(clean_lines)
 
+    @staticmethod
+    def format_tab_titles(tab_titles: list[str], current_tab_idx: int) -> str:
+        for idx in range(len(tab_titles)):
+            if idx == current_tab_idx:
+                tab_titles[idx] = f"Tab {idx} (current): {tab_titles[idx]}"
+            else:
+                tab_titles[idx] = f"Tab {idx}: {tab_titles[idx]}"
+        return " | ".join(tab_titles)
+
     @beartype
-    def process(self, page: Page, client: CDPSession) -> str:
-        # get the tab info
+    def get_tab_title_str(self, page: Page) -> str:
         open_tabs = page.context.pages
         try:
             tab_titles = [tab.title() for tab in open_tabs]
             current_tab_idx = open_tabs.index(page)
-            for idx in range(len(open_tabs)):
-                if idx == current_tab_idx:
-                    tab_titles[
-                        idx
-                    ] = f"Tab {idx} (current): {open_tabs[idx].title()}"
-                else:
-                    tab_titles[idx] = f"Tab {idx}: {open_tabs[idx].title()}"
-            tab_title_str = " | ".join(tab_titles)
+            tab_title_str = self.format_tab_titles(tab_titles, current_tab_idx)
         except Exception:
             tab_title_str = " | ".join(
                 ["Tab {idx}" for idx in range(len(open_tabs))]
             )
+        return tab_title_str
 
+    @beartype
+    async def aget_tab_title_str(self, page: APage) -> str:
+        open_tabs = page.context.pages
         try:
-            browser_info = self.fetch_browser_info(page, client)
+            tab_titles = [await tab.title() for tab in open_tabs]
+            current_tab_idx = open_tabs.index(page)
+            tab_title_str = self.format_tab_titles(tab_titles, current_tab_idx)
         except Exception:
-            page.wait_for_load_state("load", timeout=500)
-            browser_info = self.fetch_browser_info(page, client)
+            tab_title_str = " | ".join(
+                ["Tab {idx}" for idx in range(len(open_tabs))]
+            )
+        return tab_title_str
 
+    @beartype
+    def build_observation(
+        self,
+        tab_title_str: str,
+        browser_info: BrowserInfo,
+        accessibility_tree: AccessibilityTree | None = None,
+        page_content: str | None = None,
+    ) -> str:
+        """Build the text observation from the fetched browser data.
+        `accessibility_tree` is the raw Accessibility.getFullAXTree nodes and
+        `page_content` the full html, they are only required by the
+        corresponding observation type"""
         if self.current_viewport_only:
             self.retrieve_viewport_info(browser_info)
 
@@ -548,10 +692,12 @@ class TextObervationProcessor(ObservationProcessor):
                 html = self.current_viewport_html(browser_info)
                 content = html
             else:
-                content = page.content()
+                assert page_content is not None
+                content = page_content
         elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
-                browser_info, client
+            assert accessibility_tree is not None
+            accessibility_tree = self.build_page_accessibility_tree(
+                browser_info, accessibility_tree
             )
             if self.current_viewport_only:
                 accessibility_tree = self.current_viewport_accessibility_tree(
@@ -572,6 +718,85 @@ class TextObervationProcessor(ObservationProcessor):
         content = f"{tab_title_str}\n\n{content}"
         return content
 
+    @beartype
+    def process(self, page: Page, client: CDPSession) -> str:
+        # get the tab info
+        tab_title_str = self.get_tab_title_str(page)
+
+        try:
+            tree, window_metrics = self.fetch_dom_snapshot(page, client)
+            browser_info = self.build_browser_info(tree, window_metrics)
+        except Exception:
+            page.wait_for_load_state("load", timeout=500)
+            tree, window_metrics = self.fetch_dom_snapshot(page, client)
+            browser_info = self.build_browser_info(tree, window_metrics)
+
+        accessibility_tree = None
+        page_content = None
+        if self.observation_type == "accessibility_tree":
+            accessibility_tree = client.send(
+                "Accessibility.getFullAXTree", {}
+            )["nodes"]
+        elif (
+            self.observation_type == "html" and not self.current_viewport_only
+        ):
+            page_content = page.content()
+
+        if self.recorder is not None:
+            self.recorder.record(
+                {
+                    "url": page.url,
+                    "tab_title_str": tab_title_str,
+                    "dom_snapshot": tree,
+                    "accessibility_tree": accessibility_tree,
+                    "window_metrics": window_metrics,
+                    "page_content": page_content,
+                }
+            )
+
+        return self.build_observation(
+            tab_title_str, browser_info, accessibility_tree, page_content
+        )
+
+    @beartype
+    async def aprocess(self, page: APage, client: ACDPSession) -> str:
+        tab_title_str = await self.aget_tab_title_str(page)
+
+        try:
+            tree, window_metrics = await self.afetch_dom_snapshot(page, client)
+            browser_info = self.build_browser_info(tree, window_metrics)
+        except Exception:
+            await page.wait_for_load_state("load", timeout=500)
+            tree, window_metrics = await self.afetch_dom_snapshot(page, client)
+            browser_info = self.build_browser_info(tree, window_metrics)
+
+        accessibility_tree = None
+        page_content = None
+        if self.observation_type == "accessibility_tree":
+            accessibility_tree = (
+                await client.send("Accessibility.getFullAXTree", {})
+            )["nodes"]
+        elif (
+            self.observation_type == "html" and not self.current_viewport_only
+        ):
+            page_content = await page.content()
+
+        if self.recorder is not None:
+            self.recorder.record(
+                {
+                    "url": page.url,
+                    "tab_title_str": tab_title_str,
+                    "dom_snapshot": tree,
+                    "accessibility_tree": accessibility_tree,
+                    "window_metrics": window_metrics,
+                    "page_content": page_content,
+                }
+            )
+
+        return self.build_observation(
+            tab_title_str, browser_info, accessibility_tree, page_content
+        )
+
     @beartype
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
@@ -591,17 +816,56 @@ class TextObervationProcessor(ObservationProcessor):
 
 
 class ImageObservationProcessor(ObservationProcessor):
-    def __init__(self, observation_type: str):
+    """The screenshot of the page. With `screenshot_mode` `eager`, it is
+    taken and decoded at every step. With `lazy`, a `Screenshot` is returned
+    instead, taken only when a consumer (e.g., the render) asks for it, and
+    with `disabled`, one that is never taken. See `Screenshot` for the
+    format, quality and scale"""
+
+    def __init__(
+        self,
+        observation_type: str,
+        screenshot_mode: str = "eager",
+        screenshot_format: str = "png",
+        screenshot_quality: int | None = None,
+        screenshot_scale: float = 1.0,
+    ):
+        if screenshot_mode not in SCREENSHOT_MODES:
+            raise ValueError(f"Unknown screenshot mode {screenshot_mode}")
         self.observation_type = observation_type
         self.observation_tag = "image"
         self.meta_data = create_empty_metadata()
+        self.screenshot_mode = screenshot_mode
+        self.screenshot_format = screenshot_format
+        self.screenshot_quality = screenshot_quality
+        self.screenshot_scale = screenshot_scale
+        self.last_screenshot: Screenshot | None = None
+
+    def new_screenshot(self, page: Page | APage) -> Screenshot:
+        # the page of the previous observation is gone
+        if self.last_screenshot is not None:
+            self.last_screenshot.expire()
+        self.last_screenshot = Screenshot(
+            None if self.screenshot_mode == "disabled" else page,
+            self.screenshot_format,
+            self.screenshot_quality,
+            self.screenshot_scale,
+        )
+        return self.last_screenshot
 
-    def process(self, page: Page, client: CDPSession) -> npt.NDArray[np.uint8]:
-        try:
-            screenshot = png_bytes_to_numpy(page.screenshot())
-        except:
-            page.wait_for_event("load")
-            screenshot = png_bytes_to_numpy(page.screenshot())
+    def process(self, page: Page, client: CDPSession) -> ImageObservation:
+        screenshot = self.new_screenshot(page)
+        if self.screenshot_mode == "eager":
+            return screenshot.array
+        return screenshot
+
+    async def aprocess(
+        self, page: APage, client: ACDPSession
+    ) -> ImageObservation:
+        screenshot = self.new_screenshot(page)
+        if self.screenshot_mode == "eager":
+            await screenshot.acapture()
+            return screenshot.array
         return screenshot
 
 
@@ -615,13 +879,21 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        screenshot_mode: str = "eager",
+        screenshot_format: str = "png",
+        screenshot_quality: int | None = None,
+        screenshot_scale: float = 1.0,
     ) -> None:
         self.main_observation_type = main_observation_type
         self.text_processor = TextObervationProcessor(
             text_observation_type, current_viewport_only, viewport_size
         )
         self.image_processor = ImageObservationProcessor(
-            image_observation_type
+            image_observation_type,
+            screenshot_mode,
+            screenshot_format,
+            screenshot_quality,
+            screenshot_scale,
         )
         self.viewport_size = viewport_size
 
@@ -652,11 +924,19 @@ class ObservationHandler:
     @beartype
     def get_observation(
         self, page: Page, client: CDPSession
-    ) -> dict[str, Observation]:
+    ) -> ObservationDict:
         text_obs = self.text_processor.process(page, client)
         image_obs = self.image_processor.process(page, client)
         return {"text": text_obs, "image": image_obs}
 
+    @beartype
+    async def aget_observation(
+        self, page: APage, client: ACDPSession
+    ) -> ObservationDict:
+        text_obs = await self.text_processor.aprocess(page, client)
+        image_obs = await self.image_processor.aprocess(page, client)
+        return {"text": text_obs, "image": image_obs}
+
     @beartype
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
         return {
@@ -0,0 +1,223 @@
+"""Record the raw browser data behind each text observation and replay it
+without a browser, e.g., to profile or regression-test the observation
+processors on a build machine.
+
+A corpus is a directory with one gzip compressed json file per step, named
+`{episode}_{step:04d}.json.gz`, each holding an ObservationSnapshot.
+"""
+import copy
+import glob
+import gzip
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any, Iterator, TypedDict, cast
+
+from beartype import beartype
+from playwright.sync_api import ViewportSize
+
+from .processors import TextObervationProcessor
+from .utils import AccessibilityTree, AccessibilityTreeNode
+
+
+class ObservationSnapshot(TypedDict):
+    url: str
+    tab_title_str: str
+    # DOMSnapshot.captureSnapshot, before the bounds are calibrated
+    dom_snapshot: dict[str, Any]
+    # Accessibility.getFullAXTree()["nodes"], None for html observations
+    accessibility_tree: AccessibilityTree | None
+    # WINDOW_METRICS_JS
+    window_metrics: dict[str, Any]
+    # page.content(), only fetched for full page html observations
+    page_content: str | None
+
+
+class SnapshotRecorder:
+    """Write the snapshots of each step into a corpus directory"""
+
+    def __init__(self, corpus_dir: str | Path) -> None:
+        self.corpus_dir = Path(corpus_dir)
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        self.start_episode("episode")
+
+    def start_episode(self, name: str) -> None:
+        self.episode = name
+        self.step = 0
+
+    @beartype
+    def record(self, snapshot: ObservationSnapshot) -> Path:
+        """Serialize the snapshot right away, the processors modify the
+        accessibility tree in place afterwards"""
+        path = self.corpus_dir / f"{self.episode}_{self.step:04d}.json.gz"
+        with gzip.open(path, "wt") as f:
+            json.dump(snapshot, f)
+        self.step += 1
+        return path
+
+
+@beartype
+def load_snapshot(path: str | Path) -> ObservationSnapshot:
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt") as f:  # type: ignore[operator]
+        snapshot: ObservationSnapshot = json.load(f)
+    return snapshot
+
+
+def iter_corpus(
+    corpus_dir: str | Path,
+) -> Iterator[tuple[str, ObservationSnapshot]]:
+    """Yield the (file path, snapshot) of a corpus, in recording order"""
+    paths = sorted(
+        glob.glob(os.path.join(corpus_dir, "*.json.gz"))
+        + glob.glob(os.path.join(corpus_dir, "*.json"))
+    )
+    for path in paths:
+        yield path, load_snapshot(path)
+
+
+@beartype
+def replay_snapshot(
+    processor: TextObervationProcessor, snapshot: ObservationSnapshot
+) -> str:
+    """Build the text observation of a recorded step, as
+    TextObervationProcessor.process would with a live page. The snapshot is
+    left untouched"""
+    browser_info = processor.build_browser_info(
+        snapshot["dom_snapshot"], snapshot["window_metrics"]
+    )
+    accessibility_tree = snapshot["accessibility_tree"]
+    if accessibility_tree is not None:
+        accessibility_tree = copy.deepcopy(accessibility_tree)
+    return processor.build_observation(
+        snapshot["tab_title_str"],
+        browser_info,
+        accessibility_tree,
+        snapshot["page_content"],
+    )
+
+
+TAGS = ["DIV", "SPAN", "A", "LI", "UL", "BUTTON", "INPUT", "P", "TD", "TR"]
+ROLES = [
+    "generic",
+    "link",
+    "button",
+    "StaticText",
+    "textbox",
+    "listitem",
+    "heading",
+    "cell",
+]
+WORDS = ["order", "product", "admin", "search", "page", "item", "total", "go"]
+
+
+@beartype
+def make_synthetic_snapshot(
+    num_nodes: int,
+    seed: int = 0,
+    layout_ratio: float = 0.98,
+    viewport_size: ViewportSize = {"width": 1280, "height": 720},
+) -> ObservationSnapshot:
+    """Generate a page shaped like a large Magento admin / GitLab page,
+    `layout_ratio` of the nodes are rendered (i.e., have a layout)"""
+    rng = random.Random(seed)
+    width = float(viewport_size["width"])
+    strings = ["#document", "HTML", "BODY", "#text"] + TAGS
+    parent_index = [-1]
+    node_name = [0]
+    layout_node_index = [0]
+    bounds = [[0.0, 0.0, width, 20.0 * num_nodes]]
+    node_bound = {0: bounds[0]}
+    for idx in range(1, num_nodes):
+        # nest under one of the recent nodes, giving a depth of ~50-100
+        parent = rng.randint(int(idx * 0.7), idx - 1)
+        parent_index.append(parent)
+        node_name.append(rng.randint(1, len(strings) - 1))
+        if rng.random() < layout_ratio:
+            px, py, pw, ph = node_bound.get(parent, bounds[0])
+            node_width = 0.0 if rng.random() < 0.05 else rng.uniform(0, pw)
+            node_height = rng.uniform(0, max(ph / 4, 20.0))
+            bound = [
+                px + rng.uniform(0, pw - node_width),
+                py + rng.uniform(0, max(ph - node_height, 0)),
+                node_width,
+                node_height,
+            ]
+            layout_node_index.append(idx)
+            bounds.append(bound)
+            node_bound[idx] = bound
+
+    dom_snapshot = {
+        "strings": strings,
+        "documents": [
+            {
+                "nodes": {
+                    "parentIndex": parent_index,
+                    "nodeName": node_name,
+                    "backendNodeId": [idx + 1 for idx in range(num_nodes)],
+                    "attributes": [[] for _ in range(num_nodes)],
+                    "nodeValue": [-1 for _ in range(num_nodes)],
+                },
+                "layout": {
+                    "nodeIndex": layout_node_index,
+                    "bounds": bounds,
+                    "offsetRects": [[] for _ in layout_node_index],
+                },
+            }
+        ],
+    }
+
+    # one accessibility node for most of the dom nodes
+    ax_parent: dict[int, int] = {}
+    accessibility_tree: AccessibilityTree = []
+    ax_nodes: dict[int, dict[str, Any]] = {}
+    for idx in range(num_nodes):
+        if idx != 0 and rng.random() < 0.3:
+            # ignored by the accessibility tree, children go to the parent
+            ax_parent[idx] = ax_parent.get(parent_index[idx], 0)
+            continue
+        role = "RootWebArea" if idx == 0 else rng.choice(ROLES)
+        node: dict[str, Any] = {
+            "nodeId": str(idx + 1),
+            "ignored": False,
+            "role": {"type": "role", "value": role},
+            "name": {
+                "type": "computedString",
+                "value": " ".join(rng.choices(WORDS, k=rng.randint(0, 4))),
+            },
+            "properties": [
+                {
+                    "name": "focusable",
+                    "value": {"type": "boolean", "value": True},
+                }
+            ]
+            if role in ["link", "button", "textbox"]
+            else [],
+            "childIds": [],
+            "backendDOMNodeId": idx + 1,
+        }
+        if idx != 0:
+            parent_ax = ax_parent.get(parent_index[idx], 0)
+            node["parentId"] = str(parent_ax + 1)
+            ax_nodes[parent_ax]["childIds"].append(node["nodeId"])
+        ax_parent[idx] = idx
+        ax_nodes[idx] = node
+        # the raw CDP node, the bounds are added by the processor
+        accessibility_tree.append(cast(AccessibilityTreeNode, node))
+
+    window_metrics = {
+        "win_upper_bound": 0.0,
+        "win_left_bound": 0.0,
+        "win_width": width,
+        "win_height": float(viewport_size["height"]),
+        "device_pixel_ratio": 1.0,
+    }
+    return {
+        "url": f"http://synthetic/{num_nodes}/{seed}",
+        "tab_title_str": "Tab 0 (current): Synthetic",
+        "dom_snapshot": dom_snapshot,
+        "accessibility_tree": accessibility_tree,
+        "window_metrics": window_metrics,
+        "page_content": None,
+    }
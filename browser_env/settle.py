@@ -0,0 +1,186 @@
+"""Strategies to wait for the page to settle after an action.
+All the waiting times are in seconds, following `sleep_after_execution`"""
+import asyncio
+import time
+
+from beartype import beartype
+from playwright.async_api import Page as APage
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import Page
+
+# resolves once no DOM mutation was observed for `quiet` ms, or after
+# `timeout` ms
+DOM_QUIESCENCE_JS = """([quiet, timeout]) => new Promise((resolve) => {
+    const start = performance.now();
+    let last = start;
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true,
+    });
+    const check = () => {
+        const now = performance.now();
+        if (now - last >= quiet || now - start >= timeout) {
+            observer.disconnect();
+            resolve(now - start);
+        } else {
+            setTimeout(check, 50);
+        }
+    };
+    setTimeout(check, Math.min(quiet, timeout));
+})"""
+
+
+class SettleStrategy:
+    """Wait until the page is stable, but no longer than `max_wait`"""
+
+    def __init__(self, max_wait: float) -> None:
+        self.max_wait = max_wait
+
+    def wait(self, page: Page, max_wait: float) -> None:
+        raise NotImplementedError
+
+    async def await_(self, page: APage, max_wait: float) -> None:
+        raise NotImplementedError
+
+    @beartype
+    def settle(self, page: Page) -> float:
+        """Wait for the page and return the time spent waiting"""
+        start = time.perf_counter()
+        if self.max_wait > 0:
+            self.wait(page, self.max_wait)
+        return time.perf_counter() - start
+
+    @beartype
+    async def asettle(self, page: APage) -> float:
+        start = time.perf_counter()
+        if self.max_wait > 0:
+            await self.await_(page, self.max_wait)
+        return time.perf_counter() - start
+
+
+class SleepSettle(SettleStrategy):
+    """Hard sleep for the full duration"""
+
+    def wait(self, page: Page, max_wait: float) -> None:
+        time.sleep(max_wait)
+
+    async def await_(self, page: APage, max_wait: float) -> None:
+        await asyncio.sleep(max_wait)
+
+
+class LoadStateSettle(SettleStrategy):
+    """Wait for a playwright load state: `load`, `domcontentloaded` or
+    `networkidle`"""
+
+    def __init__(self, max_wait: float, state: str = "load") -> None:
+        super().__init__(max_wait)
+        self.state = state
+
+    def wait(self, page: Page, max_wait: float) -> None:
+        try:
+            page.wait_for_load_state(
+                self.state, timeout=max_wait * 1000  # type: ignore[arg-type]
+            )
+        except PlaywrightError:
+            # timeout, or the page is gone (e.g., closed tab)
+            pass
+
+    async def await_(self, page: APage, max_wait: float) -> None:
+        try:
+            await page.wait_for_load_state(
+                self.state, timeout=max_wait * 1000  # type: ignore[arg-type]
+            )
+        except PlaywrightError:
+            pass
+
+
+class DOMQuiescenceSettle(SettleStrategy):
+    """Wait until no DOM mutation is observed for a `quiet_window`"""
+
+    def __init__(self, max_wait: float, quiet_window: float = 0.3) -> None:
+        super().__init__(max_wait)
+        self.quiet_window = quiet_window
+
+    def wait(self, page: Page, max_wait: float) -> None:
+        deadline = time.perf_counter() + max_wait
+        try:
+            page.evaluate(
+                DOM_QUIESCENCE_JS,
+                [self.quiet_window * 1000, max_wait * 1000],
+            )
+        except PlaywrightError:
+            # the execution context is destroyed by a navigation, the new
+            # page loads within what is left of the budget
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                LoadStateSettle(remaining).wait(page, remaining)
+
+    async def await_(self, page: APage, max_wait: float) -> None:
+        deadline = time.perf_counter() + max_wait
+        try:
+            await page.evaluate(
+                DOM_QUIESCENCE_JS,
+                [self.quiet_window * 1000, max_wait * 1000],
+            )
+        except PlaywrightError:
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                await LoadStateSettle(remaining).await_(page, remaining)
+
+
+class HybridSettle(SettleStrategy):
+    """Run the strategies in order, sharing a total budget of `max_wait`"""
+
+    def __init__(
+        self, max_wait: float, strategies: list[SettleStrategy]
+    ) -> None:
+        super().__init__(max_wait)
+        self.strategies = strategies
+
+    def wait(self, page: Page, max_wait: float) -> None:
+        deadline = time.perf_counter() + max_wait
+        for strategy in self.strategies:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            strategy.wait(page, remaining)
+
+    async def await_(self, page: APage, max_wait: float) -> None:
+        deadline = time.perf_counter() + max_wait
+        for strategy in self.strategies:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            await strategy.await_(page, remaining)
+
+
+SETTLE_STRATEGIES = [
+    "sleep",
+    "load",
+    "networkidle",
+    "dom_quiescence",
+    "hybrid",
+]
+
+
+@beartype
+def create_settle_strategy(name: str, max_wait: float) -> SettleStrategy:
+    match name:
+        case "sleep":
+            return SleepSettle(max_wait)
+        case "load":
+            return LoadStateSettle(max_wait, "load")
+        case "networkidle":
+            return LoadStateSettle(max_wait, "networkidle")
+        case "dom_quiescence":
+            return DOMQuiescenceSettle(max_wait)
+        case "hybrid":
+            return HybridSettle(
+                max_wait,
+                [
+                    LoadStateSettle(max_wait, "load"),
+                    DOMQuiescenceSettle(max_wait),
+                ],
+            )
+        case _:
+            raise ValueError(f"Unknown settle strategy {name}")
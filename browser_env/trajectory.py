@@ -1,6 +1,220 @@
-from typing import Union
+import operator
+import os
+import pickle
+import tempfile
+import zlib
+from collections.abc import Iterable, Iterator, Mapping
+from typing import IO, Any, SupportsIndex, Union, cast
 
 from .actions import Action
-from .utils import StateInfo
+from .utils import DetachedPage, Observation, Screenshot, StateInfo
 
 Trajectory = list[Union[StateInfo, Action]]
+
+
+def is_state(item: Any) -> bool:
+    return isinstance(item, Mapping) and "observation" in item
+
+
+def release_state(state: StateInfo) -> None:
+    state["info"]["page"].release()
+    observation = state["observation"]
+    if "image" in observation:
+        observation["image"] = Screenshot(None)
+
+
+def release_states(trajectory: Trajectory, keep_last: int) -> None:
+    """Drop the page html and the screenshot of the states older than the
+    `keep_last` latest ones, the urls and the text observations are kept.
+    Zero keeps every state"""
+    if keep_last <= 0:
+        return
+    states = trajectory[0::2]
+    for state in states[: max(len(states) - keep_last, 0)]:
+        release_state(state)  # type: ignore[arg-type]
+
+
+class SpillStore:
+    """Append only records in a temporary file, each one pickled and zlib
+    compressed, read back by offset"""
+
+    def __init__(self, spill_dir: str | None = None, level: int = 1) -> None:
+        self.spill_dir = spill_dir
+        self.level = level
+        self.file: IO[bytes] | None = None
+        self.size = 0
+
+    def put(self, record: Any) -> tuple[int, int]:
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(dir=self.spill_dir)
+        data = zlib.compress(
+            pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL),
+            self.level,
+        )
+        self.file.write(data)
+        self.file.flush()
+        offset = self.size
+        self.size += len(data)
+        return offset, len(data)
+
+    def get(self, ref: tuple[int, int]) -> Any:
+        assert self.file is not None
+        offset, length = ref
+        data = os.pread(self.file.fileno(), length, offset)
+        return pickle.loads(zlib.decompress(data))
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SpilledObservation(Mapping[str, Observation]):
+    """The observation of a spilled state, read back from the store on
+    every access"""
+
+    def __init__(
+        self, store: SpillStore, ref: tuple[int, int], keys: list[str]
+    ) -> None:
+        self.store = store
+        self.ref = ref
+        self._keys = keys
+
+    def load(self) -> dict[str, Observation]:
+        return cast(
+            dict[str, Observation], self.store.get(self.ref)["observation"]
+        )
+
+    def __getitem__(self, key: str) -> Observation:
+        if key not in self._keys:
+            raise KeyError(key)
+        return self.load()[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (dict, (self.load(),))
+
+
+class SpilledPage(DetachedPage):
+    """The url of a spilled state, its html is read back from the store"""
+
+    def __init__(
+        self, url: str, store: SpillStore, ref: tuple[int, int]
+    ) -> None:
+        super().__init__(url)
+        self.store = store
+        self.ref = ref
+
+    @property
+    def content(self) -> str:
+        return self.store.get(self.ref)["content"] or ""
+
+    async def afetch_content(self) -> str:
+        return self.content
+
+    def release(self) -> None:
+        pass
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DetachedPage):
+            return NotImplemented
+        return self.url == other.url and self.content == other.content
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (DetachedPage, (self.url, self.content))
+
+
+class BoundedTrajectory(Trajectory):
+    """A trajectory keeping the observations of its `keep_last` latest
+    states in memory.
+
+    The observations and the page html of the older states are spilled to
+    a compressed temporary file in `spill_dir` (or dropped, as by
+    `release_states`, without `spill`), their urls, errors and metadata
+    stay in memory. A spilled observation is read back when accessed, so
+    the list interface is unchanged.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[StateInfo | Action] = (),
+        keep_last: int = 1,
+        spill: bool = True,
+        spill_dir: str | None = None,
+    ) -> None:
+        super().__init__()
+        self.keep_last = max(keep_last, 1)
+        self.spill = spill
+        self.store = SpillStore(spill_dir)
+        self.state_indices: list[int] = []
+        self.num_bounded = 0
+        self.extend(items)
+
+    def append(self, item: StateInfo | Action) -> None:
+        super().append(item)
+        if is_state(item):
+            self.state_indices.append(len(self) - 1)
+            self.bound()
+
+    def extend(self, items: Iterable[StateInfo | Action]) -> None:
+        for item in items:
+            self.append(item)
+
+    # the signature of list.__iadd__, which mypy still reports against the
+    # generic overload of list.__add__
+    def __iadd__(  # type: ignore[override, misc]
+        self, items: Iterable[StateInfo | Action]
+    ) -> "BoundedTrajectory":
+        self.extend(items)
+        return self
+
+    def pop(self, index: SupportsIndex = -1) -> StateInfo | Action:
+        if operator.index(index) not in (-1, len(self) - 1):
+            raise IndexError(
+                "Only the last item of a trajectory can be popped"
+            )
+        item = super().pop()
+        if self.state_indices and self.state_indices[-1] == len(self):
+            self.state_indices.pop()
+            self.num_bounded = min(self.num_bounded, len(self.state_indices))
+        return item
+
+    def bound(self) -> None:
+        num_old = len(self.state_indices) - self.keep_last
+        while self.num_bounded < num_old:
+            index = self.state_indices[self.num_bounded]
+            self[index] = self.bound_state(cast(StateInfo, self[index]))
+            self.num_bounded += 1
+
+    def bound_state(self, state: StateInfo) -> StateInfo:
+        if not self.spill:
+            release_state(state)
+            return state
+        page = state["info"]["page"]
+        observation = dict(state["observation"])
+        # the html of a lazy page is lost once the page changed
+        content = page._content
+        ref = self.store.put({"observation": observation, "content": content})
+        return {
+            "observation": SpilledObservation(  # type: ignore[typeddict-item]
+                self.store, ref, list(observation)
+            ),
+            "info": {
+                **state["info"],
+                "page": SpilledPage(page.url, self.store, ref),
+            },
+        }
+
+    def close(self) -> None:
+        self.store.close()
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (list, (list(self),))
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+import threading
 from io import BytesIO
 from typing import Any, Dict, TypedDict, Union
 
@@ -6,12 +6,86 @@ import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from PIL import Image
+from playwright.async_api import Page as APage
+from playwright.sync_api import Page
+
+SCREENSHOT_MODES = ["eager", "lazy", "disabled"]
+
+
+PAGE_CONTENT_MODES = ["eager", "lazy", "disabled"]
 
 
-@dataclass
 class DetachedPage:
-    url: str
-    content: str  # html
+    """The url and the html of the page of a step.
+
+    With `page`, the html is only fetched when `content` is read, until the
+    next step `expire`s it: serializing the html costs megabytes over the
+    Playwright pipe, while the agents only read the url. With an async page,
+    `await afetch_content()` fetches it. `release` drops the html of the
+    older steps.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        content: str | None = None,
+        page: Page | APage | None = None,
+    ) -> None:
+        self.url = url
+        self._content = content
+        self.page = page
+        self.expired = False
+
+    def __repr__(self) -> str:
+        return f"DetachedPage(url={self.url!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DetachedPage):
+            return NotImplemented
+        return self.url == other.url and (self._content or "") == (
+            other._content or ""
+        )
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the live page does not cross processes
+        return {"url": self.url, "content": self._content or ""}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(state["url"], state["content"])  # type: ignore[misc]
+
+    def expire(self) -> None:
+        self.expired = True
+
+    def release(self) -> None:
+        self._content = None
+        self.page = None
+
+    def check_fetch(self) -> bool:
+        """Whether the html still has to be fetched"""
+        if self._content is not None or self.page is None:
+            return False
+        if self.expired:
+            raise RuntimeError(
+                "The page changed since the observation, its html can no longer be fetched"
+            )
+        return True
+
+    @property
+    def content(self) -> str:
+        """The html"""
+        if self.check_fetch():
+            if isinstance(self.page, APage):
+                raise RuntimeError(
+                    "The html of an async page is fetched with `await afetch_content()`"
+                )
+            self._content = self.page.content()  # type: ignore[union-attr]
+        return self._content or ""
+
+    async def afetch_content(self) -> str:
+        if self.check_fetch():
+            assert isinstance(self.page, APage)
+            self._content = await self.page.content()
+        return self._content or ""
 
 
 @beartype
@@ -60,9 +134,122 @@ class BrowserInfo(TypedDict):
 AccessibilityTree = list[AccessibilityTreeNode]
 
 
-Observation = str | npt.NDArray[np.uint8]
+class Screenshot:
+    """A screenshot of a page observation, taken on first access and decoded
+    at most once.
+
+    The page keeps changing, so the screenshot can only be taken until the
+    next observation, which `expire`s it. `page` is None when the
+    screenshots are disabled. With an async page, `await acapture()` takes
+    it. `image_format` (png or jpeg) and `quality` are the ones of
+    `page.screenshot`, `scale` below 1 shrinks the decoded array (cheaply for
+    jpeg, decoded at a reduced size).
+    """
+
+    def __init__(
+        self,
+        page: Page | APage | None,
+        image_format: str = "png",
+        quality: int | None = None,
+        scale: float = 1.0,
+    ) -> None:
+        self.page = page
+        self.image_format = image_format
+        self.options: dict[str, Any] = {"type": image_format}
+        if image_format == "jpeg" and quality is not None:
+            self.options["quality"] = quality
+        self.scale = scale
+        self.data: bytes | None = None
+        self.expired = False
+        self._array: npt.NDArray[np.uint8] | None = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the live page and the decoded array do not cross processes
+        state = self.__dict__.copy()
+        state.update(page=None, expired=True, _array=None)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.page is not None
+
+    def expire(self) -> None:
+        self.expired = True
+
+    def check_capture(self) -> bool:
+        """Whether the screenshot still has to be taken"""
+        if self.data is not None or self.page is None:
+            return False
+        if self.expired:
+            raise RuntimeError(
+                "The page changed since the observation, its screenshot can no longer be taken"
+            )
+        return True
+
+    def capture(self) -> bytes | None:
+        """The encoded screenshot, None when disabled"""
+        if self.check_capture():
+            if isinstance(self.page, APage):
+                raise RuntimeError(
+                    "The screenshot of an async page is taken with `await acapture()`"
+                )
+            try:
+                self.data = self.page.screenshot(**self.options)  # type: ignore[union-attr]
+            except:
+                self.page.wait_for_event("load")  # type: ignore[union-attr]
+                self.data = self.page.screenshot(**self.options)  # type: ignore[union-attr]
+        return self.data
+
+    async def acapture(self) -> bytes | None:
+        if self.check_capture():
+            assert isinstance(self.page, APage)
+            try:
+                self.data = await self.page.screenshot(**self.options)
+            except:
+                await self.page.wait_for_event("load")
+                self.data = await self.page.screenshot(**self.options)
+        return self.data
+
+    @property
+    def array(self) -> npt.NDArray[np.uint8]:
+        """The decoded screenshot, thread safe once captured"""
+        with self._lock:
+            if self._array is None:
+                data = self.capture()
+                if data is None:
+                    raise ValueError("The screenshots are disabled")
+                self._array = decode_screenshot(data, self.scale)
+            return self._array
+
+
+def decode_screenshot(
+    data: bytes, scale: float = 1.0
+) -> npt.NDArray[np.uint8]:
+    image: Image.Image = Image.open(BytesIO(data))
+    if scale < 1:
+        size = (round(image.width * scale), round(image.height * scale))
+        # jpeg is decoded at the closest larger reduction
+        image.draft("RGB", size)
+        if image.size != size:
+            image = image.resize(size)
+    return np.array(image)
+
+
+ImageObservation = npt.NDArray[np.uint8] | Screenshot
+Observation = str | ImageObservation
+
+
+class ObservationDict(TypedDict):
+    text: str
+    image: ImageObservation
 
 
 class StateInfo(TypedDict):
-    observation: dict[str, Observation]
+    observation: ObservationDict
     info: Dict[str, Any]
@@ -0,0 +1,18 @@
+from .registry import (
+    PROVIDERS,
+    LLMProvider,
+    get_provider,
+    register_provider,
+)
+
+# register the providers
+from . import mock_utils, openai_utils  # isort:skip
+
+__all__ = [
+    "PROVIDERS",
+    "LLMProvider",
+    "get_provider",
+    "register_provider",
+    "mock_utils",
+    "openai_utils",
+]
@@ -0,0 +1,345 @@
+"""A local stand-in for the LLM API, to load test the agent loop offline.
+
+The mock answers after `latency` seconds (the time to the first token) plus
+the time to stream the response at `tokens_per_second`, and fails with a rate
+limit error with probability `error_rate`. It is available in process, as the
+`mock` provider, and over HTTP as an OpenAI compatible server:
+
+    python -m llms.providers.mock_utils --port 8000 --latency 0.5
+    OPENAI_API_BASE=http://localhost:8000/v1 OPENAI_API_KEY=mock python run.py ...
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator
+
+import aiolimiter
+import openai.error
+
+from llms import lm_config
+
+from .openai_utils import retry_with_exponential_backoff
+from .registry import LLMProvider, register_provider
+
+# the agent keeps scrolling, which is valid on any page
+MOCK_RESPONSES = [
+    "Let's think step-by-step. The page is longer than the viewport. In summary, the next action I will perform is ```scroll [down]```",
+    "Let's think step-by-step. The page is longer than the viewport. In summary, the next action I will perform is ```scroll [up]```",
+]
+
+
+@dataclass
+class MockLLM:
+    latency: float = 0.5
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0
+    responses: list[str] = field(default_factory=lambda: MOCK_RESPONSES)
+    seed: int | None = None
+
+    def __post_init__(self) -> None:
+        self.rng = random.Random(self.seed)
+        self.num_calls = 0
+        self.num_samples = 0
+        self.num_cancelled = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        # about 4 characters per token for English text
+        return len(text) // 4 + 1
+
+    def next_response(self) -> tuple[str, float]:
+        """The response and the time to generate it, raises a rate limit
+        error with probability `error_rate`"""
+        responses, duration = self.next_responses(1)
+        return responses[0], duration
+
+    def next_responses(self, n: int) -> tuple[list[str], float]:
+        """`n` samples of one batched call, decoded in parallel, and the time
+        to generate them"""
+        with self.lock:
+            failed = self.rng.random() < self.error_rate
+            responses = [
+                self.responses[(self.num_samples + idx) % len(self.responses)]
+                for idx in range(n)
+            ]
+            self.num_samples += n
+            self.num_calls += 1
+        if failed:
+            raise openai.error.RateLimitError(  # type: ignore[no-untyped-call]
+                "Mock rate limit", http_status=429
+            )
+        duration = self.latency
+        if self.tokens_per_second > 0:
+            duration += (
+                max(self.count_tokens(response) for response in responses)
+                / self.tokens_per_second
+            )
+        return responses, duration
+
+    def stream(self, response: str) -> Iterator[tuple[str, float]]:
+        """The pieces of the response, one per token, with the time to wait
+        before each of them"""
+        token_time = (
+            1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        )
+        for idx in range(0, len(response), 4):
+            wait = token_time + (self.latency if idx == 0 else 0.0)
+            yield response[idx : idx + 4], wait
+
+    @classmethod
+    def from_gen_config(cls, gen_config: dict[str, Any]) -> "MockLLM":
+        responses = gen_config.get("mock_responses") or MOCK_RESPONSES
+        return cls(
+            latency=gen_config.get("mock_latency", 0.5),
+            tokens_per_second=gen_config.get("mock_tokens_per_second", 50.0),
+            error_rate=gen_config.get("mock_error_rate", 0.0),
+            responses=responses,
+        )
+
+
+@register_provider("mock")
+class MockProvider(LLMProvider):
+    """The mock in process, configured by the `mock_*` keys of the
+    gen_config. The errors are retried as the OpenAI ones are"""
+
+    def __init__(self) -> None:
+        self.mock: MockLLM | None = None
+
+    def get_mock(self, lm_config: lm_config.LMConfig) -> MockLLM:
+        if self.mock is None:
+            self.mock = MockLLM.from_gen_config(lm_config.gen_config)
+        return self.mock
+
+    def generate(self, lm_config: lm_config.LMConfig, prompt: Any) -> str:
+        @retry_with_exponential_backoff
+        def generate() -> str:
+            response, duration = self.get_mock(lm_config).next_response()
+            time.sleep(duration)
+            return response
+
+        answer: str = generate()
+        return answer
+
+    async def agenerate(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> str:
+        return await self.agenerate_stream(
+            lm_config, prompt, limiter, lambda text: False
+        )
+
+    def generate_n(
+        self, lm_config: lm_config.LMConfig, prompt: Any, n: int
+    ) -> list[str]:
+        @retry_with_exponential_backoff
+        def generate() -> list[str]:
+            responses, duration = self.get_mock(lm_config).next_responses(n)
+            time.sleep(duration)
+            return responses
+
+        answers: list[str] = generate()
+        return answers
+
+    async def agenerate_n(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        n: int,
+    ) -> list[str]:
+        async with limiter:
+            for _ in range(3):
+                try:
+                    responses, duration = self.get_mock(
+                        lm_config
+                    ).next_responses(n)
+                except openai.error.RateLimitError:
+                    await asyncio.sleep(10)
+                    continue
+                await asyncio.sleep(duration)
+                return responses
+        return []
+
+    def generate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        @retry_with_exponential_backoff
+        def generate() -> str:
+            mock = self.get_mock(lm_config)
+            full_response, _ = mock.next_response()
+            response = ""
+            for text, wait in mock.stream(full_response):
+                time.sleep(wait)
+                response += text
+                if should_stop(text):
+                    break
+            return response
+
+        answer: str = generate()
+        return answer
+
+    async def agenerate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        mock = self.get_mock(lm_config)
+        async with limiter:
+            for _ in range(3):
+                try:
+                    full_response, _ = mock.next_response()
+                except openai.error.RateLimitError:
+                    await asyncio.sleep(10)
+                    continue
+                response = ""
+                for text, wait in mock.stream(full_response):
+                    await asyncio.sleep(wait)
+                    response += text
+                    if should_stop(text):
+                        break
+                return response
+        return ""
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """Serve /v1/chat/completions and /v1/completions"""
+
+    mock: MockLLM
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        chat = self.path.endswith("/chat/completions")
+        if not chat and not self.path.endswith("/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        try:
+            responses, duration = self.mock.next_responses(request.get("n", 1))
+        except openai.error.RateLimitError as e:
+            self.send_json(
+                429, {"error": {"message": str(e), "type": "requests"}}
+            )
+            return
+        if request.get("stream"):
+            self.send_stream(chat, request, responses[0])
+            return
+
+        time.sleep(duration)
+        choices: list[dict[str, Any]] = []
+        for idx, response in enumerate(responses):
+            choice: dict[str, Any] = {"index": idx, "finish_reason": "stop"}
+            if chat:
+                choice["message"] = {"role": "assistant", "content": response}
+            else:
+                choice["text"] = response
+            choices.append(choice)
+        prompt = request.get("messages") if chat else request.get("prompt")
+        self.send_json(
+            200,
+            {
+                "id": f"mock-{self.mock.num_calls}",
+                "object": "chat.completion" if chat else "text_completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": choices,
+                "usage": {
+                    "prompt_tokens": self.mock.count_tokens(
+                        json.dumps(prompt)
+                    ),
+                    "completion_tokens": sum(
+                        self.mock.count_tokens(response)
+                        for response in responses
+                    ),
+                },
+            },
+        )
+
+    def send_stream(
+        self, chat: bool, request: dict[str, Any], response: str
+    ) -> None:
+        """Server-sent events, a client closing the connection cancels the
+        rest of the response"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for text, wait in self.mock.stream(response):
+                time.sleep(wait)
+                if chat:
+                    choice: dict[str, Any] = {"delta": {"content": text}}
+                else:
+                    choice = {"text": text}
+                chunk = {
+                    "object": "chat.completion.chunk"
+                    if chat
+                    else "text_completion",
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": None, **choice}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            with self.mock.lock:
+                self.mock.num_cancelled += 1
+
+    def send_json(self, status: int, body: dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def make_mock_server(
+    mock: MockLLM, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """An OpenAI compatible server, `port` 0 picks a free port. Run it with
+    `serve_forever`"""
+    handler = type("Handler", (MockOpenAIHandler,), {"mock": mock})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a mock of the OpenAI API"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tokens_per_second", type=float, default=50.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_mock_server(
+        MockLLM(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ),
+        args.host,
+        args.port,
+    )
+    print(f"Serving the mock OpenAI API on {server.server_address}")
+    server.serve_forever()
@@ -6,13 +6,89 @@ import logging
 import os
 import random
 import time
-from typing import Any
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    TypeVar,
+    cast,
+)
 
 import aiolimiter
 import openai
 import openai.error
 from tqdm.asyncio import tqdm_asyncio
 
+from llms import lm_config
+
+from .rate_limiter import estimate_tokens, get_rate_limiter
+from .registry import LLMProvider, register_provider
+from .response_cache import get_response_cache
+
+T = TypeVar("T", str, list[str])
+
+
+def is_cacheable(request: dict[str, Any]) -> bool:
+    """Only the greedy requests have a single answer worth replaying"""
+    return bool(request.get("temperature", 0.0) <= 0)
+
+
+def cached_generate(
+    api: str, request: dict[str, Any], generate: Callable[[], T]
+) -> T:
+    """Return the cached answer to `request`, or generate and cache it. The
+    empty answers are not cached, the throttled calls return them on errors.
+    The sampled requests (temperature > 0) bypass the cache, a stored sample
+    would be replayed on every retry and vote"""
+    cache = get_response_cache()
+    if cache is None or not is_cacheable(request):
+        return generate()
+    answer: T | None = cache.get(api, request)
+    if answer is None:
+        answer = generate()
+        if answer:
+            cache.put(api, request, answer)
+    return answer
+
+
+async def acached_generate(
+    api: str, request: dict[str, Any], agenerate: Callable[[], Awaitable[T]]
+) -> T:
+    """Async version of `cached_generate`"""
+    cache = get_response_cache()
+    if cache is None or not is_cacheable(request):
+        return await agenerate()
+    answer: T | None = cache.get(api, request)
+    if answer is None:
+        answer = await agenerate()
+        if answer:
+            cache.put(api, request, answer)
+    return answer
+
+
+def rate_limited_create(
+    create: Callable[..., Any],
+    api_input: str | list[dict[str, str]],
+    **kwargs: Any,
+) -> Any:
+    """Call `create` once the shared rate limiter allows it, the request
+    counts its prompt tokens plus `max_tokens` per sample as OpenAI does"""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return create(**kwargs)
+    model = kwargs.get("model", kwargs.get("engine"))
+    limiter.acquire(
+        estimate_tokens(api_input, model)
+        + kwargs["max_tokens"] * kwargs.get("n", 1)
+    )
+    try:
+        return create(**kwargs)
+    except openai.error.RateLimitError:
+        limiter.drain()
+        raise
+
 
 def retry_with_exponential_backoff(  # type: ignore
     func,
@@ -20,9 +96,11 @@ def retry_with_exponential_backoff(  # type: ignore
     exponential_base: float = 2,
     jitter: bool = True,
     max_retries: int = 10,
+    max_delay: float = 60,
     errors: tuple[Any] = (openai.error.RateLimitError,),
 ):
-    """Retry a function with exponential backoff."""
+    """Retry a function with exponential backoff, the delay is capped at
+    `max_delay` seconds."""
 
     def wrapper(*args, **kwargs):  # type: ignore
         # Initialize variables
@@ -47,10 +125,11 @@ def retry_with_exponential_backoff(  # type: ignore
                     )
 
                 # Increment the delay
-                delay *= exponential_base * (1 + jitter * random.random())
+                delay = min(delay * exponential_base, max_delay)
 
-                # Sleep for the delay
-                time.sleep(delay)
+                # Sleep for the delay, the jitter spreads the retries of
+                # the processes that failed together
+                time.sleep(delay * (1 - jitter * 0.5 * random.random()))
 
             # Raise exceptions for any errors not specified
             except Exception as e:
@@ -142,20 +221,34 @@ def generate_from_openai_completion(
     context_length: int,
     stop_token: str | None = None,
 ) -> str:
-    if "OPENAI_API_KEY" not in os.environ:
-        raise ValueError(
-            "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+    def generate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        response = rate_limited_create(
+            openai.Completion.create,
+            prompt,
+            prompt=prompt,
+            engine=engine,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=[stop_token],
         )
-    openai.api_key = os.environ["OPENAI_API_KEY"]
-    response = openai.Completion.create(  # type: ignore
-        prompt=prompt,
-        engine=engine,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p,
-        stop=[stop_token],
-    )
-    answer: str = response["choices"][0]["text"]
+        answer: str = response["choices"][0]["text"]
+        return answer
+
+    request = {
+        "model": engine,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "stop_token": stop_token,
+    }
+    answer: str = cached_generate("completion", request, generate)
     return answer
 
 
@@ -235,6 +328,85 @@ async def agenerate_from_openai_chat_completion(
     return [x["choices"][0]["message"]["content"] for x in responses]
 
 
+async def agenerate_one_from_openai_chat_completion(
+    messages: list[dict[str, str]],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    limiter: aiolimiter.AsyncLimiter,
+) -> str:
+    """Generate a single chat completion under a limiter shared by many
+    concurrent callers, e.g., the tasks of the async runner"""
+
+    async def agenerate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        response = await _throttled_openai_chat_completion_acreate(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            limiter=limiter,
+        )
+        answer: str = response["choices"][0]["message"]["content"]
+        return answer
+
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "stop_token": None,
+    }
+    answer: str = await acached_generate("chat", request, agenerate)
+    return answer
+
+
+async def agenerate_one_from_openai_completion(
+    prompt: str,
+    engine: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    limiter: aiolimiter.AsyncLimiter,
+) -> str:
+    async def agenerate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        response = await _throttled_openai_completion_acreate(
+            engine=engine,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            limiter=limiter,
+        )
+        answer: str = response["choices"][0].get("text", "")
+        return answer
+
+    request = {
+        "model": engine,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "stop_token": None,
+    }
+    answer: str = await acached_generate("completion", request, agenerate)
+    return answer
+
+
 @retry_with_exponential_backoff
 def generate_from_openai_chat_completion(
     messages: list[dict[str, str]],
@@ -245,21 +417,35 @@ def generate_from_openai_chat_completion(
     context_length: int,
     stop_token: str | None = None,
 ) -> str:
-    if "OPENAI_API_KEY" not in os.environ:
-        raise ValueError(
-            "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+    def generate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+
+        response = rate_limited_create(
+            openai.ChatCompletion.create,
+            messages,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=[stop_token] if stop_token else None,
         )
-    openai.api_key = os.environ["OPENAI_API_KEY"]
-
-    response = openai.ChatCompletion.create(  # type: ignore
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p,
-        stop=[stop_token] if stop_token else None,
-    )
-    answer: str = response["choices"][0]["message"]["content"]
+        answer: str = response["choices"][0]["message"]["content"]
+        return answer
+
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "stop_token": stop_token,
+    }
+    answer: str = cached_generate("chat", request, generate)
     return answer
 
 
@@ -281,3 +467,339 @@ def fake_generate_from_openai_chat_completion(
     openai.api_key = os.environ["OPENAI_API_KEY"]
     answer = "Let's think step-by-step. This page shows a list of links and buttons. There is a search box with the label 'Search query'. I will click on the search box to type the query. So the action I will perform is \"click [60]\"."
     return answer
+
+
+def _acreate(api: str) -> Callable[..., Awaitable[Any]]:
+    if api == "chat":
+        return cast(
+            Callable[..., Awaitable[Any]], openai.ChatCompletion.acreate
+        )
+    return cast(Callable[..., Awaitable[Any]], openai.Completion.acreate)
+
+
+def _chunk_text(chunk: dict[str, Any]) -> str:
+    if not chunk["choices"]:
+        return ""
+    choice = chunk["choices"][0]
+    if "delta" in choice:
+        text: str = choice["delta"].get("content") or ""
+    else:
+        text = choice.get("text") or ""
+    return text
+
+
+def read_stream(
+    chunks: Iterator[dict[str, Any]], should_stop: Callable[[str], bool]
+) -> str:
+    """Concatenate the streamed text until `should_stop` returns True for a
+    piece of text. Closing the stream drops the connection, which cancels the
+    rest of the generation"""
+    response = ""
+    for chunk in chunks:
+        text = _chunk_text(chunk)
+        response += text
+        if text and should_stop(text):
+            chunks.close()  # type: ignore[attr-defined]
+            break
+    return response
+
+
+async def aread_stream(
+    chunks: AsyncIterator[dict[str, Any]],
+    should_stop: Callable[[str], bool],
+) -> str:
+    """Async version of `read_stream`"""
+    response = ""
+    async for chunk in chunks:
+        text = _chunk_text(chunk)
+        response += text
+        if text and should_stop(text):
+            await chunks.aclose()  # type: ignore[attr-defined]
+            break
+    return response
+
+
+@retry_with_exponential_backoff
+def generate_from_openai_stream(
+    api: str, should_stop: Callable[[str], bool], **kwargs: Any
+) -> str:
+    """Stream a chat (`api` is `chat`) or completion (`completion`) response
+    until `should_stop`, `kwargs` are the arguments of the OpenAI call"""
+
+    def generate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        if api == "chat":
+            create = openai.ChatCompletion.create
+            api_input = kwargs["messages"]
+        else:
+            create = openai.Completion.create
+            api_input = kwargs["prompt"]
+        chunks = rate_limited_create(create, api_input, stream=True, **kwargs)
+        return read_stream(chunks, should_stop)
+
+    answer: str = cached_generate(f"{api}_stream", kwargs, generate)
+    return answer
+
+
+async def agenerate_one_from_openai_stream(
+    api: str,
+    should_stop: Callable[[str], bool],
+    limiter: aiolimiter.AsyncLimiter,
+    **kwargs: Any,
+) -> str:
+    """Async version of `generate_from_openai_stream`, under a limiter shared
+    by many concurrent callers"""
+
+    async def agenerate() -> str:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        acreate = _acreate(api)
+        async with limiter:
+            for _ in range(3):
+                try:
+                    chunks = await acreate(stream=True, **kwargs)
+                    return await aread_stream(chunks, should_stop)
+                except openai.error.RateLimitError:
+                    logging.warning(
+                        "OpenAI API rate limit exceeded. Sleeping for 10 seconds."
+                    )
+                    await asyncio.sleep(10)
+                except asyncio.exceptions.TimeoutError:
+                    logging.warning(
+                        "OpenAI API timeout. Sleeping for 10 seconds."
+                    )
+                    await asyncio.sleep(10)
+                except openai.error.APIError as e:
+                    logging.warning(f"OpenAI API error: {e}")
+                    break
+            return ""
+
+    answer: str = await acached_generate(f"{api}_stream", kwargs, agenerate)
+    return answer
+
+
+def _choice_text(choice: dict[str, Any]) -> str:
+    if "message" in choice:
+        text: str = choice["message"].get("content") or ""
+    else:
+        text = choice.get("text") or ""
+    return text
+
+
+@retry_with_exponential_backoff
+def generate_n_from_openai(api: str, n: int, **kwargs: Any) -> list[str]:
+    """Sample `n` chat (`api` is `chat`) or completion (`completion`)
+    responses in a single call, `kwargs` are the arguments of the OpenAI
+    call"""
+
+    def generate() -> list[str]:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        if api == "chat":
+            create = openai.ChatCompletion.create
+            api_input = kwargs["messages"]
+        else:
+            create = openai.Completion.create
+            api_input = kwargs["prompt"]
+        response = rate_limited_create(create, api_input, n=n, **kwargs)
+        return [_choice_text(choice) for choice in response["choices"]]
+
+    answers: list[str] = cached_generate(
+        f"{api}_n", {"n": n, **kwargs}, generate
+    )
+    return answers
+
+
+async def agenerate_n_from_openai(
+    api: str, n: int, limiter: aiolimiter.AsyncLimiter, **kwargs: Any
+) -> list[str]:
+    """Async version of `generate_n_from_openai`, under a limiter shared by
+    many concurrent callers"""
+
+    async def agenerate() -> list[str]:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+            )
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        acreate = _acreate(api)
+        async with limiter:
+            for _ in range(3):
+                try:
+                    response = await acreate(n=n, **kwargs)
+                    return [
+                        _choice_text(choice) for choice in response["choices"]
+                    ]
+                except openai.error.RateLimitError:
+                    logging.warning(
+                        "OpenAI API rate limit exceeded. Sleeping for 10 seconds."
+                    )
+                    await asyncio.sleep(10)
+                except asyncio.exceptions.TimeoutError:
+                    logging.warning(
+                        "OpenAI API timeout. Sleeping for 10 seconds."
+                    )
+                    await asyncio.sleep(10)
+                except openai.error.APIError as e:
+                    logging.warning(f"OpenAI API error: {e}")
+                    break
+            return []
+
+    answers: list[str] = await acached_generate(
+        f"{api}_n", {"n": n, **kwargs}, agenerate
+    )
+    return answers
+
+
+def _request_kwargs(
+    lm_config: lm_config.LMConfig, prompt: Any
+) -> dict[str, Any]:
+    kwargs = {
+        "temperature": lm_config.gen_config["temperature"],
+        "max_tokens": lm_config.gen_config["max_tokens"],
+        "top_p": lm_config.gen_config["top_p"],
+    }
+    if lm_config.mode == "chat":
+        return {"model": lm_config.model, "messages": prompt, **kwargs}
+    elif lm_config.mode == "completion":
+        stop_token = lm_config.gen_config["stop_token"]
+        return {
+            "engine": lm_config.model,
+            "prompt": prompt,
+            "stop": [stop_token] if stop_token else None,
+            **kwargs,
+        }
+    else:
+        raise ValueError(f"OpenAI models do not support mode {lm_config.mode}")
+
+
+@register_provider("openai")
+class OpenAIProvider(LLMProvider):
+    def generate(self, lm_config: lm_config.LMConfig, prompt: Any) -> str:
+        # the retried functions are untyped
+        if lm_config.mode == "chat":
+            return cast(
+                str,
+                generate_from_openai_chat_completion(
+                    messages=prompt,
+                    model=lm_config.model,
+                    temperature=lm_config.gen_config["temperature"],
+                    top_p=lm_config.gen_config["top_p"],
+                    context_length=lm_config.gen_config["context_length"],
+                    max_tokens=lm_config.gen_config["max_tokens"],
+                    stop_token=None,
+                ),
+            )
+        elif lm_config.mode == "completion":
+            return cast(
+                str,
+                generate_from_openai_completion(
+                    prompt=prompt,
+                    engine=lm_config.model,
+                    temperature=lm_config.gen_config["temperature"],
+                    max_tokens=lm_config.gen_config["max_tokens"],
+                    top_p=lm_config.gen_config["top_p"],
+                    context_length=lm_config.gen_config["context_length"],
+                    stop_token=lm_config.gen_config["stop_token"],
+                ),
+            )
+        else:
+            raise ValueError(
+                f"OpenAI models do not support mode {lm_config.mode}"
+            )
+
+    async def agenerate(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> str:
+        if lm_config.mode == "chat":
+            return await agenerate_one_from_openai_chat_completion(
+                messages=prompt,
+                model=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                limiter=limiter,
+            )
+        elif lm_config.mode == "completion":
+            return await agenerate_one_from_openai_completion(
+                prompt=prompt,
+                engine=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                limiter=limiter,
+            )
+        else:
+            raise ValueError(
+                f"OpenAI models do not support mode {lm_config.mode}"
+            )
+
+    def generate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        return cast(
+            str,
+            generate_from_openai_stream(
+                lm_config.mode,
+                should_stop,
+                **_request_kwargs(lm_config, prompt),
+            ),
+        )
+
+    async def agenerate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        return await agenerate_one_from_openai_stream(
+            lm_config.mode,  # type: ignore[arg-type]
+            should_stop,
+            limiter,
+            **_request_kwargs(lm_config, prompt),
+        )
+
+    def generate_n(
+        self, lm_config: lm_config.LMConfig, prompt: Any, n: int
+    ) -> list[str]:
+        return cast(
+            list[str],
+            generate_n_from_openai(
+                lm_config.mode,
+                n,
+                **_request_kwargs(lm_config, prompt),
+            ),
+        )
+
+    async def agenerate_n(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        n: int,
+    ) -> list[str]:
+        return await agenerate_n_from_openai(
+            lm_config.mode,  # type: ignore[arg-type]
+            n,
+            limiter,
+            **_request_kwargs(lm_config, prompt),
+        )
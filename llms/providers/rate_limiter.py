@@ -0,0 +1,130 @@
+"""A requests per minute and tokens per minute limiter shared by processes.
+
+The two token buckets live in a small json file guarded by a file lock, so
+that all the processes pointing to the same file (e.g., several run.py
+launched side by side) share one quota. Each bucket holds up to one minute
+of quota and refills continuously.
+"""
+import functools
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+import tiktoken
+from filelock import FileLock
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.core.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens(prompt: str | list[dict[str, str]], model: str) -> int:
+    """The prompt tokens, counted as the OpenAI cookbook does for the chat
+    messages (a few tokens of overhead per message)"""
+    encoding = get_encoding(model)
+    if isinstance(prompt, str):
+        return len(encoding.encode(prompt))
+    num_tokens = 3
+    for message in prompt:
+        num_tokens += 4
+        for value in message.values():
+            num_tokens += len(encoding.encode(value))
+    return num_tokens
+
+
+class TokenBucketLimiter:
+    """Block until `requests_per_minute` and `tokens_per_minute` allow a
+    request, zero disables a bucket"""
+
+    def __init__(
+        self,
+        state_path: str | Path,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.state_path = Path(state_path)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = FileLock(f"{self.state_path}.lock")
+        self.capacity = {
+            "requests": float(requests_per_minute),
+            "tokens": float(tokens_per_minute),
+        }
+        self.poll_interval = poll_interval
+        self.waited = 0.0
+
+    def read_state(self, now: float) -> dict[str, float]:
+        """The levels of the buckets, refilled up to `now`"""
+        try:
+            with open(self.state_path) as f:
+                state: dict[str, Any] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        elapsed = max(now - state.get("updated", now), 0.0)
+        levels = {}
+        for name, capacity in self.capacity.items():
+            level = state.get(name, capacity)
+            levels[name] = min(level + elapsed * capacity / 60, capacity)
+        return levels
+
+    def write_state(self, levels: dict[str, float], now: float) -> None:
+        with open(self.state_path, "w") as f:
+            json.dump({**levels, "updated": now}, f)
+
+    def try_acquire(self, num_tokens: int) -> float:
+        """Take the quota of one request of `num_tokens` tokens, return 0 on
+        success, otherwise the seconds to wait before the next try"""
+        costs = {"requests": 1.0, "tokens": float(num_tokens)}
+        with self.lock:
+            now = time.time()
+            levels = self.read_state(now)
+            wait = 0.0
+            for name, capacity in self.capacity.items():
+                if capacity <= 0:
+                    continue
+                # a request larger than the bucket waits for a full bucket
+                cost = min(costs[name], capacity)
+                if levels[name] < cost:
+                    wait = max(wait, (cost - levels[name]) * 60 / capacity)
+            if wait == 0.0:
+                for name, capacity in self.capacity.items():
+                    if capacity > 0:
+                        levels[name] -= min(costs[name], capacity)
+                self.write_state(levels, now)
+            return wait
+
+    def acquire(self, num_tokens: int = 0) -> None:
+        while True:
+            wait = self.try_acquire(num_tokens)
+            if wait == 0.0:
+                return
+            # the other processes compete for the same quota, check again
+            wait = max(wait, self.poll_interval)
+            self.waited += wait
+            time.sleep(wait)
+
+    def drain(self) -> None:
+        """Empty the buckets, e.g., after the API rejected a request, so that
+        every process backs off until they refill"""
+        with self.lock:
+            now = time.time()
+            self.write_state({name: 0.0 for name in self.capacity}, now)
+
+
+_rate_limiter: TokenBucketLimiter | None = None
+
+
+def set_rate_limiter(limiter: TokenBucketLimiter | None) -> None:
+    """Use `limiter` for the sync generate functions of this process, None
+    disables the limiter"""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def get_rate_limiter() -> TokenBucketLimiter | None:
+    return _rate_limiter
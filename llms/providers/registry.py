@@ -0,0 +1,94 @@
+"""The registry of the LLM providers, selected with `LMConfig.provider`"""
+import asyncio
+from typing import Any, Callable
+
+import aiolimiter
+
+from llms import lm_config
+
+
+class LLMProvider:
+    """Generate a response to a prompt built by the prompt constructor.
+
+    `api_format` tells the prompt constructor how to lay out the prompt, e.g.,
+    `openai` for the chat messages / completion string of the OpenAI API.
+    """
+
+    name = ""
+    api_format = "openai"
+
+    def generate(self, lm_config: lm_config.LMConfig, prompt: Any) -> str:
+        raise NotImplementedError
+
+    async def agenerate(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> str:
+        """Async version of `generate`, `limiter` is shared by all the
+        concurrent callers"""
+        raise NotImplementedError
+
+    def generate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        """Stream the response, feeding each piece of text to `should_stop`,
+        and cancel the generation once it returns True. Without streaming
+        support, the full response is generated"""
+        return self.generate(lm_config, prompt)
+
+    async def agenerate_stream(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        should_stop: Callable[[str], bool],
+    ) -> str:
+        """Async version of `generate_stream`"""
+        return await self.agenerate(lm_config, prompt, limiter)
+
+    def generate_n(
+        self, lm_config: lm_config.LMConfig, prompt: Any, n: int
+    ) -> list[str]:
+        """Sample `n` responses in one batched request. Without batching
+        support, the samples are generated one by one"""
+        return [self.generate(lm_config, prompt) for _ in range(n)]
+
+    async def agenerate_n(
+        self,
+        lm_config: lm_config.LMConfig,
+        prompt: Any,
+        limiter: aiolimiter.AsyncLimiter,
+        n: int,
+    ) -> list[str]:
+        """Async version of `generate_n`, without batching support the
+        samples are generated concurrently"""
+        return list(
+            await asyncio.gather(
+                *[self.agenerate(lm_config, prompt, limiter) for _ in range(n)]
+            )
+        )
+
+
+PROVIDERS: dict[str, type[LLMProvider]] = {}
+
+
+def register_provider(
+    name: str,
+) -> Callable[[type[LLMProvider]], type[LLMProvider]]:
+    def register(provider_cls: type[LLMProvider]) -> type[LLMProvider]:
+        provider_cls.name = name
+        PROVIDERS[name] = provider_cls
+        return provider_cls
+
+    return register
+
+
+def get_provider(name: str) -> LLMProvider:
+    if name not in PROVIDERS:
+        raise NotImplementedError(f"Provider {name} not implemented")
+    return PROVIDERS[name]()
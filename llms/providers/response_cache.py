@@ -0,0 +1,164 @@
+"""An on-disk cache of the LLM responses, keyed by the hash of the request.
+
+The cache is a SQLite database in WAL mode, so that the worker processes of a
+parallel run can share it: readers never block, and the writers wait for each
+other up to `timeout` seconds. Each process opens its own connection.
+
+Modes:
+    read_write: return the cached response when there is one, otherwise call
+        the API and store the response
+    read: return the cached response when there is one, never store
+    write: always call the API and store (refresh) the response
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+CACHE_MODES = ["read_write", "read", "write"]
+
+
+class ResponseCache:
+    """Cache the responses under `path`, keeping at most `max_entries` of
+    them. The least recently used entries are evicted first"""
+
+    def __init__(
+        self,
+        path: str | Path,
+        mode: str = "read_write",
+        max_entries: int = 100_000,
+        timeout: float = 30.0,
+    ) -> None:
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._pid = -1
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # a connection must not cross a fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access "
+                "ON responses (last_access)"
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(api: str, request: dict[str, Any]) -> str:
+        """The hash of the api (e.g., `chat`) with the model, the prompt and
+        the sampling parameters"""
+        payload = json.dumps(
+            {"api": api, **request}, sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, api: str, request: dict[str, Any]) -> Any | None:
+        if self.mode == "write":
+            return None
+        key = self.make_key(api, request)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 "
+                "WHERE key = ?",
+                (time.time(), key),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, api: str, request: dict[str, Any], response: Any) -> None:
+        if self.mode == "read":
+            return
+        key = self.make_key(api, request)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, last_access) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(response), time.time()),
+            )
+            self.writes += 1
+            self.evict()
+
+    def evict(self) -> None:
+        (num_entries,) = self.conn.execute(
+            "SELECT COUNT(*) FROM responses"
+        ).fetchone()
+        if num_entries <= self.max_entries:
+            return
+        cursor = self.conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+            (num_entries - self.max_entries,),
+        )
+        self.evictions += cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            (num_entries,) = self.conn.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+        return int(num_entries)
+
+    def stats(self) -> dict[str, int]:
+        """The counters of this process"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+_response_cache: ResponseCache | None = None
+
+
+def set_response_cache(cache: ResponseCache | None) -> None:
+    """Use `cache` for all the generate functions of this process, None
+    disables the cache"""
+    global _response_cache
+    if _response_cache is not None and _response_cache is not cache:
+        _response_cache.close()
+    _response_cache = cache
+
+
+def get_response_cache() -> ResponseCache | None:
+    return _response_cache
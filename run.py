@@ -1,16 +1,23 @@
 """Script to run end-to-end evaluation on the benchmark"""
 from __future__ import annotations
+
 import argparse
+import asyncio
 import glob
 import json
 import logging
+import multiprocessing
 import os
 import random
 import time
 from pathlib import Path
+from typing import Any
 
+import aiolimiter
 import openai
+import pandas as pd
 from beartype import beartype
+from filelock import FileLock
 
 from agent import (
     Agent,
@@ -19,9 +26,26 @@ from agent import (
     construct_agent,
 )
 from agent.prompts import *
+from agent.prompts.prompt_constructor import (
+    MESSAGE_LAYOUTS,
+    HistoricalPromptConstructor,
+)
+from agent.prompts.truncation import TRUNCATION_MODES
+from agent.retrieval import (
+    EMBEDDERS,
+    MEMORY_FORMATS,
+    RETRIEVAL_BACKENDS,
+    VectorStore,
+    create_vector_store,
+    summarize_trajectory,
+    task_sites,
+)
+from agent.retrieval.warm_start import warm_start
 from browser_env import (
     Action,
     ActionTypes,
+    AsyncScriptBrowserEnv,
+    BoundedTrajectory,
     ScriptBrowserEnv,
     StateInfo,
     Trajectory,
@@ -29,15 +53,27 @@ from browser_env import (
 )
 from browser_env.actions import is_equivalent
 from browser_env.helper_functions import (
+    SCREENSHOT_FORMATS,
     RenderHelper,
     get_action_description,
 )
-from evaluation_harness import evaluator_router
-
-# my modifications
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-import pandas as pd
+from browser_env.settle import SETTLE_STRATEGIES
+from browser_env.utils import (
+    PAGE_CONTENT_MODES,
+    SCREENSHOT_MODES,
+    Screenshot,
+)
+from evaluation_harness import StringEvaluator, evaluator_router
+from llms.providers.rate_limiter import (
+    TokenBucketLimiter,
+    set_rate_limiter,
+)
+from llms.providers.response_cache import (
+    CACHE_MODES,
+    ResponseCache,
+    get_response_cache,
+    set_response_cache,
+)
 
 LOG_FOLDER = "log_files"
 Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
@@ -59,6 +95,12 @@ formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 console_handler.setFormatter(formatter)
 file_handler.setFormatter(formatter)
 
+# the evaluation types which do not read the final page
+ANSWER_EVAL_TYPES = ["string_match"]
+
+DEFAULT_REQUESTS_PER_MINUTE = 300
+DEFAULT_RATE_LIMIT_FILE = "cache/openai_rate_limit.json"
+
 
 def config() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -90,7 +132,121 @@ def config() -> argparse.Namespace:
     parser.add_argument("--viewport_width", type=int, default=1280)
     parser.add_argument("--viewport_height", type=int, default=720)
     parser.add_argument("--save_trace_enabled", action="store_true")
-    parser.add_argument("--sleep_after_execution", type=float, default=2.5)
+    parser.add_argument(
+        "--screenshot_mode",
+        choices=SCREENSHOT_MODES,
+        default="lazy",
+        help=(
+            "`lazy` takes the screenshot of a step only when it is rendered, "
+            "`eager` at every step, `disabled` never"
+        ),
+    )
+    parser.add_argument(
+        "--screenshot_format",
+        choices=["png", "jpeg"],
+        default="png",
+        help="Format of the browser screenshots",
+    )
+    parser.add_argument(
+        "--screenshot_quality",
+        type=int,
+        default=None,
+        help="Quality of the jpeg browser screenshots",
+    )
+    parser.add_argument(
+        "--screenshot_scale",
+        type=float,
+        default=1.0,
+        help="Below 1, the decoded screenshots are shrunk by this factor",
+    )
+    parser.add_argument(
+        "--page_content_mode",
+        choices=PAGE_CONTENT_MODES,
+        default="lazy",
+        help=(
+            "`lazy` fetches the html of a step only when it is read, `eager` "
+            "at every step, `disabled` never"
+        ),
+    )
+    parser.add_argument(
+        "--state_retention",
+        type=int,
+        default=1,
+        help=(
+            "Number of latest states of a trajectory keeping their "
+            "observations and html in memory, 0 keeps all"
+        ),
+    )
+    parser.add_argument(
+        "--old_states",
+        choices=["spill", "release"],
+        default="spill",
+        help=(
+            "`spill` writes the observations and the html of the older states "
+            "to a compressed temporary file, `release` drops their html and "
+            "screenshot"
+        ),
+    )
+    parser.add_argument(
+        "--spill_dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory of the spilled states, the system temporary directory "
+            "by default"
+        ),
+    )
+    parser.add_argument(
+        "--render_screenshot_format",
+        choices=SCREENSHOT_FORMATS,
+        default="inline",
+        help=(
+            "`inline` embeds the screenshots of the render html as base64 "
+            "PNG, the other formats write them to render_{task_id}/ next to "
+            "it"
+        ),
+    )
+    parser.add_argument(
+        "--render_screenshot_quality",
+        type=int,
+        default=80,
+        help="Quality of the jpeg and webp screenshots",
+    )
+    parser.add_argument(
+        "--sleep_after_execution",
+        type=float,
+        default=2.5,
+        help=(
+            "Upper bound of the time to wait for the page to settle after "
+            "each action"
+        ),
+    )
+    parser.add_argument(
+        "--settle_strategy",
+        choices=SETTLE_STRATEGIES,
+        default="hybrid",
+        help=(
+            "How to wait for the page to settle, `sleep` always waits for the "
+            "full sleep_after_execution"
+        ),
+    )
+    parser.add_argument(
+        "--reuse_browser",
+        action="store_true",
+        help=(
+            "Launch the browser once per worker and only create a fresh "
+            "context per task"
+        ),
+    )
+    parser.add_argument(
+        "--record_snapshots_dir",
+        type=str,
+        default=None,
+        help=(
+            "Record the raw browser data of every observation, for offline "
+            "replay (see browser_env/replay.py)"
+        ),
+    )
 
     parser.add_argument("--max_steps", type=int, default=30)
 
@@ -103,19 +259,33 @@ def config() -> argparse.Namespace:
     )
     parser.add_argument(
         "--parsing_failure_th",
-        help="When concesecutive parsing failure exceeds this threshold, the agent will stop",
+        help=(
+            "When concesecutive parsing failure exceeds this threshold, the "
+            "agent will stop"
+        ),
         type=int,
         default=3,
     )
     parser.add_argument(
         "--repeating_action_failure_th",
-        help="When concesecutive repeating action exceeds this threshold, the agent will stop",
+        help=(
+            "When concesecutive repeating action exceeds this threshold, the "
+            "agent will stop"
+        ),
         type=int,
         default=3,
     )
 
     # lm config
-    parser.add_argument("--provider", type=str, default="openai")
+    parser.add_argument(
+        "--provider",
+        type=str,
+        default="openai",
+        help=(
+            "`mock` answers locally with the timing of the --mock_* flags, to "
+            "load test the loop offline"
+        ),
+    )
     parser.add_argument("--model", type=str, default="gpt-3.5-turbo-0613")
     parser.add_argument("--mode", type=str, default="chat")
     parser.add_argument("--temperature", type=float, default=1.0)
@@ -126,16 +296,229 @@ def config() -> argparse.Namespace:
     parser.add_argument(
         "--max_obs_length",
         type=int,
-        help="when not zero, will truncate the observation to this length before feeding to the model",
+        help=(
+            "when not zero, will truncate the observation to this length "
+            "before feeding to the model"
+        ),
         default=1920,
     )
+    parser.add_argument(
+        "--obs_truncation_mode",
+        choices=TRUNCATION_MODES,
+        default="line",
+        help=(
+            "`token` cuts after max_obs_length tokens, `line` keeps whole "
+            "lines, `priority` keeps the interactive nodes first"
+        ),
+    )
+    parser.add_argument(
+        "--max_history_length",
+        type=int,
+        default=0,
+        help=(
+            "when not zero, only the latest actions of the task history that "
+            "fit in this many tokens are kept"
+        ),
+    )
+    parser.add_argument(
+        "--max_retrieved_length",
+        type=int,
+        default=None,
+        help=(
+            "Only the retrieved examples that fit in this many tokens are "
+            "kept, max_obs_length by default, 0 keeps them all"
+        ),
+    )
+    parser.add_argument(
+        "--message_layout",
+        choices=MESSAGE_LAYOUTS,
+        default="default",
+        help=(
+            "`prefix_stable` moves the template values that change at every "
+            "step (e.g., the observation) to the end of the prompt, and the "
+            "fields of the examples the same way"
+        ),
+    )
+    parser.add_argument(
+        "--num_samples",
+        type=int,
+        default=1,
+        help=(
+            "When above one, sample this many responses in one batched "
+            "request and take the majority action"
+        ),
+    )
+    parser.add_argument(
+        "--stream_actions",
+        action="store_true",
+        help=(
+            "Stream the LLM responses and stop the generation as soon as a "
+            "complete action is parsed"
+        ),
+    )
+    parser.add_argument(
+        "--mock_latency",
+        type=float,
+        default=0.5,
+        help="Seconds before the first token of the mock provider",
+    )
+    parser.add_argument(
+        "--mock_tokens_per_second",
+        type=float,
+        default=50.0,
+        help="Output speed of the mock provider",
+    )
+    parser.add_argument(
+        "--mock_error_rate",
+        type=float,
+        default=0.0,
+        help="Probability of a rate limit error from the mock provider",
+    )
+    parser.add_argument(
+        "--response_cache",
+        type=str,
+        default=None,
+        help=(
+            "Path of the SQLite database caching the LLM responses, shared by "
+            "the parallel workers"
+        ),
+    )
+    parser.add_argument(
+        "--response_cache_mode",
+        choices=CACHE_MODES,
+        default="read_write",
+        help="`read` only serves the cached responses, `write` refreshes them",
+    )
+    parser.add_argument(
+        "--response_cache_max_entries",
+        type=int,
+        default=100_000,
+        help="The least recently used responses are evicted beyond this many",
+    )
+    parser.add_argument(
+        "--log_prompts",
+        action="store_true",
+        help="Log the full prompts and responses at the debug level",
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
     parser.add_argument("--test_end_idx", type=int, default=1000)
 
-
     parser.add_argument("--retrieval_top_k", type=int, default=None)
+    parser.add_argument(
+        "--retrieval_backend",
+        choices=RETRIEVAL_BACKENDS,
+        default="hybrid",
+        help=(
+            "`hybrid` mixes BM25 and embedding similarity, favours the "
+            "successful tasks of the same site and diversifies the results, "
+            "`local` is the embedding similarity only, `chroma` uses Chroma "
+            "with the OpenAI embeddings"
+        ),
+    )
+    parser.add_argument(
+        "--warm_start_dirs",
+        nargs="*",
+        default=[],
+        help=(
+            "Result directories of earlier runs, their finished tasks are "
+            "added to the vector DB before the first task"
+        ),
+    )
+    parser.add_argument(
+        "--retrieval_success_weight",
+        type=float,
+        default=0.1,
+        help=(
+            "Bonus of the hybrid backend for the tasks stored with a score of "
+            "1"
+        ),
+    )
+    parser.add_argument(
+        "--retrieval_mmr_lambda",
+        type=float,
+        default=0.9,
+        help=(
+            "Relevance / diversity trade-off of the hybrid backend, 1 "
+            "disables the diversification"
+        ),
+    )
+    parser.add_argument(
+        "--retrieval_embedder",
+        choices=EMBEDDERS,
+        default="hashing",
+        help="Embedder of the local backend",
+    )
+    parser.add_argument(
+        "--memory_format",
+        choices=MEMORY_FORMATS,
+        default="condensed",
+        help=(
+            "`condensed` stores each finished task as a compact record "
+            "(outcome, pages, deduplicated actions), `raw` stores its full "
+            "step by step history"
+        ),
+    )
+    parser.add_argument(
+        "--memory_summary",
+        action="store_true",
+        help=(
+            "Add an LLM summary to the condensed records, generated once when "
+            "the task is stored"
+        ),
+    )
+
+    # parallel execution
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes, each owning its own browser env and "
+            "agent"
+        ),
+    )
+
+    parser.add_argument(
+        "--async_tasks",
+        type=int,
+        default=0,
+        help=(
+            "When not zero, run this many tasks concurrently in one asyncio "
+            "event loop"
+        ),
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=None,
+        help=(
+            "LLM requests per minute shared by all the concurrent tasks "
+            f"({DEFAULT_REQUESTS_PER_MINUTE} by default), and by the "
+            "processes sharing --rate_limit_file"
+        ),
+    )
+    parser.add_argument(
+        "--tokens_per_minute",
+        type=int,
+        default=0,
+        help=(
+            "When not zero, LLM tokens per minute (prompt plus max_tokens) "
+            "shared by the processes sharing --rate_limit_file"
+        ),
+    )
+    parser.add_argument(
+        "--rate_limit_file",
+        type=str,
+        default=None,
+        help=(
+            "State of the rate limiter of the sync OpenAI calls, shared by "
+            "all the processes using it. The limiter is only on when this "
+            "file or a limit is given, the file defaults to "
+            f"{DEFAULT_RATE_LIMIT_FILE}"
+        ),
+    )
 
     # logging related
     parser.add_argument("--result_dir", type=str, default="")
@@ -149,6 +532,11 @@ def config() -> argparse.Namespace:
         raise ValueError(
             f"Action type {args.action_set_tag} is incompatible with the observation type {args.observation_type}"
         )
+    if args.num_samples > 1 and args.stream_actions:
+        raise ValueError(
+            "--stream_actions cannot stop early when voting over "
+            "--num_samples samples"
+        )
 
     return args
 
@@ -210,35 +598,293 @@ def early_stop(
     return False, ""
 
 
+def get_result_file_path(result_dir: str) -> str:
+    return f"{result_dir}/logged_results.csv"
+
+
+def load_results(result_file_path: str) -> pd.DataFrame:
+    if os.path.exists(result_file_path):
+        return pd.read_csv(result_file_path, index_col=0)
+    return pd.DataFrame(index=range(812), columns=["score"])
+
+
+def record_score(result_file_path: str, task_id: int, score: float) -> None:
+    """Write the score of a task to the shared results file.
+    The file is re-read under a lock so that concurrent workers do not
+    overwrite each other's results"""
+    with FileLock(f"{result_file_path}.lock"):
+        df = load_results(result_file_path)
+        df.loc[task_id, "score"] = score
+        df.to_csv(result_file_path)
+
+
+def create_vectordb(
+    args: argparse.Namespace, config_file_list: list[str]
+) -> VectorStore | None:
+    if not args.retrieval_top_k:
+        return None
+    options: dict[str, Any] = {}
+    if args.retrieval_backend == "chroma":
+        persist_directory = f"{args.result_dir}/vectordb"
+    else:
+        persist_directory = f"{args.result_dir}/vector_index"
+    if args.retrieval_backend == "hybrid":
+        options = {
+            "success_weight": args.retrieval_success_weight,
+            "mmr_lambda": args.retrieval_mmr_lambda,
+        }
+    vectordb = create_vector_store(
+        args.retrieval_backend,
+        persist_directory,
+        args.retrieval_embedder,
+        **options,
+    )
+    # the intents are both the queries and the stored texts
+    vectordb.pre_embed(
+        [load_task(config_file)[0] for config_file in config_file_list]
+    )
+    warm_start_dirs = list(args.warm_start_dirs or [])
+    if (
+        args.retrieval_backend != "chroma"
+        and vectordb.count() == 0
+        and os.path.isdir(f"{args.result_dir}/vectordb")
+    ):
+        # resuming a result directory of the Chroma store, its finished tasks
+        # are copied to the new index
+        warm_start_dirs.insert(0, args.result_dir)
+    if warm_start_dirs:
+        # the already stored tasks are skipped, the workers add them once
+        with FileLock(f"{args.result_dir}/vectordb.lock"):
+            warm_start(vectordb, warm_start_dirs)
+    return vectordb
+
+
+def retrieve_related_intents(
+    args: argparse.Namespace, vectordb: VectorStore, config_file: str
+) -> list[tuple[str, float, str]]:
+    """The finished tasks closest to the task of `config_file`, on the same
+    sites"""
+    intent, _ = load_task(config_file)
+    sites = load_task_sites(config_file)
+    related_intents = []
+    # the vector db is shared by all the workers
+    with FileLock(f"{args.result_dir}/vectordb.lock"):
+        k = min(vectordb.count(), args.retrieval_top_k)
+        docs = (
+            vectordb.similarity_search(intent, k=k, sites=sites) if k else []
+        )
+    if docs:
+        logger.info("[Retrieval] related intents:")
+        for doc in docs:
+            logger.info(doc.page_content)
+            related_intents.append(
+                (
+                    doc.page_content,
+                    doc.metadata["score"],
+                    doc.metadata["historical_actions_str"],
+                )
+            )
+    return related_intents
+
+
+def load_task(config_file: str) -> tuple[str, int]:
+    with open(config_file) as f:
+        _c = json.load(f)
+        intent = _c["intent"]
+        task_id = _c["task_id"]
+    return intent, task_id
+
+
+def load_task_sites(config_file: str) -> list[str]:
+    with open(config_file) as f:
+        return task_sites(json.load(f))
+
+
+def is_answer_evaluated(config_file: str) -> bool:
+    """Whether the evaluation of the task only reads its answer, the other
+    evaluators read the final page"""
+    with open(config_file) as f:
+        eval_types = json.load(f)["eval"]["eval_types"]
+    return all(eval_type in ANSWER_EVAL_TYPES for eval_type in eval_types)
+
+
+def evaluate_answer(config_file: str, trajectory: Trajectory) -> float:
+    """The score of a task evaluated on its answer, without its page"""
+    assert is_answer_evaluated(config_file)
+    evaluator = StringEvaluator()
+    return evaluator(trajectory=trajectory, config_file=config_file)
+
+
+def record_action(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    action: Action,
+    state_info: StateInfo,
+    meta_data: dict[str, Any],
+    render_helper: RenderHelper,
+) -> None:
+    """Render the step and add the action to the action history"""
+    action_str = get_action_description(
+        action,
+        state_info["info"]["observation_metadata"],
+        action_set_tag=args.action_set_tag,
+        prompt_constructor=agent.prompt_constructor
+        if isinstance(agent, PromptAgent)
+        else None,
+    )
+    render_helper.render(action, state_info, meta_data, args.render_screenshot)
+    meta_data["action_history"].append(action_str)
+
+
+def log_settle_times(settle_times: list[float]) -> None:
+    logger.info(
+        f"[Settle time] mean {sum(settle_times) / len(settle_times):.3f}s, "
+        f"max {max(settle_times):.3f}s over {len(settle_times)} steps"
+    )
+
+
+def construct_memory(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    intent: str,
+    trajectory: Trajectory,
+    meta_data: dict[str, Any],
+    score: float,
+) -> str:
+    """The history of a finished task, as stored in the vector DB"""
+    assert isinstance(agent, PromptAgent)
+    prompt_constructor = agent.prompt_constructor
+    # the vector DB tasks use the history of a historical prompt
+    assert isinstance(prompt_constructor, HistoricalPromptConstructor)
+    if args.memory_format == "raw":
+        return prompt_constructor.construct_history(trajectory, meta_data)
+
+    record = prompt_constructor.construct_condensed_history(
+        trajectory, meta_data, score
+    )
+    if args.memory_summary:
+        try:
+            summary = summarize_trajectory(agent.lm_config, intent, record)
+        except openai.error.OpenAIError as e:
+            logger.info(f"[Memory] no summary: {repr(e)}")
+        else:
+            record = prompt_constructor.construct_condensed_history(
+                trajectory, meta_data, score, summary=summary
+            )
+    return record
+
+
+def finish_task(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    vectordb: VectorStore | None,
+    config_file: str,
+    trajectory: Trajectory,
+    meta_data: dict[str, Any],
+    score: float,
+) -> None:
+    """Store the score of a finished task and its history for retrieval"""
+    intent, task_id = load_task(config_file)
+    record_score(get_result_file_path(args.result_dir), task_id, score)
+
+    # pass historical_actions_str here
+
+    if vectordb is not None:
+        historical_actions_str = construct_memory(
+            args, agent, intent, trajectory, meta_data, score
+        )
+        with FileLock(f"{args.result_dir}/vectordb.lock"):
+            vectordb.add_texts(
+                texts=[intent],
+                metadatas=[
+                    {
+                        "score": score,
+                        "task_id": task_id,
+                        "sites": ",".join(load_task_sites(config_file)),
+                        "historical_actions_str": historical_actions_str,
+                    }
+                ],
+            )
+    # the memory is built, the spilled states are no longer read
+    close_trajectory(trajectory)
+
+    if score == 1:
+        logger.info(f"[Result] (PASS) {config_file}")
+    else:
+        logger.info(f"[Result] (FAIL) {config_file}")
+
+
+def log_error(
+    args: argparse.Namespace, config_file: str, e: Exception
+) -> None:
+    if isinstance(e, openai.error.OpenAIError):
+        logger.info(f"[OpenAI Error] {repr(e)}")
+        return
+
+    logger.info(f"[Unhandled Error] {repr(e)}]")
+    import traceback
+
+    # write to error file
+    with open(Path(args.result_dir) / "error.txt", "a") as f:
+        f.write(f"[Config file]: {config_file}\n")
+        f.write(f"[Unhandled Error] {repr(e)}\n")
+        f.write(traceback.format_exc())  # write stack trace to file
+
+
+def create_trajectory(args: argparse.Namespace) -> Trajectory:
+    """An empty trajectory, bounded by `--state_retention`"""
+    if args.state_retention <= 0:
+        return []
+    return BoundedTrajectory(
+        keep_last=args.state_retention,
+        spill=args.old_states == "spill",
+        spill_dir=args.spill_dir,
+    )
+
+
+def close_render(
+    args: argparse.Namespace, config_file: str, render_helper: RenderHelper
+) -> None:
+    """Wait for the pending render writes, a failed write is logged like an
+    error of the task instead of stopping the remaining tasks"""
+    try:
+        render_helper.close()
+    except Exception as e:
+        log_error(args, config_file, e)
+
+
+def close_trajectory(trajectory: Trajectory) -> None:
+    """Remove the spill file of a bounded trajectory"""
+    if isinstance(trajectory, BoundedTrajectory):
+        trajectory.close()
+
+
+def get_early_stop_thresholds(args: argparse.Namespace) -> dict[str, int]:
+    return {
+        "parsing_failure": args.parsing_failure_th,
+        "repeating_action": args.repeating_action_failure_th,
+    }
+
+
 @beartype
 def test(
     args: argparse.Namespace,
     agent: Agent | PromptAgent | TeacherForcingAgent,
     config_file_list: list[str],
-) -> None:
+) -> list[float]:
     scores = []
     max_steps = args.max_steps
 
     # my mods
-    RESULT_FILE_PATH = f"{args.result_dir}/logged_results.csv"
+    RESULT_FILE_PATH = get_result_file_path(args.result_dir)
     if os.path.exists(RESULT_FILE_PATH):
-        print('results file exists, resuming from there')
-        df = pd.read_csv(RESULT_FILE_PATH, index_col=0)
+        print("results file exists, resuming from there")
     else:
-        print('create new results file')
-        df = pd.DataFrame(index=range(812), columns=['score'])
-
-    if args.retrieval_top_k:
-        vectordb = Chroma(
-                collection_name="tasks",
-                embedding_function=OpenAIEmbeddings(),
-                persist_directory=f"{args.result_dir}/vectordb"
-        )
+        print("create new results file")
 
-    early_stop_thresholds = {
-        "parsing_failure": args.parsing_failure_th,
-        "repeating_action": args.repeating_action_failure_th,
-    }
+    vectordb = create_vectordb(args, config_file_list)
+
+    early_stop_thresholds = get_early_stop_thresholds(args)
 
     env = ScriptBrowserEnv(
         headless=not args.render,
@@ -251,43 +897,48 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        reuse_browser=args.reuse_browser,
+        settle_strategy=args.settle_strategy,
+        record_snapshots_dir=args.record_snapshots_dir,
+        screenshot_mode=args.screenshot_mode,
+        screenshot_format=args.screenshot_format,
+        screenshot_quality=args.screenshot_quality,
+        screenshot_scale=args.screenshot_scale,
+        page_content_mode=args.page_content_mode,
     )
 
     for config_file in config_file_list:
+        trajectory: Trajectory = []
         try:
             render_helper = RenderHelper(
-                config_file, args.result_dir, args.action_set_tag
+                config_file,
+                args.result_dir,
+                args.action_set_tag,
+                args.render_screenshot_format,
+                args.render_screenshot_quality,
             )
 
             # get intent
-            with open(config_file) as f:
-                _c = json.load(f)
-                intent = _c["intent"]
-                task_id = _c["task_id"]
+            intent, task_id = load_task(config_file)
 
             logger.info(f"[Config file]: {config_file}")
             logger.info(f"[Intent]: {intent}")
 
             agent.reset(config_file)
-            trajectory: Trajectory = []
+            trajectory = create_trajectory(args)
             obs, info = env.reset(options={"config_file": config_file})
             state_info: StateInfo = {"observation": obs, "info": info}
             trajectory.append(state_info)
+            settle_times = [info["settle_time"]]
 
-            meta_data = {"action_history": ["None"]}
+            meta_data: dict[str, Any] = {"action_history": ["None"]}
 
             # vectordb
-            related_intents = []
-            if args.retrieval_top_k:
-                k = min(vectordb._collection.count(), args.retrieval_top_k)
-                if k:
-                    docs = vectordb.similarity_search(intent, k=k)
-                    print('related intents: \n')
-                    for doc in docs:
-                        print(doc.page_content + '\n')
-                        related_intents.append((doc.page_content, doc.metadata["score"], doc.metadata["historical_actions_str"]))
+            if vectordb is not None:
                 # pass related_intents to agent
-                meta_data["related_intents"] = related_intents
+                meta_data["related_intents"] = retrieve_related_intents(
+                    args, vectordb, config_file
+                )
 
             while True:
                 early_stop_flag, stop_info = early_stop(
@@ -306,19 +957,9 @@ def test(
                         action = create_stop_action(f"ERROR: {str(e)}")
 
                 trajectory.append(action)
-
-                action_str = get_action_description(
-                    action,
-                    state_info["info"]["observation_metadata"],
-                    action_set_tag=args.action_set_tag,
-                    prompt_constructor=agent.prompt_constructor
-                    if isinstance(agent, PromptAgent)
-                    else None,
+                record_action(
+                    args, agent, action, state_info, meta_data, render_helper
                 )
-                render_helper.render(
-                    action, state_info, meta_data, args.render_screenshot
-                )
-                meta_data["action_history"].append(action_str)
 
                 if action["action_type"] == ActionTypes.STOP:
                     break
@@ -326,12 +967,16 @@ def test(
                 obs, _, terminated, _, info = env.step(action)
                 state_info = {"observation": obs, "info": info}
                 trajectory.append(state_info)
+                settle_times.append(info["settle_time"])
+                logger.debug(f"[Settle time] {info['settle_time']:.3f}s")
 
                 if terminated:
                     # add a action place holder
                     trajectory.append(create_stop_action(""))
                     break
 
+            log_settle_times(settle_times)
+
             evaluator = evaluator_router(config_file)
             score = evaluator(
                 trajectory=trajectory,
@@ -341,47 +986,324 @@ def test(
             )
 
             scores.append(score)
-
-            df.score[task_id] = score
-            df.to_csv(RESULT_FILE_PATH)
-
-            # pass historical_actions_str here
-
-            if args.retrieval_top_k:
-                historical_actions_str = agent.prompt_constructor.construct_history(trajectory, meta_data)
-                vectordb.add_texts(texts=[intent], metadatas=[{"score": score, "task_id": task_id, "historical_actions_str": historical_actions_str}])
-
-            if score == 1:
-                logger.info(f"[Result] (PASS) {config_file}")
-            else:
-                logger.info(f"[Result] (FAIL) {config_file}")
+            finish_task(
+                args,
+                agent,
+                vectordb,
+                config_file,
+                trajectory,
+                meta_data,
+                score,
+            )
 
             if args.save_trace_enabled:
                 env.save_trace(
                     Path(args.result_dir) / "traces" / f"{task_id}.zip"
                 )
 
-        except openai.error.OpenAIError as e:
-            logger.info(f"[OpenAI Error] {repr(e)}")
         except Exception as e:
-            logger.info(f"[Unhandled Error] {repr(e)}]")
-            import traceback
+            log_error(args, config_file, e)
 
-            # write to error file
-            with open(Path(args.result_dir) / "error.txt", "a") as f:
-                f.write(f"[Config file]: {config_file}\n")
-                f.write(f"[Unhandled Error] {repr(e)}\n")
-                f.write(traceback.format_exc())  # write stack trace to file
-
-        render_helper.close()
+        close_render(args, config_file, render_helper)
+        close_trajectory(trajectory)
 
     env.close()
-    logger.info(f"Average score: {sum(scores) / len(scores)}")
-    print(f'df stats: len: {len(df.index)} avg: {df.score.mean()} number of nan: {df.score.isnull().sum()}')
-    has_gitlab_df = pd.read_csv('has_gitlab.csv', index_col=0)
+    return scores
+
+
+async def arun_task(
+    args: argparse.Namespace,
+    agent: PromptAgent,
+    env: AsyncScriptBrowserEnv,
+    vectordb: VectorStore | None,
+    config_file: str,
+    limiter: aiolimiter.AsyncLimiter,
+) -> float:
+    render_helper = RenderHelper(
+        config_file,
+        args.result_dir,
+        args.action_set_tag,
+        args.render_screenshot_format,
+        args.render_screenshot_quality,
+    )
+    trajectory: Trajectory = []
+    try:
+        intent, task_id = load_task(config_file)
+        logger.info(f"[Config file]: {config_file}")
+        logger.info(f"[Intent]: {intent}")
+
+        agent.reset(config_file)
+        trajectory = create_trajectory(args)
+        obs, info = await env.areset(options={"config_file": config_file})
+        state_info: StateInfo = {"observation": obs, "info": info}
+        trajectory.append(state_info)
+        settle_times = [info["settle_time"]]
+
+        meta_data: dict[str, Any] = {"action_history": ["None"]}
+        # the file locks, the disk and the LLM calls of the bookkeeping
+        # block, they run in threads to not stall the other tasks
+        if vectordb is not None:
+            meta_data["related_intents"] = await asyncio.to_thread(
+                retrieve_related_intents, args, vectordb, config_file
+            )
+
+        early_stop_thresholds = get_early_stop_thresholds(args)
+        while True:
+            early_stop_flag, stop_info = early_stop(
+                trajectory, args.max_steps, early_stop_thresholds
+            )
+
+            if early_stop_flag:
+                action = create_stop_action(f"Early stop: {stop_info}")
+            else:
+                try:
+                    action = await agent.anext_action(
+                        trajectory, intent, meta_data, limiter
+                    )
+                except ValueError as e:
+                    action = create_stop_action(f"ERROR: {str(e)}")
+
+            trajectory.append(action)
+            if args.render_screenshot:
+                image = state_info["observation"]["image"]
+                # the render can not take the screenshot of an async page
+                if isinstance(image, Screenshot):
+                    await image.acapture()
+            record_action(
+                args, agent, action, state_info, meta_data, render_helper
+            )
+
+            if action["action_type"] == ActionTypes.STOP:
+                break
+
+            obs, _, terminated, _, info = await env.astep(action)
+            state_info = {"observation": obs, "info": info}
+            trajectory.append(state_info)
+            settle_times.append(info["settle_time"])
+
+            if terminated:
+                trajectory.append(create_stop_action(""))
+                break
+
+        log_settle_times(settle_times)
+        if args.save_trace_enabled:
+            await env.asave_trace(
+                Path(args.result_dir) / "traces" / f"{task_id}.zip"
+            )
+
+        # the answer of the task is checked without its page, the llm
+        # fuzzy match blocks
+        score = await asyncio.to_thread(
+            evaluate_answer, config_file, trajectory
+        )
+        await asyncio.to_thread(
+            finish_task,
+            args,
+            agent,
+            vectordb,
+            config_file,
+            trajectory,
+            meta_data,
+            score,
+        )
+        return score
+    finally:
+        # waits for the pending render writes
+        await asyncio.to_thread(close_render, args, config_file, render_helper)
+        close_trajectory(trajectory)
+
+
+async def atest(
+    args: argparse.Namespace,
+    agent: PromptAgent,
+    config_file_list: list[str],
+) -> list[float]:
+    """Run `args.async_tasks` tasks concurrently in one event loop.
+    Each concurrent slot owns an AsyncScriptBrowserEnv, and all the LLM calls
+    go through one shared rate limiter, so that the LLM latency of a task
+    overlaps with the browser work of the others.
+    The evaluators drive a sync page, the tasks evaluated on their final
+    page are refused, see `run_async`"""
+    live_page_files = [
+        config_file
+        for config_file in config_file_list
+        if not is_answer_evaluated(config_file)
+    ]
+    if live_page_files:
+        raise ValueError(
+            f"The evaluation of {live_page_files} reads the final page, "
+            "which the async runner cannot evaluate"
+        )
+    vectordb = create_vectordb(args, config_file_list)
+    limiter = aiolimiter.AsyncLimiter(
+        args.requests_per_minute or DEFAULT_REQUESTS_PER_MINUTE
+    )
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for config_file in config_file_list:
+        queue.put_nowait(config_file)
+    scores: list[float] = []
+
+    async def worker() -> None:
+        env = AsyncScriptBrowserEnv(
+            headless=not args.render,
+            slow_mo=args.slow_mo,
+            observation_type=args.observation_type,
+            current_viewport_only=args.current_viewport_only,
+            viewport_size={
+                "width": args.viewport_width,
+                "height": args.viewport_height,
+            },
+            save_trace_enabled=args.save_trace_enabled,
+            sleep_after_execution=args.sleep_after_execution,
+            settle_strategy=args.settle_strategy,
+            record_snapshots_dir=args.record_snapshots_dir,
+            screenshot_mode=args.screenshot_mode,
+            screenshot_format=args.screenshot_format,
+            screenshot_quality=args.screenshot_quality,
+            screenshot_scale=args.screenshot_scale,
+            page_content_mode=args.page_content_mode,
+        )
+        try:
+            while not queue.empty():
+                config_file = queue.get_nowait()
+                try:
+                    score = await arun_task(
+                        args,
+                        agent,
+                        env,
+                        vectordb,
+                        config_file,
+                        limiter,
+                    )
+                    scores.append(score)
+                except Exception as e:
+                    log_error(args, config_file, e)
+        finally:
+            await env.aclose()
+
+    num_slots = min(args.async_tasks, len(config_file_list))
+    await asyncio.gather(*[worker() for _ in range(num_slots)])
+    return scores
+
+
+def run_async(
+    args: argparse.Namespace,
+    agent: PromptAgent,
+    config_file_list: list[str],
+) -> list[float]:
+    """Run the tasks evaluated on their answer with `atest`. The other ones
+    (url_match, program_html) are evaluated on the final page, with its
+    unsubmitted forms and its tabs, which only the sync runner keeps. They
+    run in `test` once the async tasks are done"""
+    async_files = [
+        config_file
+        for config_file in config_file_list
+        if is_answer_evaluated(config_file)
+    ]
+    sync_files = [
+        config_file
+        for config_file in config_file_list
+        if config_file not in async_files
+    ]
+    scores = []
+    if async_files:
+        scores += asyncio.run(atest(args, agent, async_files))
+    if sync_files:
+        logger.info(
+            f"[Async] {len(sync_files)} tasks evaluated on their final page "
+            "run in the sync runner"
+        )
+        scores += test(args, agent, sync_files)
+    return scores
+
+
+def set_log_levels(args: argparse.Namespace) -> None:
+    if args.log_prompts:
+        logging.getLogger("logger.prompt_constructor").setLevel(logging.DEBUG)
+
+
+def setup_response_cache(args: argparse.Namespace) -> None:
+    """Each process opens its own connection to the shared cache"""
+    if args.response_cache:
+        set_response_cache(
+            ResponseCache(
+                args.response_cache,
+                mode=args.response_cache_mode,
+                max_entries=args.response_cache_max_entries,
+            )
+        )
+
+
+def setup_rate_limiter(args: argparse.Namespace) -> None:
+    """The processes share the quota through `args.rate_limit_file`.
+    The limiter is opt-in, it reads and writes the file at every LLM call"""
+    if args.provider != "openai":
+        return
+    if (
+        args.requests_per_minute is None
+        and not args.tokens_per_minute
+        and args.rate_limit_file is None
+    ):
+        return
+    set_rate_limiter(
+        TokenBucketLimiter(
+            args.rate_limit_file or DEFAULT_RATE_LIMIT_FILE,
+            requests_per_minute=args.requests_per_minute
+            or DEFAULT_REQUESTS_PER_MINUTE,
+            tokens_per_minute=args.tokens_per_minute,
+        )
+    )
+
+
+def log_response_cache_stats() -> None:
+    cache = get_response_cache()
+    if cache is not None:
+        logger.info(f"[Response cache] {cache.stats()}")
+
+
+def run_worker(
+    args: argparse.Namespace, config_file_list: list[str]
+) -> list[float]:
+    """Entry point of a worker process, which owns its own browser env and
+    agent"""
+    with open(os.path.join(args.result_dir, "log_files.txt"), "a+") as f:
+        f.write(f"{LOG_FILE_NAME}\n")
+    set_log_levels(args)
+    setup_response_cache(args)
+    setup_rate_limiter(args)
+    agent = construct_agent(args)
+    scores = test(args, agent, config_file_list)
+    log_response_cache_stats()
+    return scores
+
+
+def run_parallel(
+    args: argparse.Namespace, config_file_list: list[str]
+) -> list[float]:
+    """Shard the config files across `args.num_workers` processes"""
+    num_workers = min(args.num_workers, len(config_file_list))
+    # round robin keeps the task order within each shard
+    shards = [config_file_list[i::num_workers] for i in range(num_workers)]
+    # playwright does not survive a fork, start fresh interpreters instead
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=num_workers) as pool:
+        results = pool.starmap(run_worker, [(args, shard) for shard in shards])
+    return [score for scores in results for score in scores]
+
+
+def summarize(args: argparse.Namespace, scores: list[float]) -> None:
+    if scores:
+        logger.info(f"Average score: {sum(scores) / len(scores)}")
+    df = load_results(get_result_file_path(args.result_dir))
+    print(
+        f"df stats: len: {len(df.index)} avg: {df.score.mean()} number of nan: {df.score.isnull().sum()}"
+    )
+    has_gitlab_df = pd.read_csv("has_gitlab.csv", index_col=0)
     df = df[~has_gitlab_df.has_gitlab]
-    print('after filtering')
-    print(f'df stats: len: {len(df.index)} avg: {df.score.mean()} number of nan: {df.score.isnull().sum()}')
+    print("after filtering")
+    print(
+        f"df stats: len: {len(df.index)} avg: {df.score.mean()} number of nan: {df.score.isnull().sum()}"
+    )
 
 
 def prepare(args: argparse.Namespace) -> None:
@@ -435,6 +1357,9 @@ if __name__ == "__main__":
     args = config()
     # args.sleep_after_execution = 2.5
     prepare(args)
+    set_log_levels(args)
+    setup_response_cache(args)
+    setup_rate_limiter(args)
 
     test_file_list = []
     st_idx = args.test_start_idx
@@ -450,5 +1375,14 @@ if __name__ == "__main__":
     args.current_viewport_only = True
     dump_config(args)
 
-    agent = construct_agent(args)
-    test(args, agent, test_file_list)
+    if args.async_tasks > 0:
+        agent = construct_agent(args)
+        assert isinstance(agent, PromptAgent), "async runs need a prompt agent"
+        scores = run_async(args, agent, test_file_list)
+    elif args.num_workers > 1 and len(test_file_list) > 1:
+        scores = run_parallel(args, test_file_list)
+    else:
+        agent = construct_agent(args)
+        scores = test(args, agent, test_file_list)
+    log_response_cache_stats()
+    summarize(args, scores)
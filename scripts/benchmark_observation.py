@@ -0,0 +1,176 @@
+"""Benchmark the text observation pipeline without a browser.
+
+Snapshots are the steps recorded by browser_env.replay.SnapshotRecorder
+(e.g., with `run.py --record_snapshots_dir`), see browser_env/replay.py.
+When no snapshot is given, large synthetic pages are generated instead.
+Plain Accessibility.getFullAXTree dumps (json or json.gz, either the response
+or its "nodes") can be given with --ax_trees to only time the tree parsing.
+
+Usage:
+    python scripts/benchmark_observation.py --snapshots path/to/*.json.gz
+    python scripts/benchmark_observation.py --ax_trees path/to/*.json
+    python scripts/benchmark_observation.py --num_nodes 20000 50000
+"""
+import argparse
+import copy
+import glob
+import gzip
+import json
+import statistics
+import time
+from typing import Any, Callable
+
+from browser_env.processors import TextObervationProcessor
+from browser_env.replay import (
+    ObservationSnapshot,
+    load_snapshot,
+    make_synthetic_snapshot,
+    replay_snapshot,
+)
+from browser_env.utils import AccessibilityTree
+
+VIEWPORT_SIZE = {"width": 1280, "height": 720}
+
+
+def load_json(path: str) -> Any:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:  # type: ignore[operator]
+        return json.load(f)
+
+
+def timeit(func: Callable[[], Any], repeat: int) -> float:
+    """Median wall time in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark(
+    name: str, snapshot: ObservationSnapshot, repeat: int
+) -> dict[str, float]:
+    processor = TextObervationProcessor(
+        "accessibility_tree", True, VIEWPORT_SIZE  # type: ignore[arg-type]
+    )
+
+    def browser_info() -> Any:
+        return processor.build_browser_info(
+            snapshot["dom_snapshot"], snapshot["window_metrics"]
+        )
+
+    snapshot_tree = snapshot["accessibility_tree"]
+    assert snapshot_tree is not None, f"{name} is not an accessibility tree"
+    # the closures do not see the narrowing of the assert
+    tree: AccessibilityTree = snapshot_tree
+    info = browser_info()
+    processor.retrieve_viewport_info(info)
+
+    def join() -> Any:
+        return processor.build_page_accessibility_tree(
+            info, copy.deepcopy(tree)
+        )
+
+    def copy_only() -> Any:
+        return copy.deepcopy(tree)
+
+    accessibility_tree = join()
+    tree_str, _ = processor.parse_accessibility_tree(accessibility_tree)
+
+    def full() -> Any:
+        return replay_snapshot(processor, snapshot)
+
+    results = {
+        "retrieve_viewport_info": timeit(
+            lambda: processor.retrieve_viewport_info(info), repeat
+        ),
+        "build_page_accessibility_tree": max(
+            timeit(join, repeat) - timeit(copy_only, repeat), 0.0
+        ),
+        "parse_accessibility_tree": timeit(
+            lambda: processor.parse_accessibility_tree(accessibility_tree),
+            repeat,
+        ),
+        "clean_accesibility_tree": timeit(
+            lambda: processor.clean_accesibility_tree(tree_str), repeat
+        ),
+        # the copy only keeps the snapshot intact across repeats
+        "build_observation": max(
+            timeit(full, repeat) - timeit(copy_only, repeat), 0.0
+        ),
+    }
+    num_dom = len(
+        snapshot["dom_snapshot"]["documents"][0]["nodes"]["parentIndex"]
+    )
+    num_ax = len(tree)
+    print(f"== {name}: {num_dom} dom nodes, {num_ax} accessibility nodes")
+    for stage, ms in results.items():
+        print(f"{stage:>32}: {ms:10.2f} ms")
+    return results
+
+
+def benchmark_parse(
+    name: str, accessibility_tree: AccessibilityTree, repeat: int
+) -> dict[str, float]:
+    """Time the parsing of a raw accessibility tree, without bounding boxes"""
+    for node in accessibility_tree:
+        node.setdefault("bound", None)
+        node.setdefault("union_bound", None)
+        node.setdefault("offsetrect_bound", None)
+    parse = TextObervationProcessor.parse_accessibility_tree
+    tree_str, _ = parse(accessibility_tree)
+
+    results = {
+        "parse_accessibility_tree": timeit(
+            lambda: parse(accessibility_tree), repeat
+        ),
+        "clean_accesibility_tree": timeit(
+            lambda: TextObervationProcessor.clean_accesibility_tree(tree_str),
+            repeat,
+        ),
+    }
+    num_lines = tree_str.count("\n") + 1
+    print(
+        f"== {name}: {len(accessibility_tree)} accessibility nodes,"
+        f" {num_lines} lines"
+    )
+    for stage, ms in results.items():
+        print(f"{stage:>36}: {ms:10.2f} ms")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snapshots", nargs="*", default=[])
+    parser.add_argument("--ax_trees", nargs="*", default=[])
+    parser.add_argument(
+        "--num_nodes", type=int, nargs="*", default=[5000, 20000, 50000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    snapshot_files = [f for p in args.snapshots for f in glob.glob(p)]
+    ax_tree_files = [f for p in args.ax_trees for f in glob.glob(p)]
+    for path in snapshot_files:
+        snapshot = load_snapshot(path)
+        if snapshot["accessibility_tree"] is None:
+            print(f"== {path}: skipped, not an accessibility tree step")
+            continue
+        benchmark(path, snapshot, args.repeat)
+    for path in ax_tree_files:
+        accessibility_tree = load_json(path)
+        if isinstance(accessibility_tree, dict):
+            accessibility_tree = accessibility_tree["nodes"]
+        benchmark_parse(path, accessibility_tree, args.repeat)
+    if not snapshot_files and not ax_tree_files:
+        for num_nodes in args.num_nodes:
+            benchmark(
+                f"synthetic_{num_nodes}",
+                make_synthetic_snapshot(num_nodes),
+                args.repeat,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark the retrieval of the related tasks on the task corpus.
+
+Every task of the corpus is stored, with a random outcome, then queried with
+its own intent. The retrieved tasks (the query excluded) are relevant when
+they are instantiated from the same intent template.
+
+    recall@k: relevant retrieved / min(k, relevant stored)
+    success: the share of the retrieved tasks that succeeded
+    templates: the distinct templates among the retrieved tasks
+    p50 / p95: the query latency
+
+Usage:
+    python scripts/benchmark_retrieval.py --k 3
+    python scripts/benchmark_retrieval.py --backends vector hybrid --embedder sentence_transformer
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from agent.retrieval import (
+    EMBEDDERS,
+    VectorStore,
+    create_vector_store,
+    task_sites,
+)
+
+# the backend and its options
+BACKENDS: dict[str, tuple[str, dict[str, Any]]] = {
+    "vector": ("local", {}),
+    "bm25": (
+        "hybrid",
+        {"vector_weight": 0.0, "success_weight": 0.0, "mmr_lambda": 1.0},
+    ),
+    "hybrid_no_mmr": ("hybrid", {"mmr_lambda": 1.0}),
+    "hybrid": ("hybrid", {}),
+}
+
+
+def benchmark(
+    name: str,
+    store: VectorStore,
+    tasks: list[dict[str, Any]],
+    successes: list[float],
+    k: int,
+) -> dict[str, float]:
+    store.pre_embed([task["intent"] for task in tasks])
+    store.add_texts(
+        [task["intent"] for task in tasks],
+        [
+            {
+                "task_id": task["task_id"],
+                "score": success,
+                "sites": ",".join(task_sites(task)),
+            }
+            for task, success in zip(tasks, successes)
+        ],
+    )
+    templates = {task["task_id"]: task["intent_template_id"] for task in tasks}
+    scores = {
+        task["task_id"]: success for task, success in zip(tasks, successes)
+    }
+    template_sizes = {
+        template: list(templates.values()).count(template)
+        for template in set(templates.values())
+    }
+
+    recalls, retrieved_successes, num_templates, latencies = [], [], [], []
+    for task in tasks:
+        start = time.perf_counter()
+        docs = store.similarity_search(
+            task["intent"], k=k + 1, sites=task_sites(task)
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        task_ids = [
+            doc.metadata["task_id"]
+            for doc in docs
+            if doc.metadata["task_id"] != task["task_id"]
+        ][:k]
+        if not task_ids:
+            continue
+        template = task["intent_template_id"]
+        num_relevant = template_sizes[template] - 1
+        if num_relevant:
+            hits = sum(templates[task_id] == template for task_id in task_ids)
+            recalls.append(hits / min(k, num_relevant))
+        retrieved_successes += [scores[task_id] for task_id in task_ids]
+        num_templates.append(len({templates[task_id] for task_id in task_ids}))
+
+    latencies.sort()
+    results = {
+        f"recall@{k}": statistics.mean(recalls),
+        "success": statistics.mean(retrieved_successes),
+        "templates": statistics.mean(num_templates),
+        "p50 ms": latencies[len(latencies) // 2],
+        "p95 ms": latencies[int(len(latencies) * 0.95)],
+    }
+    print(
+        f"{name:>14}: "
+        + "  ".join(
+            f"{metric} {value:7.3f}" for metric, value in results.items()
+        )
+    )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default="config_files/test.raw.json")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument(
+        "--backends", nargs="*", choices=list(BACKENDS), default=list(BACKENDS)
+    )
+    parser.add_argument("--embedder", choices=EMBEDDERS, default="hashing")
+    parser.add_argument(
+        "--success_rate",
+        type=float,
+        default=0.3,
+        help="Probability of a stored task to be a success",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        tasks = json.load(f)
+    rng = random.Random(args.seed)
+    successes = [float(rng.random() < args.success_rate) for _ in tasks]
+    print(f"== {len(tasks)} tasks, k={args.k}, embedder {args.embedder}")
+    for name in args.backends:
+        backend, options = BACKENDS[name]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = create_vector_store(
+                backend, Path(tmp_dir) / "index", args.embedder, **options
+            )
+            benchmark(name, store, tasks, successes, args.k)
+
+
+if __name__ == "__main__":
+    main()
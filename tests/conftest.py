@@ -1,9 +1,16 @@
-from typing import AsyncGenerator, Generator
+from typing import AsyncGenerator, Callable, Generator
 
+import numpy as np
 import pytest
 import pytest_asyncio
+import tiktoken
 
-from browser_env import AsyncScriptBrowserEnv, ScriptBrowserEnv
+from browser_env import (
+    AsyncScriptBrowserEnv,
+    ScriptBrowserEnv,
+    StateInfo,
+)
+from browser_env.utils import DetachedPage
 
 HEADLESS = True
 SLOW_MO = 0
@@ -70,3 +77,37 @@ async def async_script_browser_env() -> AsyncGenerator[
     env = AsyncScriptBrowserEnv(headless=HEADLESS, slow_mo=SLOW_MO)
     yield env
     await env.aclose()
+
+
+@pytest.fixture(scope="session")
+def tokenizer() -> tiktoken.core.Encoding:
+    """One token per byte, it does not need to download a vocabulary"""
+    return tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+@pytest.fixture(scope="session")
+def make_state_info() -> Callable[[int], StateInfo]:
+    """The state of the `step`-th page, with a text and an image observation
+    and the html of the page"""
+
+    def make(step: int) -> StateInfo:
+        return {
+            "observation": {
+                "text": f"[5] link 'Page {step}'",
+                "image": np.full((72, 128, 4), step, dtype=np.uint8),
+            },
+            "info": {
+                "page": DetachedPage(f"http://page/{step}", f"<p>{step}</p>"),
+                "fail_error": "",
+                "observation_metadata": {
+                    "text": {"obs_nodes_info": {"5": {"text": "[5] link"}}}
+                },
+            },
+        }
+
+    return make
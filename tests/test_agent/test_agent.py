@@ -0,0 +1,103 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any
+
+import aiolimiter
+import tiktoken
+
+from agent import PromptAgent
+from agent.prompts.prompt_constructor import CoTPromptConstructor
+from agent.prompts.raw.p_cot_id_actree_2s import prompt as cot_prompt
+from browser_env.actions import ActionTypes
+from browser_env.utils import DetachedPage
+from llms import lm_config
+
+
+def make_response(action: str) -> str:
+    return f"Let's think step-by-step. In summary, the next action I will perform is ```{action}```"
+
+
+def make_agent(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding, **gen_config: Any
+) -> PromptAgent:
+    path = tmp_path / "prompt.json"
+    with open(path, "w") as f:
+        json.dump(cot_prompt, f)
+    config = lm_config.LMConfig(
+        provider="mock",
+        model="gpt-3.5-turbo",
+        mode="chat",
+        gen_config={
+            "max_obs_length": 0,
+            "mock_latency": 0.0,
+            "mock_tokens_per_second": 0,
+            **gen_config,
+        },
+    )
+    constructor = CoTPromptConstructor(path, config, tokenizer)
+    return PromptAgent("id_accessibility_tree", config, constructor)
+
+
+def make_trajectory() -> list[Any]:
+    return [
+        {
+            "observation": {"text": "[1] RootWebArea 'page'"},
+            "info": {"page": DetachedPage("http://page/0", "")},
+        }
+    ]
+
+
+def test_vote(tmp_path: Path, tokenizer: tiktoken.core.Encoding) -> None:
+    agent = make_agent(tmp_path, tokenizer)
+    action = agent.vote(
+        [
+            "no action",
+            make_response("click [2]"),
+            make_response("click [1]"),
+            make_response("click [1]"),
+            "no action",
+            "no action",
+        ]
+    )
+    # the unparsable samples do not count
+    assert action["action_type"] == ActionTypes.CLICK
+    assert action["element_id"] == "1"
+
+    # ties go to the earliest sample
+    action = agent.vote(
+        [make_response("click [2]"), make_response("click [1]")]
+    )
+    assert action["element_id"] == "2"
+
+    assert agent.vote(["no action"])["action_type"] == ActionTypes.NONE
+    assert agent.vote([])["action_type"] == ActionTypes.NONE
+
+
+def test_next_action_samples(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    responses = [
+        make_response("click [2]"),
+        make_response("scroll [down]"),
+        make_response("scroll [down]"),
+    ]
+    agent = make_agent(
+        tmp_path, tokenizer, num_samples=3, mock_responses=responses
+    )
+    meta_data = {"action_history": ["None"]}
+    action = agent.next_action(make_trajectory(), "find the page", meta_data)
+    assert action["action_type"] == ActionTypes.SCROLL
+    # a single batched call
+    assert agent.provider.mock.num_calls == 1  # type: ignore[attr-defined]
+
+    action = asyncio.run(
+        agent.anext_action(
+            make_trajectory(),
+            "find the page",
+            meta_data,
+            aiolimiter.AsyncLimiter(100),
+        )
+    )
+    assert action["action_type"] == ActionTypes.SCROLL
+    assert agent.provider.mock.num_calls == 2  # type: ignore[attr-defined]
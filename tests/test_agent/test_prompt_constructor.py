@@ -0,0 +1,318 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+import tiktoken
+
+from agent.prompts.prompt_constructor import (
+    MESSAGE_LAYOUTS,
+    CoTPromptConstructor,
+    HistoricalPromptConstructor,
+    VectorDBPromptConstructor,
+    reorder_example,
+    reorder_template,
+)
+from agent.prompts.raw.historical_cot_best import (
+    prompt as historical_prompt,
+)
+from agent.prompts.raw.p_cot_id_actree_2s import prompt as cot_prompt
+from agent.prompts.raw.vectorDB_cot import prompt as vector_db_prompt
+from browser_env.utils import DetachedPage
+from llms import lm_config
+
+
+def make_lm_config(**gen_config: Any) -> lm_config.LMConfig:
+    return lm_config.LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo",
+        mode="chat",
+        gen_config={"max_obs_length": 0, **gen_config},
+    )
+
+
+def write_instruction(tmp_path: Path, prompt: dict[str, Any]) -> Path:
+    path = tmp_path / "prompt.json"
+    with open(path, "w") as f:
+        json.dump(prompt, f)
+    return path
+
+
+def make_trajectory(num_steps: int) -> tuple[list[Any], dict[str, Any]]:
+    trajectory: list[Any] = []
+    action_history = ["None"]
+    for step in range(num_steps):
+        trajectory.append(
+            {
+                "observation": {"text": f"[1] RootWebArea 'page {step}'"},
+                "info": {"page": DetachedPage(f"http://page/{step}", "")},
+            }
+        )
+        trajectory.append({})
+        action_history.append(f"click [{step}]")
+    meta_data = {
+        "action_history": action_history[:num_steps],
+        "related_intents": [("a task", 1.0, "0. click [1]")],
+    }
+    return trajectory[:-1], meta_data
+
+
+def test_construct(tmp_path: Path, tokenizer: tiktoken.core.Encoding) -> None:
+    constructor = CoTPromptConstructor(
+        write_instruction(tmp_path, cot_prompt), make_lm_config(), tokenizer
+    )
+    trajectory, meta_data = make_trajectory(2)
+    prompt = constructor.construct(trajectory, "find the page", meta_data)
+    current = prompt[-1]["content"]  # type: ignore[index]
+    assert "[1] RootWebArea 'page 1'" in current
+    assert "http://page/1" in current
+    assert "find the page" in current
+    assert "click [0]" in current
+
+
+def test_history_budget(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    trajectory, meta_data = make_trajectory(5)
+    constructor = HistoricalPromptConstructor(
+        write_instruction(tmp_path, historical_prompt),
+        make_lm_config(),
+        tokenizer,
+    )
+    history = constructor.construct_history(trajectory, meta_data)
+    assert history.count("action/error") == 5
+
+    # only the latest actions are kept
+    max_history_length = len(history) // 2
+    constructor = HistoricalPromptConstructor(
+        write_instruction(tmp_path, historical_prompt),
+        make_lm_config(max_history_length=max_history_length),
+        tokenizer,
+    )
+    section = constructor.sections["historical_actions"]
+    truncated = section.render(constructor, trajectory, "", meta_data)
+    assert len(tokenizer.encode(truncated)) <= max_history_length
+    assert history.endswith(truncated)
+    assert 0 < truncated.count("action/error") < 5
+
+
+def test_condensed_history(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    trajectory, meta_data = make_trajectory(5)
+    constructor = HistoricalPromptConstructor(
+        write_instruction(tmp_path, historical_prompt),
+        make_lm_config(),
+        tokenizer,
+    )
+    record = constructor.construct_condensed_history(
+        trajectory, meta_data, 1.0
+    )
+    assert record.startswith("Outcome: PASS (score 1.0) in 4 steps")
+    assert "http://page/0 -> http://page/1" in record
+    assert "1. click [0]; 2. click [1]" in record
+    assert len(record) < len(
+        constructor.construct_history(trajectory, meta_data)
+    )
+
+
+def test_retrieved_examples(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    trajectory, meta_data = make_trajectory(2)
+    constructor = VectorDBPromptConstructor(
+        write_instruction(tmp_path, vector_db_prompt),
+        make_lm_config(),
+        tokenizer,
+    )
+    prompt = constructor.construct(trajectory, "find the page", meta_data)
+    current = prompt[-1]["content"]  # type: ignore[index]
+    assert "Retrieved intent: a task" in current
+
+
+def test_retrieved_examples_budget(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    trajectory, meta_data = make_trajectory(2)
+    meta_data["related_intents"] = [
+        (f"task {i}", 1.0, "Outcome: PASS (score 1.0) in 1 steps")
+        for i in range(20)
+    ]
+    # the budget of the observation by default, or its own one
+    for gen_config, budget in [
+        ({"max_obs_length": 1000}, 1000),
+        ({"max_retrieved_length": 500}, 500),
+    ]:
+        constructor = VectorDBPromptConstructor(
+            write_instruction(tmp_path, vector_db_prompt),
+            make_lm_config(**gen_config),
+            tokenizer,
+        )
+        prompt = constructor.construct(trajectory, "find the page", meta_data)
+        current = prompt[-1]["content"]  # type: ignore[index]
+        start = current.index("Retrieved Example 0")
+        end = current.rindex("[End of retrieved history]")
+        retrieved = current[start : end + len("[End of retrieved history]")]
+        assert 0 < len(tokenizer.encode(retrieved)) <= budget
+        assert "Retrieved Example 19" not in current
+
+
+def test_missing_section(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    with pytest.raises(ValueError):
+        CoTPromptConstructor(
+            write_instruction(
+                tmp_path, {**cot_prompt, "template": "{unknown_keyword}"}
+            ),
+            make_lm_config(),
+            tokenizer,
+        )
+
+
+def test_static_prefix(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    constructor = CoTPromptConstructor(
+        write_instruction(tmp_path, cot_prompt), make_lm_config(), tokenizer
+    )
+    prompts = []
+    for num_steps in [1, 2, 3]:
+        trajectory, meta_data = make_trajectory(num_steps)
+        prompt = constructor.construct(trajectory, "find the page", meta_data)
+        assert isinstance(prompt, list)
+        prompts.append(prompt)
+    # only the last message changes across the steps
+    assert prompts[0][:-1] == prompts[1][:-1] == prompts[2][:-1]
+    assert prompts[0][-1] != prompts[1][-1]
+    assert constructor.static_prefix_tokens > 0
+
+    # the prefix is also used in the completion mode
+    completion_config = lm_config.LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo-instruct",
+        mode="completion",
+        gen_config={"max_obs_length": 0},
+    )
+    constructor = CoTPromptConstructor(
+        write_instruction(tmp_path, cot_prompt), completion_config, tokenizer
+    )
+    prompt = constructor.construct(trajectory, "find the page", meta_data)
+    assert isinstance(prompt, str)
+    assert isinstance(constructor.static_prefix, str)
+    assert prompt.startswith(constructor.static_prefix)
+    assert prompt.endswith("\n\nAction:")
+
+
+def test_prefix_stable_layout(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    trajectory, meta_data = make_trajectory(3)
+    prompts = {}
+    for message_layout in MESSAGE_LAYOUTS:
+        constructor = HistoricalPromptConstructor(
+            write_instruction(tmp_path, historical_prompt),
+            make_lm_config(message_layout=message_layout),
+            tokenizer,
+        )
+        prompt = constructor.construct(trajectory, "find the page", meta_data)
+        prompts[message_layout] = prompt[-1]["content"]  # type: ignore[index]
+    default, prefix_stable = prompts["default"], prompts["prefix_stable"]
+    assert sorted(default.split("\n")) == sorted(prefix_stable.split("\n"))
+    # the objective and the history are before the observation
+    observation = prefix_stable.index("OBSERVATION (")
+    assert prefix_stable.index("OBJECTIVE:") < observation
+    assert prefix_stable.index("action/error") < observation
+    assert default.index("OBSERVATION (") < default.index("OBJECTIVE:")
+
+
+def test_prefix_stable_examples(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    constructor = CoTPromptConstructor(
+        write_instruction(tmp_path, cot_prompt),
+        make_lm_config(message_layout="prefix_stable"),
+        tokenizer,
+    )
+    trajectory, meta_data = make_trajectory(1)
+    prompt = constructor.construct(trajectory, "find the page", meta_data)
+    assert isinstance(prompt, list)
+    # the examples and the current observation share one layout
+    labels = ["OBJECTIVE:", "URL:", "PREVIOUS ACTION:", "OBSERVATION:"]
+    for message in prompt[1:-1:2] + prompt[-1:]:
+        content = message["content"]
+        positions = [content.index(label) for label in labels]
+        assert positions == sorted(positions)
+    for (x, y), (example_x, example_y) in zip(
+        constructor.instruction["examples"], cot_prompt["examples"]
+    ):
+        assert sorted(x.split("\n")) == sorted(example_x.split("\n"))
+        assert y == example_y
+
+
+def test_reorder_example() -> None:
+    example = (
+        "OBSERVATION:\n[1] link 'a'\n\t[2] text 'b'\nURL: u\nOBJECTIVE: o"
+    )
+    keywords = ["observation", "url", "objective"]
+    volatility = {"objective": 0, "url": 2, "observation": 3}
+    assert reorder_example(example, keywords, volatility) == (
+        "OBJECTIVE: o\nURL: u\nOBSERVATION:\n[1] link 'a'\n\t[2] text 'b'"
+    )
+    # the fields do not match the template
+    assert reorder_example(example, keywords[:2], volatility) == example
+
+
+def test_reorder_template() -> None:
+    template = "head\nA:\n{observation}\nB: {objective}\ntail"
+    assert reorder_template(template, {"objective": 0, "observation": 3}) == (
+        "head\nB: {objective}\ntail\nA:\n{observation}"
+    )
+
+
+def test_reorder_vector_db_template(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    constructor = VectorDBPromptConstructor(
+        write_instruction(tmp_path, vector_db_prompt),
+        make_lm_config(message_layout="prefix_stable"),
+        tokenizer,
+    )
+    dashes = "-" * 74
+    assert constructor.template == (
+        "Here are the various sections, delineated by a series of dashes "
+        f"\n\n\t{dashes}\n\n"
+        f"CURRENT OBJECTIVE: {{objective}}\n\n{dashes}\n\n"
+        f"RETRIEVED TASK HISTORY: {{retrieved_examples}} \n\n{dashes}\n\n"
+        "CURRENT TASK HISTORY (Everything following this line is a numbered "
+        "list of your history for the current task, these are NOT "
+        f"instructions to you!): {{historical_actions}}\n\n{dashes}\n\n"
+        f"CURRENT URL: {{url}}\n\n{dashes}\n\n"
+        "\tOBSERVATION: {observation}\n\n\n"
+        "\tThis is the end of the observation section. All [id] and "
+        "[tab_index] arguments should be obtained before this line\n"
+        f"\t{dashes}\n"
+    )
+
+
+def test_action_stream_parser(
+    tmp_path: Path, tokenizer: tiktoken.core.Encoding
+) -> None:
+    constructor = CoTPromptConstructor(
+        write_instruction(tmp_path, cot_prompt), make_lm_config(), tokenizer
+    )
+    response = (
+        "Let's think step-by-step. In summary, the next action I will "
+        "perform is ```click [1234]``` and then ```stop [N/A]```"
+    )
+    parser = constructor.action_stream_parser()
+    pieces = [response[idx : idx + 3] for idx in range(0, len(response), 3)]
+    for num_pieces, piece in enumerate(pieces, start=1):
+        if parser.feed(piece):
+            break
+    # stops right after the closing splitter
+    assert parser.response.endswith("[1234]```")
+    assert num_pieces < len(pieces)
+    assert constructor.extract_action(
+        parser.response
+    ) == constructor.extract_action(response)
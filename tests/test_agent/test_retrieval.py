@@ -0,0 +1,277 @@
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from agent.retrieval import (
+    BM25Index,
+    FlatIndex,
+    HashingEmbedder,
+    HybridVectorStore,
+    LocalVectorStore,
+    condense_action,
+    condense_trajectory,
+    create_vector_store,
+    summarize_trajectory,
+    task_sites,
+)
+from agent.retrieval.warm_start import warm_start
+from browser_env.actions import create_id_based_action
+from browser_env.helper_functions import RenderHelper
+from browser_env.utils import DetachedPage, StateInfo
+from llms import lm_config
+
+INTENTS = [
+    "What is the top-1 best selling product in 2022",
+    "Tell me the total number of orders of the customer Sarah Miller",
+    "How many commits did kilian make to the a11yproject repo",
+    "Find the customer name and email with phone number 8015551212",
+    "What is the best selling brand in Q1 2022",
+]
+
+
+def test_hashing_embedder() -> None:
+    embedder = HashingEmbedder(dim=256)
+    vectors = embedder.embed(INTENTS + [""])
+    assert vectors.shape == (len(INTENTS) + 1, 256)
+    assert vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:-1], axis=1), 1.0)
+    assert not vectors[-1].any()
+    # the same in every process
+    assert np.array_equal(
+        vectors, HashingEmbedder(dim=256).embed(INTENTS + [""])
+    )
+
+
+def test_local_store(tmp_path: Path) -> None:
+    store = create_vector_store("local", tmp_path / "index")
+    assert store.count() == 0
+    assert store.similarity_search(INTENTS[0], k=3) == []
+    store.add_texts(INTENTS, [{"task_id": idx} for idx in range(len(INTENTS))])
+    docs = store.similarity_search("best selling product of 2022", k=2)
+    assert [doc.metadata["task_id"] for doc in docs] == [0, 4]
+    assert docs[0].page_content == INTENTS[0]
+    assert docs[0].similarity >= docs[1].similarity
+
+    # another process sees the rows of the first one
+    other = create_vector_store("local", tmp_path / "index")
+    assert other.count() == len(INTENTS)
+    store.add_texts(["Show me the orders of Sarah"], [{"task_id": 5}])
+    assert other.count() == len(INTENTS) + 1
+    docs = other.similarity_search("orders of the customer Sarah", k=2)
+    assert {doc.metadata["task_id"] for doc in docs} == {1, 5}
+
+    with pytest.raises(ValueError):
+        FlatIndex(tmp_path / "index", "other-embedder", 8)
+
+
+def test_flat_index_top_k(tmp_path: Path) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 64)).astype(np.float32)
+    index = FlatIndex(tmp_path / "index", "random", 64)
+    index.add(vectors, [str(idx) for idx in range(1000)], [{}] * 1000)
+    query = vectors[42]
+    results = index.search(query, 10)
+    expected = np.argsort(-(vectors @ query), kind="stable")[:10]
+    assert [row for row, _ in results] == expected.tolist()
+
+
+def test_query_latency(tmp_path: Path) -> None:
+    store = LocalVectorStore(tmp_path / "index", HashingEmbedder())
+    intents = [f"{intent} {idx}" for idx in range(163) for intent in INTENTS]
+    store.pre_embed(intents)
+    store.add_texts(intents, [{}] * len(intents))
+    start = time.perf_counter()
+    for intent in intents[:100]:
+        store.similarity_search(intent, k=3)
+    # the queries were embedded up front
+    assert (time.perf_counter() - start) / 100 < 1e-3
+
+
+def test_bm25() -> None:
+    index = BM25Index()
+    index.add(INTENTS)
+    scores = index.scores("best selling brand")
+    assert scores.shape == (len(INTENTS),)
+    assert int(scores.argmax()) == 4
+    # "best selling" is in two intents, "brand" only in the last one
+    assert scores[4] > scores[0] > 0
+    assert not scores[1:4].any()
+    assert not index.scores("unknown words").any()
+
+
+def test_task_sites() -> None:
+    assert task_sites({"sites": ["reddit", "gitlab"]}) == ["gitlab", "reddit"]
+    assert task_sites({"start_url": "__SHOPPING_ADMIN__/sales"}) == [
+        "shopping_admin"
+    ]
+    assert task_sites({"start_url": "http://localhost:7780"}) == []
+
+
+def test_hybrid_store(tmp_path: Path) -> None:
+    store = HybridVectorStore(tmp_path / "index", HashingEmbedder())
+    sites = ["shopping_admin", "shopping_admin", "gitlab", "shopping", "x"]
+    store.add_texts(
+        INTENTS,
+        [
+            {"task_id": idx, "score": 0.0, "sites": site}
+            for idx, site in enumerate(sites)
+        ],
+    )
+    docs = store.similarity_search("best selling product", k=2)
+    assert [doc.metadata["task_id"] for doc in docs] == [0, 4]
+    assert docs[0].similarity >= docs[1].similarity
+
+    # only the tasks of the site, or without a known site
+    docs = store.similarity_search(
+        "best selling product", k=5, sites=["gitlab"]
+    )
+    assert {doc.metadata["task_id"] for doc in docs} == {2}
+
+    # the successful trajectories are preferred
+    store.add_texts(
+        ["What is the top-2 best selling product in 2022"],
+        [{"task_id": 5, "score": 1.0, "sites": "shopping_admin"}],
+    )
+    query = "top-1 best selling product in 2022"
+    store.success_weight = 0.0
+    assert store.similarity_search(query, k=1)[0].metadata["task_id"] == 0
+    store.success_weight = 0.5
+    assert store.similarity_search(query, k=1)[0].metadata["task_id"] == 5
+    store.success_weight = 0.0
+
+    # the same task stored twice is not retrieved twice
+    store.add_texts([INTENTS[1]], [{"task_id": 1, "score": 0.0}])
+    query = "total number of orders of the customer Sarah Miller"
+    store.mmr_lambda = 1.0
+    docs = store.similarity_search(query, k=2)
+    assert [doc.metadata["task_id"] for doc in docs] == [1, 1]
+    store.mmr_lambda = 0.5
+    docs = store.similarity_search(query, k=2)
+    assert [doc.metadata["task_id"] for doc in docs][0] == 1
+    assert [doc.metadata["task_id"] for doc in docs][1] != 1
+
+    # the other processes see the same documents
+    other = HybridVectorStore(tmp_path / "index", HashingEmbedder())
+    assert other.count() == store.count() == len(INTENTS) + 2
+
+
+def render_task(result_dir: Path, task_id: int, intent: str) -> None:
+    config_file = result_dir / f"{task_id}.json"
+    with open(config_file, "w") as f:
+        json.dump(
+            {"sites": ["gitlab"], "task_id": task_id, "intent": intent}, f
+        )
+    render_helper = RenderHelper(
+        str(config_file), str(result_dir), "id_accessibility_tree"
+    )
+    state_info: StateInfo = {
+        "observation": {
+            "text": "[5] link 'Commits'",
+            "image": np.zeros((1, 1, 3), dtype=np.uint8),
+        },
+        "info": {
+            "page": DetachedPage("http://gitlab/repo", ""),
+            "observation_metadata": {
+                "text": {
+                    "obs_nodes_info": {"5": {"text": "[5] link 'Commits'"}}
+                }
+            },
+        },
+    }
+    for action_str in ["click [5]", "scroll [down]", "scroll [down]"]:
+        action = create_id_based_action(action_str)
+        action["raw_prediction"] = action_str
+        render_helper.render(action, state_info, {"action_history": ["None"]})
+    render_helper.close()
+
+
+def test_warm_start(tmp_path: Path) -> None:
+    old_run = tmp_path / "old_run"
+    old_run.mkdir()
+    old_store = HybridVectorStore(old_run / "vector_index", HashingEmbedder())
+    old_store.add_texts(
+        INTENTS[:2],
+        [
+            {"task_id": 0, "score": 0.0, "historical_actions_str": "a"},
+            {"task_id": 1, "score": 1.0, "historical_actions_str": "b"},
+        ],
+    )
+    # a run without retrieval, only the rendered trajectories
+    other_run = tmp_path / "other_run"
+    other_run.mkdir()
+    render_task(other_run, 0, INTENTS[0])
+    render_task(other_run, 2, INTENTS[2])
+    render_task(other_run, 3, INTENTS[3])
+    with open(other_run / "logged_results.csv", "w") as f:
+        f.write(",score\n0,1.0\n2,0.0\n3,\n")
+
+    store = HybridVectorStore(tmp_path / "new_run", HashingEmbedder())
+    assert warm_start(store, [old_run, other_run]) == 3
+    documents = {
+        metadata["task_id"]: metadata for _, metadata in store.documents()
+    }
+    # task 3 is not finished, task 0 succeeded in the other run
+    assert sorted(documents) == [0, 1, 2]
+    assert documents[1]["historical_actions_str"] == "b"
+    assert documents[0]["score"] == 1.0
+    assert documents[0]["sites"] == "gitlab"
+    assert documents[0]["historical_actions_str"].splitlines() == [
+        "Outcome: PASS (score 1.0) in 3 steps",
+        "Pages: http://gitlab/repo",
+        "Actions: 1. click link 'Commits'; 2. scroll [down] (x2)",
+    ]
+    # the stored tasks are not added twice
+    assert warm_start(store, [old_run, other_run]) == 0
+    assert store.count() == 3
+
+
+def test_condense_trajectory() -> None:
+    assert (
+        condense_action("click [1234] where [1234] is link 'Orders'")
+        == "click link 'Orders'"
+    )
+    assert (
+        condense_action("type [7] [Sarah] where [7] is searchbox 'Search'")
+        == "type [Sarah] searchbox 'Search'"
+    )
+    actions = [
+        "click [1] where [1] is link 'Orders'",
+        "scroll [down]",
+        "scroll [down]",
+        "scroll [down]",
+        "stop [42]",
+    ]
+    urls = ["http://shop/admin", "http://shop/orders", "http://shop/orders"]
+    record = condense_trajectory(urls, actions, 1.0)
+    assert record.splitlines() == [
+        "Outcome: PASS (score 1.0) in 5 steps",
+        "Pages: http://shop/admin -> http://shop/orders",
+        "Actions: 1. click link 'Orders'; 2. scroll [down] (x3); 3. stop [42]",
+    ]
+
+    actions = [f"scroll [{idx}]" for idx in range(30)]
+    record = condense_trajectory([], actions, 0.0, max_actions=4)
+    assert record.splitlines()[-1] == (
+        "Actions: 1. scroll [0]; 2. scroll [1]; 3. ... 26 more ...; "
+        "4. scroll [28]; 5. scroll [29]"
+    )
+    assert record.startswith("Outcome: FAIL")
+
+
+def test_summarize_trajectory() -> None:
+    config = lm_config.LMConfig(
+        provider="mock",
+        model="mock",
+        mode="chat",
+        gen_config={"mock_latency": 0.0, "mock_tokens_per_second": 0.0},
+    )
+    record = condense_trajectory(["http://shop"], ["scroll [down]"], 0.0)
+    summary = summarize_trajectory(config, INTENTS[0], record)
+    assert summary
+    record = condense_trajectory(
+        ["http://shop"], ["scroll [down]"], 0.0, summary=summary
+    )
+    assert record.splitlines()[-1] == f"Summary: {' '.join(summary.split())}"
@@ -0,0 +1,76 @@
+import pytest
+import tiktoken
+
+from agent.prompts.truncation import ObservationTruncator
+
+OBS = "\n".join(
+    [
+        "Tab 0 (current): Orders",
+        "",
+        "[1] RootWebArea 'Orders'",
+        "\t[2] StaticText 'Welcome back to the store admin'",
+        "\t[3] heading 'Orders'",
+        "\t[4] link 'Next page'",
+        "\t[5] textbox 'Search' focused: True",
+    ]
+)
+
+
+def count_tokens(tokenizer: tiktoken.core.Encoding, text: str) -> int:
+    return len(tokenizer.encode(text))
+
+
+def test_token_mode(tokenizer: tiktoken.core.Encoding) -> None:
+    truncator = ObservationTruncator(tokenizer, "token")
+    assert truncator.truncate(OBS, 30) == OBS[:30]
+    assert truncator.truncate(OBS, 1000) == OBS
+
+
+def test_non_ascii(tokenizer: tiktoken.core.Encoding) -> None:
+    truncator = ObservationTruncator(tokenizer, "token")
+    # fewer characters than tokens
+    assert truncator.truncate("é" * 10, 10) == "é" * 5
+
+
+@pytest.mark.parametrize("max_obs_length", [30, 60, 100, 150, 1000])
+def test_line_mode(
+    max_obs_length: int, tokenizer: tiktoken.core.Encoding
+) -> None:
+    truncator = ObservationTruncator(tokenizer, "line")
+    truncated = truncator.truncate(OBS, max_obs_length)
+    assert count_tokens(tokenizer, truncated) <= max_obs_length
+    lines = truncated.split("\n")
+    # only whole lines, and as many as possible
+    assert lines == OBS.split("\n")[: len(lines)]
+    if truncated != OBS:
+        next_line = OBS.split("\n")[len(lines)]
+        assert (
+            count_tokens(tokenizer, truncated + "\n" + next_line)
+            > max_obs_length
+        )
+
+
+def test_priority_mode(tokenizer: tiktoken.core.Encoding) -> None:
+    truncator = ObservationTruncator(tokenizer, "priority")
+    truncated = truncator.truncate(OBS, 130)
+    assert count_tokens(tokenizer, truncated) <= 130
+    assert truncated.split("\n") == [
+        "Tab 0 (current): Orders",
+        "",
+        "[1] RootWebArea 'Orders'",
+        "\t[3] heading 'Orders'",
+        "\t[4] link 'Next page'",
+        "\t[5] textbox 'Search' focused: True",
+    ]
+
+
+def test_no_line_fits(tokenizer: tiktoken.core.Encoding) -> None:
+    truncator = ObservationTruncator(tokenizer, "line")
+    assert truncator.truncate(OBS, 10) == OBS[:10]
+
+
+def test_cache(tokenizer: tiktoken.core.Encoding) -> None:
+    truncator = ObservationTruncator(tokenizer, "line", cache_size=2)
+    for max_obs_length in [30, 60, 100, 30]:
+        truncator.truncate(OBS, max_obs_length)
+    assert [key[1] for key in truncator.cache] == [100, 30]
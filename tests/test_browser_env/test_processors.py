@@ -0,0 +1,242 @@
+import copy
+import random
+from typing import Any, cast
+
+import numpy as np
+
+from browser_env.processors import TextObervationProcessor
+from browser_env.utils import AccessibilityTree
+
+
+def make_processor() -> TextObervationProcessor:
+    return TextObervationProcessor(
+        "accessibility_tree", True, {"width": 1280, "height": 720}
+    )
+
+
+def make_info() -> dict[str, Any]:
+    # dom nodes: 0 document, 1 body, 2 div (no layout), 3 span
+    return {
+        "DOMTree": {
+            "documents": [
+                {
+                    "nodes": {
+                        "backendNodeId": [10, 11, 12, 13],
+                        "nodeName": [0, 1, 2, 3],
+                    },
+                    "layout": {
+                        # node 3 has two layout entries, the first one is used
+                        "nodeIndex": [0, 1, 3, 3],
+                        "bounds": [
+                            [0, 0, 100, 100],
+                            [0, 0, 50, 50],
+                            [5, 5, 10, 10],
+                            [7, 7, 1, 1],
+                        ],
+                        "unionBounds": [
+                            [0, 0, 100, 100],
+                            [0, 0, 50, 50],
+                            [5, 5, 10, 10],
+                            [7, 7, 1, 1],
+                        ],
+                        "offsetRects": [[], [], [], []],
+                    },
+                }
+            ]
+        }
+    }
+
+
+def test_build_page_accessibility_tree() -> None:
+    accessibility_tree = [
+        {"nodeId": "1", "backendDOMNodeId": 10},
+        {"nodeId": "2", "parentId": "1", "backendDOMNodeId": 11},
+        # no layout, inherits from the closest parent with a layout
+        {"nodeId": "3", "parentId": "2", "backendDOMNodeId": 12},
+        {"nodeId": "4", "parentId": "3"},
+        {"nodeId": "5", "parentId": "3", "backendDOMNodeId": 13},
+        # unknown backend id and no parent
+        {"nodeId": "6", "backendDOMNodeId": 99},
+        # duplicated nodes are dropped
+        {"nodeId": "5", "parentId": "3", "backendDOMNodeId": 13},
+    ]
+    tree = make_processor().build_page_accessibility_tree(
+        make_info(), accessibility_tree  # type: ignore[arg-type]
+    )
+    assert [node["nodeId"] for node in tree] == ["1", "2", "3", "4", "5", "6"]
+    bounds = {node["nodeId"]: node["union_bound"] for node in tree}
+    assert bounds == {
+        "1": [0, 0, 100, 100],
+        "2": [0, 0, 50, 50],
+        "3": [0, 0, 50, 50],
+        "4": None,
+        "5": [5, 5, 10, 10],
+        "6": None,
+    }
+
+
+def reference_union_bounds(
+    parent: list[int], layout_node_cursor: list[int], bounds: list[list[float]]
+) -> list[list[float] | None]:
+    """The recursive union bound, node by node"""
+    union_bounds: list[list[float] | None] = [None for _ in bounds]
+
+    def valid_bbox(bound: list[float] | None) -> bool:
+        return bound is not None and not (
+            np.isclose(bound[2], 0) or np.isclose(bound[3], 0)
+        )
+
+    def add_union_bound(idx: int) -> list[float] | None:
+        if idx not in layout_node_cursor:
+            return None
+        cursor = layout_node_cursor.index(idx)
+        tree_bounds = [bounds[cursor]] + [
+            add_union_bound(child_idx)
+            for child_idx in range(len(parent))
+            if parent[child_idx] == idx
+        ]
+        corners = [
+            [b[0], b[1], b[0] + b[2], b[1] + b[3]]
+            for b in tree_bounds
+            if b is not None and valid_bbox(b)
+        ]
+        if not corners:
+            union_bound = [0.0, 0.0, 0.0, 0.0]
+        else:
+            left = min(b[0] for b in corners)
+            top = min(b[1] for b in corners)
+            right = max(b[2] for b in corners)
+            bottom = max(b[3] for b in corners)
+            union_bound = [left, top, right - left, bottom - top]
+        union_bounds[cursor] = union_bound
+        return union_bound
+
+    add_union_bound(0)
+    return union_bounds
+
+
+def make_dom_tree(
+    parent: list[int], layout_node_cursor: list[int], bounds: list[list[float]]
+) -> dict[str, Any]:
+    return {
+        "DOMTree": {
+            "documents": [
+                {
+                    "nodes": {
+                        "parentIndex": parent,
+                        "nodeName": [0 for _ in parent],
+                    },
+                    "layout": {
+                        "nodeIndex": layout_node_cursor,
+                        "bounds": bounds,
+                    },
+                }
+            ]
+        }
+    }
+
+
+def test_retrieve_viewport_info() -> None:
+    rng = random.Random(0)
+    for num_nodes in [1, 2, 10, 100, 300]:
+        parent = [-1] + [rng.randrange(idx) for idx in range(1, num_nodes)]
+        # some nodes have no layout, some have several entries
+        layout_node_cursor = [
+            idx for idx in range(num_nodes) if idx == 0 or rng.random() < 0.9
+        ]
+        layout_node_cursor += rng.choices(
+            layout_node_cursor, k=num_nodes // 10
+        )
+        rng.shuffle(layout_node_cursor)
+        bounds = [
+            [
+                rng.uniform(-100, 1000),
+                rng.uniform(-100, 5000),
+                rng.choice([0.0, rng.uniform(0, 500)]),
+                rng.choice([0.0, rng.uniform(0, 500)]),
+            ]
+            for _ in layout_node_cursor
+        ]
+        info = make_dom_tree(parent, layout_node_cursor, bounds)
+        make_processor().retrieve_viewport_info(info)  # type: ignore[arg-type]
+        union_bounds = info["DOMTree"]["documents"][0]["layout"]["unionBounds"]
+        assert union_bounds == reference_union_bounds(
+            parent, layout_node_cursor, bounds
+        )
+
+
+def test_retrieve_viewport_info_deep_tree() -> None:
+    num_nodes = 5000
+    parent = list(range(-1, num_nodes - 1))
+    bounds = [[float(idx), 0.0, 1.0, 1.0] for idx in range(num_nodes)]
+    info = make_dom_tree(parent, list(range(num_nodes)), bounds)
+    make_processor().retrieve_viewport_info(info)  # type: ignore[arg-type]
+    union_bounds = info["DOMTree"]["documents"][0]["layout"]["unionBounds"]
+    assert union_bounds[0] == [0.0, 0.0, float(num_nodes), 1.0]
+    assert union_bounds[-1] == bounds[-1]
+
+
+def make_accessibility_tree(names: list[str]) -> AccessibilityTree:
+    tree: list[dict[str, Any]] = [
+        {
+            "nodeId": "1",
+            "role": {"value": "RootWebArea"},
+            "name": {"value": "page"},
+            "childIds": [str(idx + 2) for idx in range(len(names))],
+            "backendDOMNodeId": 1,
+            "bound": None,
+            "union_bound": None,
+            "offsetrect_bound": None,
+        }
+    ]
+    for idx, name in enumerate(names):
+        tree.append(
+            {
+                "nodeId": str(idx + 2),
+                "role": {"value": "link"},
+                "name": {"value": name},
+                "childIds": [],
+                "backendDOMNodeId": idx + 2,
+                "bound": None,
+                "union_bound": None,
+                "offsetrect_bound": None,
+            }
+        )
+    return cast(AccessibilityTree, tree)
+
+
+def test_parse_accessibility_tree() -> None:
+    tree = make_accessibility_tree(["a", "", "c"])
+    # an empty generic node does not indent its children
+    tree[2]["role"]["value"] = "generic"
+    tree[2]["childIds"] = ["4"]
+    tree[1]["childIds"] = ["5"]
+    node = copy.copy(tree[1])
+    node["nodeId"] = "5"
+    node["childIds"] = []
+    tree.append(node)
+    tree[0]["childIds"] = ["2", "3", "missing"]
+    tree_str, obs_nodes_info = make_processor().parse_accessibility_tree(tree)
+    assert tree_str == (
+        "[1] RootWebArea 'page'\n"
+        "\t[2] link 'a'\n"
+        "\t\t[5] link 'a'\n"
+        "\t[4] link 'c'"
+    )
+    assert list(obs_nodes_info) == ["1", "2", "5", "4"]
+
+
+def test_parse_accessibility_tree_deep_tree() -> None:
+    num_nodes = 5000
+    tree = make_accessibility_tree(["a"])
+    for idx in range(2, num_nodes):
+        tree[-1]["childIds"] = [str(idx + 1)]
+        node = copy.copy(tree[-1])
+        node["nodeId"] = str(idx + 1)
+        node["childIds"] = []
+        tree.append(node)
+    tree_str, obs_nodes_info = make_processor().parse_accessibility_tree(tree)
+    assert len(obs_nodes_info) == num_nodes
+    assert tree_str.split("\n")[-1] == "\t" * (num_nodes - 1) + (
+        f"[{num_nodes}] link 'a'"
+    )
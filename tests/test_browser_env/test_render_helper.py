@@ -0,0 +1,234 @@
+import io
+import json
+import pickle
+from pathlib import Path
+from typing import Any, Callable, cast
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from browser_env import Trajectory, release_states
+from browser_env.actions import create_id_based_action
+from browser_env.helper_functions import RenderHelper
+from browser_env.utils import DetachedPage, Screenshot, StateInfo
+
+
+def render_steps(
+    tmp_path: Path,
+    make_state_info: Callable[[int], StateInfo],
+    num_steps: int,
+    screenshot_format: str,
+) -> str:
+    config_file = tmp_path / "0.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 0, "intent": "find the page"}, f)
+    render_helper = RenderHelper(
+        str(config_file),
+        str(tmp_path),
+        "id_accessibility_tree",
+        screenshot_format,
+    )
+    for step in range(num_steps):
+        action = create_id_based_action("click [5]")
+        action["raw_prediction"] = "click [5]"
+        render_helper.render(
+            action,
+            make_state_info(step),
+            {"action_history": ["None"]},
+            render_screenshot=True,
+        )
+    render_helper.close()
+    # closing twice is a no-op
+    render_helper.close()
+    with open(tmp_path / "render_0.html") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("screenshot_format", ["inline", "webp", "jpeg"])
+def test_render_helper(
+    tmp_path: Path,
+    screenshot_format: str,
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    html = render_steps(tmp_path, make_state_info, 3, screenshot_format)
+    assert html.count("<body>") == html.count("</body>") == 1
+    assert html.strip().endswith("</html>")
+    assert "intent: find the page" in html
+    # the steps in order, each one with its screenshot
+    positions = [html.index(f"http://page/{step}") for step in range(3)]
+    assert positions == sorted(positions)
+    assert html.count("<img src=") == 3
+    side_files = sorted((tmp_path / "render_0").glob("step_*"))
+    if screenshot_format == "inline":
+        assert "data:image/png;base64," in html
+        assert not side_files
+    else:
+        assert len(side_files) == 3
+        assert "render_0/step_2." in html
+
+
+def test_render_error(
+    tmp_path: Path, make_state_info: Callable[[int], StateInfo]
+) -> None:
+    config_file = tmp_path / "0.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 0}, f)
+    render_helper = RenderHelper(
+        str(config_file), str(tmp_path), "id_accessibility_tree", "png"
+    )
+    state_info = make_state_info(0)
+    # not an image
+    state_info["observation"]["image"] = "image"  # type: ignore[typeddict-item]
+    action = create_id_based_action("click [5]")
+    action["raw_prediction"] = "click [5]"
+    render_helper.render(
+        action,
+        state_info,
+        {"action_history": ["None"]},
+        render_screenshot=True,
+    )
+    with pytest.raises(RuntimeError):
+        render_helper.close()
+
+
+class ScreenshotPage:
+    """Only takes screenshots"""
+
+    def __init__(self) -> None:
+        self.num_screenshots = 0
+
+    def screenshot(self, type: str = "png", quality: int = 80) -> bytes:
+        self.num_screenshots += 1
+        byte_io = io.BytesIO()
+        image = Image.new("RGB", (128, 72), (self.num_screenshots, 0, 0))
+        image.save(byte_io, format=type.upper())
+        return byte_io.getvalue()
+
+
+def test_lazy_screenshot(
+    tmp_path: Path, make_state_info: Callable[[int], StateInfo]
+) -> None:
+    page = ScreenshotPage()
+    screenshot = Screenshot(page)  # type: ignore[arg-type]
+    # nothing is taken until a consumer asks
+    assert page.num_screenshots == 0
+    state_info = make_state_info(0)
+    state_info["observation"]["image"] = screenshot
+    config_file = tmp_path / "0.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 0}, f)
+    render_helper = RenderHelper(
+        str(config_file), str(tmp_path), "id_accessibility_tree", "png"
+    )
+    action = create_id_based_action("click [5]")
+    action["raw_prediction"] = "click [5]"
+    render_helper.render(
+        action,
+        state_info,
+        {"action_history": ["None"]},
+        render_screenshot=False,
+    )
+    assert page.num_screenshots == 0
+    render_helper.render(
+        action,
+        state_info,
+        {"action_history": ["None"]},
+        render_screenshot=True,
+    )
+    render_helper.close()
+    # taken once, written as captured, never decoded
+    assert page.num_screenshots == 1
+    assert screenshot._array is None
+    with open(tmp_path / "render_0" / "step_0.png", "rb") as f:
+        assert f.read() == screenshot.data
+    assert screenshot.array.shape == (72, 128, 3)
+    assert screenshot.array is screenshot.array
+
+    # the page changed since
+    expired = Screenshot(page)  # type: ignore[arg-type]
+    expired.expire()
+    with pytest.raises(RuntimeError):
+        expired.capture()
+
+    disabled = Screenshot(None)
+    assert disabled.capture() is None
+    with pytest.raises(ValueError):
+        disabled.array
+
+    scaled = Screenshot(page, "jpeg", quality=50, scale=0.5)  # type: ignore[arg-type]
+    assert scaled.array.shape == (36, 64, 3)
+
+
+class ContentPage:
+    """Only serves its html"""
+
+    url = "http://page/0"
+
+    def __init__(self) -> None:
+        self.num_fetches = 0
+
+    def content(self) -> str:
+        self.num_fetches += 1
+        return "<html>page</html>"
+
+
+def test_lazy_page_content() -> None:
+    page = ContentPage()
+    detached = DetachedPage(page.url, page=page)  # type: ignore[arg-type]
+    # nothing is fetched until a consumer asks
+    assert detached.url == "http://page/0"
+    assert page.num_fetches == 0
+    assert detached.content == "<html>page</html>"
+    assert detached.content == "<html>page</html>"
+    assert page.num_fetches == 1
+
+    # the fetched html survives the pickling, not the page
+    unpickled = pickle.loads(pickle.dumps(detached))
+    assert unpickled == detached
+    assert unpickled.page is None
+
+    # the page changed since
+    expired = DetachedPage(page.url, page=page)  # type: ignore[arg-type]
+    expired.expire()
+    with pytest.raises(RuntimeError):
+        expired.content
+    # fetched before the page changed
+    detached.expire()
+    assert detached.content == "<html>page</html>"
+
+    detached.release()
+    assert detached.content == ""
+    assert detached.url == "http://page/0"
+
+
+def test_release_states(
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    action = create_id_based_action("click [5]")
+    trajectory: Trajectory = []
+    for step in range(4):
+        state_info = make_state_info(step)
+        state_info["info"]["page"] = DetachedPage(
+            f"http://page/{step}", "<html>page</html>"
+        )
+        trajectory += [state_info, action]
+    trajectory.pop()
+
+    states = cast(list[StateInfo], trajectory[0::2])
+    release_states(trajectory, 0)
+    assert all(state["info"]["page"].content for state in states)
+
+    release_states(trajectory, 2)
+    for state in states[:2]:
+        assert state["info"]["page"].content == ""
+        image = state["observation"]["image"]
+        assert isinstance(image, Screenshot) and not image.enabled
+    for state in states[2:]:
+        assert state["info"]["page"].content == "<html>page</html>"
+        assert isinstance(state["observation"]["image"], np.ndarray)
+    # the urls and the text observations are kept
+    assert [state["info"]["page"].url for state in states] == [
+        f"http://page/{step}" for step in range(4)
+    ]
+    assert states[0]["observation"]["text"] == "[5] link 'Page 0'"
@@ -0,0 +1,127 @@
+import copy
+import os
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from browser_env.processors import TextObervationProcessor
+from browser_env.replay import (
+    ObservationSnapshot,
+    SnapshotRecorder,
+    iter_corpus,
+    make_synthetic_snapshot,
+    replay_snapshot,
+)
+
+VIEWPORT_SIZE = {"width": 1280, "height": 720}
+
+
+def load_snapshots() -> list[Any]:
+    """A synthetic page, plus the recorded corpus in $SNAPSHOT_CORPUS_DIR"""
+    snapshots = [
+        pytest.param(make_synthetic_snapshot(5000), id="synthetic_5000")
+    ]
+    corpus_dir = os.environ.get("SNAPSHOT_CORPUS_DIR")
+    if corpus_dir:
+        for path, snapshot in iter_corpus(corpus_dir):
+            if snapshot["accessibility_tree"] is not None:
+                snapshots.append(
+                    pytest.param(snapshot, id=os.path.basename(path))
+                )
+    return snapshots
+
+
+SNAPSHOTS = load_snapshots()
+
+
+def make_processor(
+    current_viewport_only: bool = True,
+) -> TextObervationProcessor:
+    return TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only,
+        VIEWPORT_SIZE,  # type: ignore[arg-type]
+    )
+
+
+def test_record_and_replay(tmp_path: Path) -> None:
+    snapshot = make_synthetic_snapshot(500)
+    original = copy.deepcopy(snapshot)
+    content = replay_snapshot(make_processor(), snapshot)
+    assert snapshot == original
+    assert content.startswith(snapshot["tab_title_str"])
+
+    recorder = SnapshotRecorder(tmp_path)
+    recorder.start_episode("42")
+    recorder.record(snapshot)
+    recorder.record(make_synthetic_snapshot(100, seed=1))
+    corpus = list(iter_corpus(tmp_path))
+    assert [os.path.basename(path) for path, _ in corpus] == [
+        "42_0000.json.gz",
+        "42_0001.json.gz",
+    ]
+    assert corpus[0][1] == snapshot
+    assert replay_snapshot(make_processor(), corpus[0][1]) == content
+
+
+@pytest.mark.parametrize("snapshot", SNAPSHOTS)
+def test_benchmark_parse_accessibility_tree(
+    benchmark: Any, snapshot: ObservationSnapshot
+) -> None:
+    processor = make_processor(current_viewport_only=False)
+    info = processor.build_browser_info(
+        snapshot["dom_snapshot"], snapshot["window_metrics"]
+    )
+    accessibility_tree = processor.build_page_accessibility_tree(
+        info, copy.deepcopy(snapshot["accessibility_tree"])  # type: ignore[arg-type]
+    )
+    tree_str, _ = benchmark(
+        processor.parse_accessibility_tree, accessibility_tree
+    )
+    assert tree_str
+
+
+@pytest.mark.parametrize("snapshot", SNAPSHOTS)
+def test_benchmark_viewport_filter(
+    benchmark: Any, snapshot: ObservationSnapshot
+) -> None:
+    processor = make_processor()
+    info = processor.build_browser_info(
+        snapshot["dom_snapshot"], snapshot["window_metrics"]
+    )
+    # the union bounds are joined into the accessibility tree
+    processor.retrieve_viewport_info(info)
+    accessibility_tree = processor.build_page_accessibility_tree(
+        info, copy.deepcopy(snapshot["accessibility_tree"])  # type: ignore[arg-type]
+    )
+
+    def viewport_filter() -> Any:
+        processor.retrieve_viewport_info(info)
+        return processor.current_viewport_accessibility_tree(
+            info, accessibility_tree
+        )
+
+    viewport_tree = benchmark(viewport_filter)
+    assert 0 < len(viewport_tree) <= len(accessibility_tree)
+
+
+@pytest.mark.parametrize("snapshot", SNAPSHOTS)
+def test_benchmark_clean_accesibility_tree(
+    benchmark: Any, snapshot: ObservationSnapshot
+) -> None:
+    processor = make_processor()
+    content = replay_snapshot(processor, snapshot)
+    tree_str = content.split("\n\n", 1)[1]
+    clean_tree_str = benchmark(processor.clean_accesibility_tree, tree_str)
+    # already cleaned
+    assert clean_tree_str == tree_str
+
+
+@pytest.mark.parametrize("snapshot", SNAPSHOTS)
+def test_benchmark_replay_snapshot(
+    benchmark: Any, snapshot: ObservationSnapshot
+) -> None:
+    processor = make_processor()
+    content = benchmark(replay_snapshot, processor, snapshot)
+    assert content.startswith(snapshot["tab_title_str"])
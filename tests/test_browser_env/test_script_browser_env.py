@@ -1,6 +1,7 @@
 import asyncio
 import collections
 import json
+import re
 import tempfile
 from typing import Callable, Dict, Optional, Tuple, Type, Union, cast
 
@@ -28,6 +29,7 @@ from browser_env.env_config import (
     SHOPPING,
     SHOPPING_ADMIN,
 )
+from browser_env.utils import Screenshot
 
 
 def test_script_browser_env(script_browser_env: ScriptBrowserEnv) -> None:
@@ -218,6 +220,43 @@ def test_accessibility_tree(
     assert s1 in obs["text"] and s2 in obs["text"]
 
 
+@pytest.mark.asyncio
+async def test_async_accessibility_tree() -> None:
+    s1 = "checkbox 'Yes'"
+    s2 = "button 'Submit'"
+    env = AsyncScriptBrowserEnv(observation_type="accessibility_tree")
+    await env.areset()
+    obs, success, _, _, info = await env.astep(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    assert success
+    assert s1 in obs["text"] and s2 in obs["text"]
+    assert "Tab 0 (current)" in obs["text"]
+
+    # element id based actions are executed through the text processor
+    element_id = re.search(r"\[(\d+)\] checkbox 'Yes'", obs["text"]).group(1)  # type: ignore
+    _, success, _, _, info = await env.astep(
+        create_id_based_action(f"click [{element_id}]")
+    )
+    assert success, info["fail_error"]
+    await env.aclose()
+
+
+def test_async_env_sync_loop() -> None:
+    env = AsyncScriptBrowserEnv()
+
+    async def running_loop() -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    # the sync methods share one event loop until the env is closed
+    loop = env.run_sync(running_loop())
+    assert env.run_sync(running_loop()) is loop
+    env.close()
+    assert loop.is_closed()
+
+
 def test_accessibility_tree_viewport(
     accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
 ) -> None:
@@ -266,6 +305,95 @@ def test_multiple_start_url(script_browser_env: ScriptBrowserEnv) -> None:
     ].url
 
 
+def test_reuse_browser() -> None:
+    env = ScriptBrowserEnv(reuse_browser=True)
+    env.reset()
+    browser = env.browser
+    first_context = env.context
+    env.step(create_goto_url_action("http://www.example.com"))
+
+    # only the context is renewed between tasks
+    env.reset()
+    assert env.browser is browser
+    assert env.context is not first_context
+    assert len(env.context.pages) == 1
+    assert env.page.url == "about:blank"
+
+    # a crashed browser is relaunched on the next reset
+    browser.close()
+    assert not env.is_browser_healthy()
+    env.reset()
+    assert env.browser is not browser
+    assert env.is_browser_healthy()
+    env.close()
+
+
+def test_settle_strategy() -> None:
+    env = ScriptBrowserEnv(sleep_after_execution=3.0, settle_strategy="hybrid")
+    _, info = env.reset()
+    # a blank page settles well before the upper bound
+    assert 0 <= info["settle_time"] < 3.0
+    _, _, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert 0 <= info["settle_time"] < 3.5
+    env.close()
+
+
+def test_screenshot_mode() -> None:
+    env = ScriptBrowserEnv(screenshot_mode="lazy")
+    obs, _ = env.reset()
+    screenshot = obs["image"]
+    assert isinstance(screenshot, Screenshot)
+    assert screenshot.data is None
+    assert screenshot.array.shape[:2] == (720, 1280)
+    obs, *_ = env.step(create_goto_url_action("http://www.example.com"))
+    # the page of the first observation is gone
+    assert screenshot.expired
+    jpeg_env = ScriptBrowserEnv(
+        screenshot_mode="lazy",
+        screenshot_format="jpeg",
+        screenshot_quality=50,
+        screenshot_scale=0.5,
+    )
+    jpeg_obs, _ = jpeg_env.reset()
+    assert jpeg_obs["image"].array.shape[:2] == (360, 640)  # type: ignore[union-attr]
+    jpeg_env.close()
+    env.close()
+
+    env = ScriptBrowserEnv(screenshot_mode="disabled")
+    obs, _ = env.reset()
+    assert not obs["image"].enabled  # type: ignore[union-attr]
+    env.close()
+
+
+def test_page_content_mode() -> None:
+    env = ScriptBrowserEnv(page_content_mode="lazy")
+    env.reset()
+    _, _, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    page = info["page"]
+    assert page.url == "http://www.example.com/"
+    assert "Example Domain" in page.content
+    _, _, _, _, info = env.step(
+        create_goto_url_action("https://www.rfc-editor.org/rfc/rfc2606.html")
+    )
+    # fetched before the page changed
+    assert page.expired
+    assert "Example Domain" in page.content
+    env.close()
+
+    env = ScriptBrowserEnv(page_content_mode="disabled")
+    env.reset()
+    _, _, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert info["page"].url == "http://www.example.com/"
+    assert info["page"].content == ""
+    env.close()
+
+
 def test_observation_tab_information(
     accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
 ) -> None:
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from playwright.sync_api import Error as PlaywrightError
+
+from browser_env.settle import DOMQuiescenceSettle
+
+
+class NavigatingPage:
+    """Navigates away during the quiescence wait, after `delay` seconds"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.load_timeouts: list[float] = []
+
+    def evaluate(self, expression: str, arg: list[float]) -> None:
+        time.sleep(self.delay)
+        raise PlaywrightError("Execution context was destroyed")
+
+    def wait_for_load_state(self, state: str, timeout: float) -> None:
+        self.load_timeouts.append(timeout)
+
+
+class AsyncNavigatingPage:
+    """Async version of `NavigatingPage`"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.load_timeouts: list[float] = []
+
+    async def evaluate(self, expression: str, arg: list[float]) -> None:
+        await asyncio.sleep(self.delay)
+        raise PlaywrightError("Execution context was destroyed")
+
+    async def wait_for_load_state(self, state: str, timeout: float) -> None:
+        self.load_timeouts.append(timeout)
+
+
+def test_dom_quiescence_fallback_budget() -> None:
+    # the load state fallback only gets what is left of max_wait
+    page = NavigatingPage(0.2)
+    DOMQuiescenceSettle(0.5).wait(page, 0.5)  # type: ignore[arg-type]
+    (timeout,) = page.load_timeouts
+    assert 0 < timeout <= 300
+
+    apage = AsyncNavigatingPage(0.2)
+    settle = DOMQuiescenceSettle(0.5)
+    asyncio.run(settle.await_(apage, 0.5))  # type: ignore[arg-type]
+    (timeout,) = apage.load_timeouts
+    assert 0 < timeout <= 300
+
+    # no budget left, no fallback
+    page = NavigatingPage(0.3)
+    DOMQuiescenceSettle(0.2).wait(page, 0.2)  # type: ignore[arg-type]
+    assert page.load_timeouts == []
@@ -0,0 +1,106 @@
+import pickle
+from typing import Any, Callable, cast
+
+import numpy as np
+from beartype import beartype
+from beartype.door import is_bearable
+
+from browser_env import (
+    Action,
+    BoundedTrajectory,
+    StateInfo,
+    Trajectory,
+    create_id_based_action,
+)
+from browser_env.utils import DetachedPage, Screenshot
+
+
+def make_trajectory(
+    make_state_info: Callable[[int], StateInfo],
+    num_steps: int,
+    **kwargs: Any,
+) -> BoundedTrajectory:
+    trajectory = BoundedTrajectory(**kwargs)
+    for step in range(num_steps):
+        trajectory.append(make_state_info(step))
+        trajectory.append(create_id_based_action("click [5]"))
+    return trajectory
+
+
+@beartype
+def num_states(trajectory: Trajectory) -> int:
+    return len(trajectory[0::2])
+
+
+def test_bounded_trajectory(
+    tmp_path: Any, make_state_info: Callable[[int], StateInfo]
+) -> None:
+    trajectory = make_trajectory(
+        make_state_info, 5, keep_last=2, spill_dir=str(tmp_path)
+    )
+    assert len(trajectory) == 10
+    assert num_states(trajectory) == 5
+    states = cast(list[StateInfo], trajectory[0::2])
+    # the latest states are untouched
+    for step in (3, 4):
+        assert isinstance(states[step]["observation"], dict)
+        assert states[step]["info"]["page"].content == f"<p>{step}</p>"
+    # the older ones are read back from the store
+    for step in range(3):
+        state = states[step]
+        assert not isinstance(state["observation"], dict)
+        assert state["info"]["page"].url == f"http://page/{step}"
+        assert state["info"]["page"].content == f"<p>{step}</p>"
+        assert state["observation"]["text"] == f"[5] link 'Page {step}'"
+        image = state["observation"]["image"]
+        assert isinstance(image, np.ndarray) and (image == step).all()
+        assert "image" in state["observation"]
+        assert is_bearable(state, StateInfo)
+    actions = cast(list[Action], trajectory[1::2])
+    assert actions[-1]["action_type"] == actions[0]["action_type"]
+
+    # a plain list once pickled
+    unpickled = pickle.loads(pickle.dumps(trajectory))
+    assert type(unpickled) is list
+    assert unpickled[0]["observation"]["text"] == "[5] link 'Page 0'"
+    assert unpickled[0]["info"]["page"] == DetachedPage(
+        "http://page/0", "<p>0</p>"
+    )
+    trajectory.close()
+
+
+def test_bounded_trajectory_release(
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    trajectory = make_trajectory(make_state_info, 3, spill=False)
+    states = cast(list[StateInfo], trajectory[0::2])
+    for state in states[:2]:
+        assert state["info"]["page"].content == ""
+        assert isinstance(state["observation"]["image"], Screenshot)
+        text = state["observation"]["text"]
+        assert isinstance(text, str) and text.startswith("[5] link")
+    assert states[2]["info"]["page"].content == "<p>2</p>"
+    assert trajectory.store.file is None
+
+
+def test_bounded_trajectory_pop(
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    trajectory = make_trajectory(make_state_info, 2)
+    trajectory.pop()
+    trajectory.pop()
+    trajectory += [make_state_info(2), create_id_based_action("stop [2]")]
+    assert trajectory.state_indices == [0, 2]
+    states = cast(list[StateInfo], trajectory[0::2])
+    assert states[1]["info"]["page"].url == "http://page/2"
+    # the first state is spilled once
+    assert states[0]["info"]["page"].content == "<p>0</p>"
+    assert isinstance(states[1]["observation"], dict)
+
+
+def test_screenshot_pickle() -> None:
+    screenshot = Screenshot(None)
+    screenshot.data = b"png"
+    unpickled = pickle.loads(pickle.dumps(screenshot))
+    assert unpickled.capture() == b"png"
+    assert unpickled.expired
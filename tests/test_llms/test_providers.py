@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable
+
+import aiolimiter
+import openai
+import pytest
+
+from llms import lm_config
+from llms.providers import PROVIDERS, get_provider
+from llms.providers.mock_utils import (
+    MOCK_RESPONSES,
+    MockLLM,
+    make_mock_server,
+)
+from llms.providers.openai_utils import (
+    generate_from_openai_chat_completion,
+    generate_from_openai_stream,
+    generate_n_from_openai,
+)
+
+MESSAGES = [{"role": "user", "content": "What is next?"}]
+
+
+def make_lm_config(**gen_config: Any) -> lm_config.LMConfig:
+    return lm_config.LMConfig(
+        provider="mock",
+        model="gpt-3.5-turbo",
+        mode="chat",
+        gen_config={"mock_latency": 0.0, **gen_config},
+    )
+
+
+def test_registry() -> None:
+    assert {"openai", "mock"} <= set(PROVIDERS)
+    assert get_provider("mock").name == "mock"
+    with pytest.raises(NotImplementedError):
+        get_provider("unknown")
+
+
+def test_mock_provider() -> None:
+    provider = get_provider("mock")
+    config = make_lm_config(mock_latency=0.1, mock_tokens_per_second=0)
+    start = time.perf_counter()
+    responses = [provider.generate(config, MESSAGES) for _ in range(3)]
+    assert time.perf_counter() - start >= 0.3
+    assert responses == [
+        MOCK_RESPONSES[0],
+        MOCK_RESPONSES[1],
+        MOCK_RESPONSES[0],
+    ]
+
+
+def test_mock_provider_async() -> None:
+    provider = get_provider("mock")
+    config = make_lm_config(mock_latency=0.2, mock_tokens_per_second=0)
+
+    async def generate_all() -> list[str]:
+        limiter = aiolimiter.AsyncLimiter(100)
+        return await asyncio.gather(
+            *[provider.agenerate(config, MESSAGES, limiter) for _ in range(5)]
+        )
+
+    start = time.perf_counter()
+    responses = asyncio.run(generate_all())
+    # the calls wait concurrently
+    assert time.perf_counter() - start < 0.2 * 5
+    assert len(responses) == 5 and all(responses)
+
+
+def test_mock_timing_and_errors() -> None:
+    mock = MockLLM(latency=0.5, tokens_per_second=10.0, responses=["x" * 39])
+    _, duration = mock.next_response()
+    assert duration == pytest.approx(0.5 + 1.0)
+
+    mock = MockLLM(error_rate=1.0)
+    with pytest.raises(openai.error.RateLimitError):
+        mock.next_response()
+
+
+def test_mock_server(monkeypatch: pytest.MonkeyPatch) -> None:
+    server = make_mock_server(MockLLM(latency=0.0, tokens_per_second=0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        assert isinstance(host, str)
+        monkeypatch.setattr(openai, "api_base", f"http://{host}:{port}/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "mock")
+        answer = generate_from_openai_chat_completion(
+            messages=MESSAGES,
+            model="gpt-3.5-turbo",
+            temperature=0.0,
+            max_tokens=16,
+            top_p=1.0,
+            context_length=0,
+        )
+        assert answer == MOCK_RESPONSES[0]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+EARLY_ACTION = "```scroll [down]``` because " + "the page is long " * 100
+
+
+def action_is_complete() -> Callable[[str], bool]:
+    """Stop after the second splitter"""
+    response = ""
+
+    def should_stop(text: str) -> bool:
+        nonlocal response
+        response += text
+        return response.count("```") >= 2
+
+    return should_stop
+
+
+def test_mock_provider_stream() -> None:
+    provider = get_provider("mock")
+    config = make_lm_config(
+        mock_responses=[EARLY_ACTION], mock_tokens_per_second=1000
+    )
+    response = provider.generate_stream(config, MESSAGES, action_is_complete())
+    assert response.startswith("```scroll [down]`")
+    assert len(response) < 32
+
+    async def agenerate() -> str:
+        return await provider.agenerate_stream(
+            config,
+            MESSAGES,
+            aiolimiter.AsyncLimiter(100),
+            action_is_complete(),
+        )
+
+    assert asyncio.run(agenerate()) == response
+
+
+def test_mock_server_stream(monkeypatch: pytest.MonkeyPatch) -> None:
+    mock = MockLLM(
+        latency=0.0, tokens_per_second=1000, responses=[EARLY_ACTION]
+    )
+    server = make_mock_server(mock)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        assert isinstance(host, str)
+        monkeypatch.setattr(openai, "api_base", f"http://{host}:{port}/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "mock")
+        response = generate_from_openai_stream(
+            "chat",
+            action_is_complete(),
+            model="gpt-3.5-turbo",
+            messages=MESSAGES,
+            temperature=0.0,
+            max_tokens=16,
+            top_p=1.0,
+        )
+        assert response.startswith("```scroll [down]`")
+        assert len(response) < 32
+        # the server stops generating once the client is gone
+        for _ in range(100):
+            if mock.num_cancelled:
+                break
+            time.sleep(0.05)
+        assert mock.num_cancelled == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_mock_server_samples(monkeypatch: pytest.MonkeyPatch) -> None:
+    mock = MockLLM(latency=0.0, tokens_per_second=0)
+    server = make_mock_server(mock)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        assert isinstance(host, str)
+        monkeypatch.setattr(openai, "api_base", f"http://{host}:{port}/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "mock")
+        responses = generate_n_from_openai(
+            "chat",
+            3,
+            model="gpt-3.5-turbo",
+            messages=MESSAGES,
+            temperature=1.0,
+            max_tokens=16,
+            top_p=1.0,
+        )
+        assert responses == [
+            MOCK_RESPONSES[0],
+            MOCK_RESPONSES[1],
+            MOCK_RESPONSES[0],
+        ]
+        assert mock.num_calls == 1
+    finally:
+        server.shutdown()
+        server.server_close()
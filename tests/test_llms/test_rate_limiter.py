@@ -0,0 +1,111 @@
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Any
+
+import openai
+import pytest
+import tiktoken
+
+from llms.providers import openai_utils, rate_limiter
+from llms.providers.rate_limiter import TokenBucketLimiter
+
+
+def test_token_bucket(tmp_path: Path) -> None:
+    limiter = TokenBucketLimiter(
+        tmp_path / "limit.json", requests_per_minute=60, tokens_per_minute=600
+    )
+    # a full bucket holds one minute of quota
+    assert limiter.try_acquire(300) == 0.0
+    assert limiter.try_acquire(300) == 0.0
+    # 100 tokens refill in 10 seconds
+    assert limiter.try_acquire(100) == pytest.approx(10, abs=0.1)
+    # larger than the bucket, waits for a full bucket
+    assert limiter.try_acquire(10_000) == pytest.approx(60, abs=0.1)
+
+    limiter.drain()
+    assert limiter.try_acquire(0) == pytest.approx(1, abs=0.1)
+
+    # zero disables a bucket
+    limiter = TokenBucketLimiter(tmp_path / "no_limit.json")
+    for _ in range(100):
+        assert limiter.try_acquire(10_000) == 0.0
+
+
+def acquire_requests(path: Path, num_requests: int) -> None:
+    limiter = TokenBucketLimiter(path, requests_per_minute=600)
+    for _ in range(num_requests):
+        limiter.acquire()
+
+
+def test_shared_across_processes(tmp_path: Path) -> None:
+    path = tmp_path / "limit.json"
+    TokenBucketLimiter(path, requests_per_minute=600).drain()
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=acquire_requests, args=(path, 5)) for _ in range(3)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    # 15 requests at 10 requests per second from an empty bucket
+    assert time.perf_counter() - start >= 1.4
+
+
+def test_rate_limited_create(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    tokenizer: tiktoken.core.Encoding,
+) -> None:
+    monkeypatch.setattr(rate_limiter, "get_encoding", lambda model: tokenizer)
+    limiter = TokenBucketLimiter(tmp_path / "limit.json", tokens_per_minute=60)
+    rate_limiter.set_rate_limiter(limiter)
+
+    def create(**kwargs: Any) -> str:
+        raise openai.error.RateLimitError(  # type: ignore[no-untyped-call]
+            "rate limit"
+        )
+
+    try:
+        answer = openai_utils.rate_limited_create(
+            lambda **kwargs: "answer",
+            "0123456789",
+            model="gpt-3.5-turbo",
+            max_tokens=10,
+        )
+        assert answer == "answer"
+        # 10 prompt tokens and 10 completion tokens
+        assert limiter.read_state(time.time())["tokens"] == pytest.approx(
+            40, abs=0.1
+        )
+        with pytest.raises(openai.error.RateLimitError):
+            openai_utils.rate_limited_create(
+                create, "0", model="gpt-3.5-turbo", max_tokens=1
+            )
+        # every process backs off
+        assert limiter.read_state(time.time())["tokens"] == pytest.approx(
+            0, abs=0.1
+        )
+    finally:
+        rate_limiter.set_rate_limiter(None)
+
+
+def test_backoff_is_capped(monkeypatch: pytest.MonkeyPatch) -> None:
+    delays: list[float] = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+
+    @openai_utils.retry_with_exponential_backoff
+    def generate() -> str:
+        if len(delays) < 9:
+            raise openai.error.RateLimitError(  # type: ignore[no-untyped-call]
+                "rate limit"
+            )
+        return "answer"
+
+    assert generate() == "answer"
+    assert len(delays) == 9
+    assert max(delays) <= 60
+    assert delays[-1] >= 30
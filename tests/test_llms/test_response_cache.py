@@ -0,0 +1,157 @@
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+from llms.providers import openai_utils
+from llms.providers.response_cache import (
+    ResponseCache,
+    set_response_cache,
+)
+
+
+def make_request(idx: int) -> dict[str, object]:
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": f"question {idx}"}],
+        "temperature": 0.0,
+        "max_tokens": 16,
+        "top_p": 1.0,
+        "stop_token": None,
+    }
+
+
+def test_read_write(tmp_path: Path) -> None:
+    cache = ResponseCache(tmp_path / "cache.db")
+    assert cache.get("chat", make_request(0)) is None
+    cache.put("chat", make_request(0), "answer 0")
+    assert cache.get("chat", make_request(0)) == "answer 0"
+    # the api and the sampling parameters are part of the key
+    assert cache.get("completion", make_request(0)) is None
+    assert cache.get("chat", {**make_request(0), "temperature": 1.0}) is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 3,
+        "writes": 1,
+        "evictions": 0,
+    }
+
+    # shared with a new connection
+    assert ResponseCache(tmp_path / "cache.db", mode="read").get(
+        "chat", make_request(0)
+    ) == ("answer 0")
+
+
+def test_modes(tmp_path: Path) -> None:
+    ResponseCache(tmp_path / "cache.db").put("chat", make_request(0), "old")
+    cache = ResponseCache(tmp_path / "cache.db", mode="read")
+    cache.put("chat", make_request(1), "ignored")
+    assert cache.get("chat", make_request(1)) is None
+
+    cache = ResponseCache(tmp_path / "cache.db", mode="write")
+    assert cache.get("chat", make_request(0)) is None
+    cache.put("chat", make_request(0), "new")
+    cache = ResponseCache(tmp_path / "cache.db", mode="read")
+    assert cache.get("chat", make_request(0)) == "new"
+
+    with pytest.raises(ValueError):
+        ResponseCache(tmp_path / "cache.db", mode="unknown")
+
+
+def test_lru_eviction(tmp_path: Path) -> None:
+    cache = ResponseCache(tmp_path / "cache.db", max_entries=3)
+    for idx in range(3):
+        cache.put("chat", make_request(idx), f"answer {idx}")
+    # 0 is now more recent than 1
+    assert cache.get("chat", make_request(0)) == "answer 0"
+    cache.put("chat", make_request(3), "answer 3")
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert cache.get("chat", make_request(1)) is None
+    assert cache.get("chat", make_request(0)) == "answer 0"
+
+
+def put_answers(path: Path, start: int) -> None:
+    cache = ResponseCache(path)
+    for idx in range(start, start + 50):
+        cache.put("chat", make_request(idx), f"answer {idx}")
+        assert cache.get("chat", make_request(idx)) == f"answer {idx}"
+
+
+def test_concurrent_workers(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=put_answers, args=(path, start))
+        for start in [0, 50, 100, 150]
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert len(ResponseCache(path)) == 200
+
+
+def test_generate_from_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # a cached answer does not need the API
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    cache = ResponseCache(tmp_path / "cache.db")
+    cache.put("chat", make_request(0), "answer 0")
+    set_response_cache(cache)
+    try:
+        answer = openai_utils.generate_from_openai_chat_completion(
+            messages=make_request(0)["messages"],
+            model="gpt-3.5-turbo",
+            temperature=0.0,
+            max_tokens=16,
+            top_p=1.0,
+            context_length=0,
+        )
+        assert answer == "answer 0"
+        with pytest.raises(ValueError):
+            openai_utils.generate_from_openai_chat_completion(
+                messages=make_request(1)["messages"],
+                model="gpt-3.5-turbo",
+                temperature=0.0,
+                max_tokens=16,
+                top_p=1.0,
+                context_length=0,
+            )
+    finally:
+        set_response_cache(None)
+
+
+def test_sampled_requests_bypass_the_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    request: dict[str, object] = {**make_request(0), "temperature": 1.0}
+    cache = ResponseCache(tmp_path / "cache.db")
+    cache.put("chat", request, "answer 0")
+    set_response_cache(cache)
+    try:
+        # a stored sample is not replayed, the API is called
+        with pytest.raises(ValueError):
+            openai_utils.generate_from_openai_chat_completion(
+                messages=request["messages"],
+                model="gpt-3.5-turbo",
+                temperature=1.0,
+                max_tokens=16,
+                top_p=1.0,
+                context_length=0,
+            )
+        samples = iter(["sample 0", "sample 1"])
+        for expected in ["sample 0", "sample 1"]:
+            answer = openai_utils.cached_generate(
+                "chat",
+                {**make_request(1), "temperature": 1.0},
+                samples.__next__,
+            )
+            assert answer == expected
+        assert cache.stats()["hits"] == 0
+        assert len(cache) == 1
+    finally:
+        set_response_cache(None)
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable
+
+import aiolimiter
+import pytest
+
+import run
+from agent import PromptAgent, TeacherForcingAgent
+from browser_env import (
+    Action,
+    BoundedTrajectory,
+    StateInfo,
+    Trajectory,
+    create_id_based_action,
+)
+from browser_env.helper_functions import RenderHelper
+from llms.providers.rate_limiter import (
+    get_rate_limiter,
+    set_rate_limiter,
+)
+
+config_file_folder = "tests/test_evaluation_harness/configs"
+
+FORM_PAGE = """<html><body>
+<label for="name">Full name</label><input id="name" type="text">
+</body></html>"""
+
+
+class ReferenceAgent(PromptAgent):
+    """Replays the reference actions of the task config, without an LLM"""
+
+    def __init__(self) -> None:
+        self.teacher = TeacherForcingAgent()
+        self.action_set_tag = "playwright"
+        # the playwright actions are described without the prompt
+        self.prompt_constructor = None  # type: ignore[assignment]
+
+    def reset(self, test_config_file: str) -> None:
+        self.teacher.reset(test_config_file)
+
+    def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
+    ) -> Action:
+        return self.teacher.next_action(trajectory, intent, meta_data)
+
+    async def anext_action(
+        self,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> Action:
+        return self.next_action(trajectory, intent, meta_data)
+
+
+def make_args(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, *argv: str
+) -> argparse.Namespace:
+    monkeypatch.setattr(
+        sys, "argv", ["run.py", "--result_dir", str(tmp_path), *argv]
+    )
+    args = run.config()
+    args.render_screenshot = False
+    return args
+
+
+def make_form_config(tmp_path: Path) -> str:
+    """A task typing in a form without submitting it, evaluated on the
+    value left in the form"""
+    page = tmp_path / "form.html"
+    page.write_text(FORM_PAGE)
+    config = {
+        "sites": [],
+        "task_id": 0,
+        "require_login": False,
+        "storage_state": None,
+        "start_url": page.as_uri(),
+        "geolocation": None,
+        "intent": "Type UNIQUE_NAME as the full name",
+        "reference_action_sequence": {
+            "action_set_tag": "playwright",
+            "action_sequence": [
+                'page.get_by_label("Full name").fill("UNIQUE_NAME")',
+                "page.stop()",
+            ],
+        },
+        "eval": {
+            "eval_types": ["program_html"],
+            "reference_answers": [],
+            "reference_url": "",
+            "program_html": [
+                {
+                    "url": "last",
+                    "required_contents": "UNIQUE_NAME",
+                    "locator": "document.querySelector('#name').value",
+                }
+            ],
+        },
+    }
+    config_file = tmp_path / "0.json"
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+    return str(config_file)
+
+
+def test_is_answer_evaluated() -> None:
+    assert run.is_answer_evaluated(f"{config_file_folder}/string_match.json")
+    for name in ["url_exact_match", "html_content_exact_match"]:
+        assert not run.is_answer_evaluated(f"{config_file_folder}/{name}.json")
+
+
+def test_atest_refuses_live_page_tasks(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    args = make_args(monkeypatch, tmp_path, "--async_tasks", "1")
+    config_file = make_form_config(tmp_path)
+    with pytest.raises(ValueError):
+        asyncio.run(run.atest(args, ReferenceAgent(), [config_file]))
+
+
+def test_runners_agree_on_program_html(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    args = make_args(
+        monkeypatch,
+        tmp_path,
+        "--action_set_tag",
+        "playwright",
+        "--async_tasks",
+        "1",
+    )
+    config_file = make_form_config(tmp_path)
+    agent = ReferenceAgent()
+    # the typed name is only in the page, it was never submitted
+    assert run.test(args, agent, [config_file]) == [1.0]
+    assert run.run_async(args, agent, [config_file]) == [1.0]
+
+
+def test_rate_limiter_is_opt_in(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    args = make_args(monkeypatch, tmp_path)
+    run.setup_rate_limiter(args)
+    assert get_rate_limiter() is None
+
+    args.rate_limit_file = str(tmp_path / "limit.json")
+    args.provider = "mock"
+    run.setup_rate_limiter(args)
+    assert get_rate_limiter() is None
+
+    args.provider = "openai"
+    run.setup_rate_limiter(args)
+    limiter = get_rate_limiter()
+    assert limiter is not None
+    assert limiter.capacity["requests"] == run.DEFAULT_REQUESTS_PER_MINUTE
+    set_rate_limiter(None)
+
+
+def test_finish_task_closes_the_spill_file(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    args = make_args(monkeypatch, tmp_path, "--spill_dir", str(spill_dir))
+    trajectory = run.create_trajectory(args)
+    assert isinstance(trajectory, BoundedTrajectory)
+    for step in range(3):
+        trajectory.append(make_state_info(step))
+        trajectory.append(create_id_based_action("click [5]"))
+    spill_file = trajectory.store.file
+    assert spill_file is not None
+
+    run.finish_task(
+        args,
+        TeacherForcingAgent(),
+        None,
+        f"{config_file_folder}/string_match.json",
+        trajectory,
+        {"action_history": ["None"]},
+        1.0,
+    )
+    assert spill_file.closed
+    assert trajectory.store.file is None
+    assert os.listdir(spill_dir) == []
+
+
+def test_close_render_logs_the_writer_error(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    make_state_info: Callable[[int], StateInfo],
+) -> None:
+    args = make_args(monkeypatch, tmp_path)
+    config_file = f"{config_file_folder}/string_match.json"
+    render_helper = RenderHelper(
+        config_file, str(tmp_path), "id_accessibility_tree", "png"
+    )
+    state_info = make_state_info(0)
+    # not an image, the background encoding fails
+    state_info["observation"]["image"] = "image"  # type: ignore[typeddict-item]
+    action = create_id_based_action("click [5]")
+    action["raw_prediction"] = "click [5]"
+    render_helper.render(
+        action, state_info, {"action_history": ["None"]}, True
+    )
+
+    # the next tasks still run
+    run.close_render(args, config_file, render_helper)
+    assert render_helper.render_file.closed
+    error = (tmp_path / "error.txt").read_text()
+    assert config_file in error
+    assert "RuntimeError: Failed to render" in error